@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import datetime
+import importlib.metadata
+import itertools
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS_FOLDER = pathlib.Path(__file__).resolve().parent
+REPOSITORY = BENCHMARKS_FOLDER.parent
+
+# The models are not installed packages: their project folders are added to
+# the path, as the notebooks do
+for project in (REPOSITORY / 'municipality_level_analysis'
+                / 'municipalities_abm',
+                REPOSITORY / 'farmer_level_analysis' / 'calibrated_abm',
+                REPOSITORY / 'farmer_level_analysis' / 'toy_abm',
+                BENCHMARKS_FOLDER):
+    if str(project) not in sys.path:
+        sys.path.insert(0, str(project))
+
+"""
+Benchmarks of the hot paths of both the families of ABMs, on the synthetic
+datasets of the synthetic_data module:
+    - sbp_construction: SBPAdoption built from the bundle (World included,
+      with the fitted ML models already in memory)
+    - sbp_step: a single step of SBPAdoption
+    - sbp_run_25y: a run of SBPAdoption over 25 years
+    - sbp_ensemble_100: an ensemble of 100 runs from 1996 to 2021
+    - fl_calibrated_construction, fl_toy_construction: FLCalibratedABM and
+      FLToyABM built from their input data already loaded
+    - fl_calibration_sweep: the calibration of the weights of the confidence
+      factor of FLCalibratedABM over a grid, as in the calibration notebook
+Each benchmark is run once untimed (to load the caches and the lazy
+imports) and then timed repeat times, each time on a new setup. The
+results, with the machine, the versions of the libraries and the parameters,
+are written as JSON and compared with a stored baseline: a benchmark whose
+median time is more than tolerance slower than in the baseline is reported
+as a regression and the script exits with status 1.
+
+Run from the root of the repository as:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --only sbp_step sbp_run_25y
+    python benchmarks/run_benchmarks.py --save-baseline
+
+"""
+
+Benchmark = collections.namedtuple('Benchmark', ['setup', 'run', 'repeat',
+                                                 'description'])
+
+DEFAULT_BASELINE = BENCHMARKS_FOLDER / 'baseline.json'
+DEFAULT_OUT = BENCHMARKS_FOLDER / 'results' / 'latest.json'
+DEFAULT_DATA_FOLDER = BENCHMARKS_FOLDER / 'synthetic_data'
+
+VERSIONED_PACKAGES = ('numpy', 'pandas', 'scipy', 'scikit-learn', 'mesa')
+
+
+class Context:
+    """
+    Class holding the paths of the synthetic data, the options of the
+    benchmarks and the objects shared by their setups, built at the first
+    use.
+
+    """
+
+    def __init__(self, paths, workers, replicates):
+        self.paths = paths
+        self.workers = workers
+        self.replicates = replicates
+        self._world = None
+        self._calibrated_data = None
+        self._toy_data = None
+        self._validation = None
+
+    @property
+    def world(self):
+        if self._world is None:
+            from municipalities_abm.world import World
+
+            self._world = World(bundle=self.paths['bundle'], headless=True)
+        return self._world
+
+    @property
+    def calibrated_data(self):
+        if self._calibrated_data is None:
+            from calibrated_abm import input_data
+
+            self._calibrated_data = input_data.load_input_data(
+                self.paths['calibrated_farmers'],
+                self.paths['calibrated_farms']
+                )
+        return self._calibrated_data
+
+    @property
+    def toy_data(self):
+        if self._toy_data is None:
+            from sbp_toy_abm import input_data
+
+            self._toy_data = input_data.load_input_data(
+                self.paths['toy_farmers'], self.paths['toy_farms']
+                )
+        return self._toy_data
+
+    @property
+    def validation(self):
+        if self._validation is None:
+            import pandas as pd
+
+            self._validation = pd.read_excel(
+                self.paths['calibrated_validation'], index_col=0
+                )['Pasture']
+        return self._validation
+
+
+# Benchmarks of SBPAdoption
+
+def _sbp_construction(context):
+    from municipalities_abm.model import SBPAdoption
+
+    SBPAdoption(bundle=context.paths['bundle'], headless=True, seed=0)
+
+
+def _sbp_model(context):
+    from municipalities_abm.model import SBPAdoption
+
+    return SBPAdoption.from_world(context.world, seed=0, initial_year=1996)
+
+
+def _sbp_run(model, n_years):
+    for _ in range(n_years):
+        model.step()
+
+
+def _sbp_ensemble(context):
+    from municipalities_abm.ensemble import EnsembleRunner
+
+    EnsembleRunner(1996, 2021, workers=context.workers,
+                   replicates=context.replicates,
+                   bundle=context.paths['bundle'], verbose=False).run(100)
+
+
+# Benchmarks of the farmer level models
+
+def _fl_calibrated_construction(context):
+    from calibrated_abm.model import FLCalibratedABM
+
+    FLCalibratedABM(farms_input_data=context.calibrated_data)
+
+
+def _fl_toy_construction(context):
+    from sbp_toy_abm.model import FLToyABM
+
+    FLToyABM(farms_input_data=context.toy_data)
+
+
+def _fl_calibration_sweep(context):
+    """
+    Run FLCalibratedABM for each combination of the weights -1, 0 and 1 of
+    the four features of the confidence factor and return the best F1 score
+    of the pastures at the end of the step (as in the calibration notebook).
+
+    """
+    from sklearn.metrics import f1_score
+
+    from calibrated_abm.model import FLCalibratedABM
+
+    best_f1 = 0.
+    for weights in itertools.product((-1., 0., 1.), repeat=4):
+        model = FLCalibratedABM(cf_weights=weights,
+                                farms_input_data=context.calibrated_data)
+        model.step()
+        predicted = [agent.farm.pasture_type.type
+                     for agent in model.schedule.agents]
+        best_f1 = max(best_f1, f1_score(context.validation, predicted,
+                                        pos_label='Sown Permanent Pasture'))
+    return best_f1
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('sbp_construction', Benchmark(
+        lambda context: context, _sbp_construction, 5,
+        'SBPAdoption built from the synthetic bundle'
+        )),
+    ('sbp_step', Benchmark(
+        _sbp_model, lambda model: _sbp_run(model, 1), 20,
+        'Single step of SBPAdoption'
+        )),
+    ('sbp_run_25y', Benchmark(
+        _sbp_model, lambda model: _sbp_run(model, 25), 5,
+        'Run of SBPAdoption from 1996 to 2020'
+        )),
+    ('sbp_ensemble_100', Benchmark(
+        lambda context: context, _sbp_ensemble, 1,
+        'Ensemble of 100 runs of SBPAdoption from 1996 to 2021'
+        )),
+    ('fl_calibrated_construction', Benchmark(
+        lambda context: context, _fl_calibrated_construction, 20,
+        'FLCalibratedABM built from the loaded input data'
+        )),
+    ('fl_toy_construction', Benchmark(
+        lambda context: context, _fl_toy_construction, 20,
+        'FLToyABM built from the loaded input data'
+        )),
+    ('fl_calibration_sweep', Benchmark(
+        lambda context: context, _fl_calibration_sweep, 3,
+        'Calibration of FLCalibratedABM over 81 combinations of weights'
+        )),
+    ])
+
+
+def time_benchmark(benchmark, context, repeat=None, warmup=True):
+    """
+    Time a benchmark, building a new setup before each repetition.
+
+    Returns
+    -------
+    dict
+        Times of the repetitions and their minimum, median, mean and
+        standard deviation, in seconds
+
+    """
+    repeat = repeat or benchmark.repeat
+    if warmup:
+        benchmark.run(benchmark.setup(context))
+    times = []
+    for _ in range(repeat):
+        state = benchmark.setup(context)
+        start = time.perf_counter()
+        benchmark.run(state)
+        times.append(time.perf_counter() - start)
+    return {'description': benchmark.description,
+            'repeat': repeat,
+            'times': times,
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+            'stdev': statistics.stdev(times) if repeat > 1 else 0.}
+
+
+def _environment():
+    versions = {}
+    for package in VERSIONED_PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                cwd=REPOSITORY, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'machine': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'versions': versions}
+
+
+def run_benchmarks(names, context, parameters, repeat=None, verbose=True):
+    """
+    Run the benchmarks with the names given and return the results.
+
+    """
+    results = {'environment': _environment(),
+               'parameters': parameters,
+               'benchmarks': {}}
+    for name in names:
+        if verbose:
+            print('Running', name, '...', end=' ', flush=True)
+        result = time_benchmark(BENCHMARKS[name], context, repeat)
+        results['benchmarks'][name] = result
+        if verbose:
+            print('median {:.4f} s over {} repetitions'.format(
+                result['median'], result['repeat']
+                ))
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compare the median times of the results with the ones of a baseline.
+
+    Parameters
+    ----------
+    results, baseline : dict
+        Results of run_benchmarks
+    tolerance : float
+        Relative slowdown above which a benchmark is a regression (and
+        relative speedup above which it is an improvement)
+
+    Returns
+    -------
+    rows : list
+        (name, baseline median, median, ratio, status) of each benchmark in
+        both, with status "regression", "improvement" or "ok"
+    regressions : list
+        Names of the benchmarks slower than the baseline
+
+    """
+    rows = []
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        baseline_median = baseline['benchmarks'][name]['median']
+        ratio = result['median'] / baseline_median
+        if ratio > 1 + tolerance:
+            status = 'regression'
+            regressions.append(name)
+        elif ratio < 1 / (1 + tolerance):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, baseline_median, result['median'], ratio, status))
+    return rows, regressions
+
+
+def _write_json(data, path):
+    """
+    Write data as JSON atomically (see municipalities_abm.atomic_files).
+
+    """
+    from municipalities_abm.atomic_files import save_atomically
+
+    save_atomically(path, lambda file: json.dump(data, file, indent=2),
+                    mode='w')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the models on synthetic data.'
+        )
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS), metavar='NAME',
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('--list', action='store_true',
+                        help='List the benchmarks and exit')
+    parser.add_argument('--repeat', type=int, default=None,
+                        help='Timed repetitions of each benchmark (default: '
+                        'the ones of the benchmark)')
+    parser.add_argument('--out', default=DEFAULT_OUT,
+                        help='JSON file where the results are written '
+                        '(default: %(default)s)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='JSON file of the baseline results (default: '
+                        '%(default)s)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Relative slowdown reported as a regression '
+                        '(default: %(default)s)')
+    parser.add_argument('--data-folder', default=DEFAULT_DATA_FOLDER,
+                        help='Folder of the synthetic data (default: '
+                        '%(default)s)')
+    parser.add_argument('--municipalities', type=int, default=278,
+                        help='Synthetic municipalities (default: '
+                        '%(default)s)')
+    parser.add_argument('--farmers', type=int, default=300,
+                        help='Synthetic farmers (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic data (default: '
+                        '%(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes of the ensemble (default: '
+                        '%(default)s)')
+    parser.add_argument('--replicates', type=int, default=10,
+                        help='Runs simulated together by each task of the '
+                        'ensemble (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, benchmark in BENCHMARKS.items():
+            print(name + ':', benchmark.description)
+        return 0
+
+    parameters = {'municipalities': args.municipalities,
+                  'farmers': args.farmers,
+                  'seed': args.seed,
+                  'workers': args.workers,
+                  'replicates': args.replicates}
+    from synthetic_data import ensure_synthetic_data
+
+    paths = ensure_synthetic_data(args.data_folder, args.municipalities,
+                                  args.farmers, args.seed)
+    context = Context(paths, args.workers, args.replicates)
+    results = run_benchmarks(args.only, context, parameters, args.repeat)
+    _write_json(results, args.out)
+    print('Results written to', args.out)
+
+    if args.save_baseline:
+        _write_json(results, args.baseline)
+        print('Baseline written to', args.baseline)
+        return 0
+    try:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        print('No baseline in', args.baseline, '(write one with '
+              '--save-baseline).')
+        return 0
+    if baseline['parameters'] != parameters:
+        print('Warning: the baseline was run with other parameters:',
+              baseline['parameters'])
+
+    rows, regressions = compare(results, baseline, args.tolerance)
+    print()
+    print('{:<28}{:>14}{:>14}{:>10}  {}'.format('Benchmark', 'Baseline [s]',
+                                               'Current [s]', 'Ratio',
+                                               'Status'))
+    for name, baseline_median, median, ratio, status in rows:
+        print('{:<28}{:>14.4f}{:>14.4f}{:>10.2f}  {}'.format(
+            name, baseline_median, median, ratio, status
+            ))
+    if regressions:
+        print()
+        print('Regressions:', ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
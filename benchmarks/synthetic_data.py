@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+"""
+Synthetic datasets of the benchmarks, with the same schema of the real
+inputs of the models:
+    - municipalities/synthetic.sbpb: scenario bundle of the municipalities
+      (see municipalities_abm.synthetic), used with the ML models of the
+      repository
+    - calibrated/FarmersData.xlsx, FarmsData.xlsx and FarmsDataValidation.xlsx:
+      farmers, farms and observed pastures of FLCalibratedABM
+    - toy/FarmersData.xlsx and FarmsData.xlsx: farmers and farms of FLToyABM
+The data are generated from a seed, so every machine benchmarks the same
+data, and written only when missing or generated with other parameters
+(recorded in synthetic_data.json).
+
+"""
+
+PARAMETERS_FILE = 'synthetic_data.json'
+
+EDUCATION_DEGREES = ('Primary', 'Secondary', 'Undergraduate', 'Graduate')
+LEGAL_FORMS = ('Individual', 'Associated')
+PASTURES = ('Natural Pasture', 'Sown Permanent Pasture')
+
+
+def _to_excel(dataframe, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    dataframe.to_excel(path)
+
+
+def write_farmers_data(folder, n_farmers=300, seed=0):
+    """
+    Write the synthetic farmers and farms databases of both the farmer level
+    models in folder.
+
+    """
+    folder = pathlib.Path(folder)
+    rng = np.random.default_rng(seed)
+    ids = pd.Index(['SY{:04d}'.format(n_farmer + 1)
+                    for n_farmer in range(n_farmers)])
+
+    farmers = pd.DataFrame(
+        {'HighestEducationalDegree': rng.choice(EDUCATION_DEGREES, n_farmers)},
+        index=ids.rename('ID')
+        )
+    pastures = rng.choice(PASTURES, n_farmers, p=[0.8, 0.2])
+    farms = pd.DataFrame(
+        {'PastureSurface': np.round(rng.lognormal(5., 1., n_farmers), 2),
+         'PercentRentedLand': np.where(rng.random(n_farmers) < 0.5, 0.,
+                                       np.round(rng.random(n_farmers), 2)),
+         'LegalForm': rng.choice(LEGAL_FORMS, n_farmers, p=[0.7, 0.3]),
+         'Pasture': pastures},
+        index=ids.rename('FARM_ID')
+        )
+    # Observed pastures: some farmers with natural pastures adopted SBP
+    observed = np.where(rng.random(n_farmers) < 0.4, PASTURES[1], pastures)
+    validation = pd.DataFrame({'Pasture': observed},
+                              index=ids.rename('FARM_ID'))
+
+    _to_excel(farmers, folder / 'calibrated' / 'FarmersData.xlsx')
+    _to_excel(farms, folder / 'calibrated' / 'FarmsData.xlsx')
+    _to_excel(validation, folder / 'calibrated' / 'FarmsDataValidation.xlsx')
+    _to_excel(farmers, folder / 'toy' / 'FarmersData.xlsx')
+    _to_excel(farms[['Pasture']], folder / 'toy' / 'FarmsData.xlsx')
+
+
+def data_paths(folder):
+    """
+    Return the paths of the synthetic datasets in folder.
+
+    """
+    folder = pathlib.Path(folder)
+    return {
+        'bundle': folder / 'municipalities' / 'synthetic.sbpb',
+        'calibrated_farmers': folder / 'calibrated' / 'FarmersData.xlsx',
+        'calibrated_farms': folder / 'calibrated' / 'FarmsData.xlsx',
+        'calibrated_validation': (folder / 'calibrated'
+                                  / 'FarmsDataValidation.xlsx'),
+        'toy_farmers': folder / 'toy' / 'FarmersData.xlsx',
+        'toy_farms': folder / 'toy' / 'FarmsData.xlsx',
+        }
+
+
+def ensure_synthetic_data(folder, n_municipalities=278, n_farmers=300,
+                          seed=0, force=False):
+    """
+    Generate the synthetic datasets in folder, unless they are already there
+    with the same parameters.
+
+    Parameters
+    ----------
+    folder : path str
+        Folder of the datasets
+    n_municipalities, n_farmers : int
+        Number of municipalities and of farmers
+    seed : int
+        Seed of the data
+    force : bool
+        If True, the datasets are always generated again
+
+    Returns
+    -------
+    dict
+        Paths of the datasets (see data_paths)
+
+    """
+    from municipalities_abm.synthetic import write_synthetic_bundle
+
+    folder = pathlib.Path(folder)
+    parameters = {'n_municipalities': n_municipalities,
+                  'n_farmers': n_farmers,
+                  'seed': seed}
+    paths = data_paths(folder)
+    parameters_path = folder / PARAMETERS_FILE
+    try:
+        with open(parameters_path) as file:
+            current = json.load(file)
+    except FileNotFoundError:
+        current = None
+    if (not force and current == parameters
+            and all(path.exists() for path in paths.values())):
+        return paths
+
+    folder.mkdir(parents=True, exist_ok=True)
+    write_synthetic_bundle(paths['bundle'], n_municipalities, seed)
+    write_farmers_data(folder, n_farmers, seed)
+    with open(parameters_path, 'w') as file:
+        json.dump(parameters, file, indent=2)
+    return paths
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import os
+
+import pandas as pd
+
+from .model_inputs import farmers_data, farms_data
+
+"""
+Loading, validation and transformation of the farmers and farms databases.
+
+Reading the excel files is by far the most expensive part of the
+instantiation of FLCalibratedABM, and a calibration sweep instantiates the
+model hundreds of times on the same files. The tables are therefore loaded,
+checked and transformed once per version of the files (identified by their
+path, size and modification time) and the same InputData is then given to
+every model.
+
+"""
+
+InputData = collections.namedtuple('InputData', ['farmers_data',
+                                                 'farms_data'])
+InputData.__doc__ = """
+Farmers and farms data, validated and transformed as needed for the
+calculation of the confidence factor. Both dataframes are indexed by the ID
+of the farmer, with the same IDs in the same order.
+The dataframes are shared by all the models using them and must not be
+modified.
+
+"""
+
+# InputData already loaded in this process, mapped by the version of the files
+_loaded_input_data = {}
+
+
+def normalize_data(column):
+    """
+    Method to normalize a column of data.
+
+    Parameters
+    ----------
+    column : pd Series
+        The column of data to be normalized
+
+    Returns
+    -------
+    norm_column : pd.Series
+        The normalized column
+
+    """
+    max_value = column.max()
+    min_value = column.min()
+    return (column - min_value) / (max_value - min_value)
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def _read_database(path, database_name):
+    """
+    Read an excel database, dropping the blank lines and checking that it has
+    no missing values nor multiple rows with the same ID.
+
+    """
+    dataframe = pd.read_excel(path, index_col=0)
+
+    dataframe = dataframe.dropna(how='all')
+    if dataframe.isnull().values.any():
+        raise ValueError('The ' + database_name + ' excel database has some '
+                         'missing values. Please fill in the right values or '
+                         'remove the farmer and the relative farm from the '
+                         'database.')
+
+    ids = dataframe.index
+    duplicated_ids = ids[ids.duplicated()].unique()
+    if not duplicated_ids.empty:
+        raise ValueError('The ' + database_name + ' dataset has multiple rows '
+                         'with the following ID values: '
+                         + ', '.join(map(str, duplicated_ids)))
+    return dataframe
+
+
+def check_same_ids(farmers_dataframe, farms_dataframe):
+    """
+    Check that the farmers and the farms dataframes have exactly the same
+    IDs, raising a ValueError listing the IDs present in only one of them.
+
+    """
+    farmers_id = farmers_dataframe.index
+    farms_id = farms_dataframe.index
+    id_in_farmers_and_not_in_farms = farmers_id.difference(farms_id, sort=False)
+    id_in_farms_and_not_in_farmers = farms_id.difference(farmers_id, sort=False)
+
+    messages = []
+    if not id_in_farmers_and_not_in_farms.empty:
+        messages.append('Rows with the following ID values are in the'
+                        ' farmers dataset but not in the farms one: '
+                        + ', '.join(map(str, id_in_farmers_and_not_in_farms)))
+    if not id_in_farms_and_not_in_farmers.empty:
+        messages.append('Rows with the following ID values are in the'
+                        ' farms dataset but not in the farmers one: '
+                        + ', '.join(map(str, id_in_farms_and_not_in_farmers)))
+    if messages:
+        raise ValueError('\n'.join(messages))
+
+
+def load_input_data(farmers_path=farmers_data, farms_path=farms_data,
+                    use_cache=True):
+    """
+    Load, validate and transform the farmers and farms excel databases.
+
+    Checks:
+        Ignores, if present, blank lines from the excel files
+        Check that the excel files:
+            - Don't have missing values
+            - Don't have multiple rows referring to the same farmer (i.e. with
+              the same ID)
+            - Have exactly the same IDs
+
+    Transformations:
+        Feature HighestEducationalDegree: encodes it ordinally and then
+        normalises it
+        Feature PastureSurface: normalizes it
+        Feature LegalForm: encodes it as 1 if "Individual" or 0 if "Associated"
+        Feature PercentRentedLand: not modified since already normalized
+
+    Parameters
+    ----------
+    farmers_path : path str
+        Path to the excel file with the farmers data
+    farms_path : path str
+        Path to the excel file with the farms data
+    use_cache : bool
+        If True, the data already loaded in this process from the same
+        version of the files are returned without reading them again
+
+    Raises
+    ------
+    ValueError
+        Raised if any of the checks fails
+
+    Returns
+    -------
+    InputData
+
+    """
+    key = (_file_version(farmers_path), _file_version(farms_path))
+    if use_cache and key in _loaded_input_data:
+        return _loaded_input_data[key]
+
+    farmers_dataframe = _read_database(farmers_path, 'farmers')
+    farms_dataframe = _read_database(farms_path, 'farms')
+    check_same_ids(farmers_dataframe, farms_dataframe)
+    farms_dataframe = farms_dataframe.reindex(farmers_dataframe.index)
+
+    education_encoding = {'Primary': 1,
+                          'Secondary': 2,
+                          'Undergraduate': 3,
+                          'Graduate': 4}
+    farmers_dataframe['HighestEducationalDegree'] = normalize_data(
+        farmers_dataframe['HighestEducationalDegree'].replace(
+            education_encoding
+            )
+        )
+
+    farms_dataframe['PastureSurface'] = normalize_data(
+        farms_dataframe['PastureSurface']
+        )
+    legal_form_encoding = {'Individual': 1, 'Associated': 0}
+    farms_dataframe['LegalForm'] = farms_dataframe['LegalForm'].replace(
+        legal_form_encoding
+        )
+
+    input_data = InputData(farmers_dataframe, farms_dataframe)
+    if use_cache:
+        _loaded_input_data[key] = input_data
+    return input_data
+
+
+def clear_input_data_cache():
+    """
+    Remove all the loaded data from the cache.
+
+    """
+    _loaded_input_data.clear()
@@ -1,14 +1,12 @@
 # -*- coding: utf-8 -*-
 
-import pandas as pd
-
 import mesa
 import mesa.time
 import mesa.datacollection
 
 from . import agents
-from .model_inputs import (farmers_data, farms_data, payments, pastures_costs,
-                           weights)
+from . import input_data
+from .model_inputs import payments, pastures_costs, weights
 
 
 
@@ -63,7 +61,8 @@ class FLCalibratedABM(mesa.Model):
                  cf_weights=weights,
                  payments=payments,
                  pastures_costs=pastures_costs,
-                 discount_rate=0.05):
+                 discount_rate=0.05,
+                 farms_input_data=None):
         """
         Initalization of the model.
 
@@ -79,6 +78,10 @@ class FLCalibratedABM(mesa.Model):
             Maps each pasture to its installation and maintenance yearly costs
         discount_rate : float
             Discount rate for economic calculations
+        farms_input_data : input_data.InputData
+            Farmers and farms data already loaded, validated and transformed
+            by input_data.load_input_data. If None, the default excel
+            databases are loaded (only the first time, since they are cached)
         seed : int
             Seed for pseudonumber generation
 
@@ -100,11 +103,13 @@ class FLCalibratedABM(mesa.Model):
         self._initialize_pastures()
 
         # Farmers and farms instantiation
-        self._farmers_data = []
-        self._load_and_transform_farmers_data(farmers_data)
-
-        self._farms_data = []
-        self._load_and_transform_farms_data(farms_data)
+        if farms_input_data is None:
+            farms_input_data = input_data.load_input_data()
+        # The farmers data are shared with the other models and only read,
+        # while the farms data are copied since their pastures are replaced
+        # with the objects of this model
+        self._farmers_data = farms_input_data.farmers_data
+        self._farms_data = farms_input_data.farms_data.copy()
 
         self._replace_strings_with_objects(self._farms_data,
                                            'Pasture',
@@ -149,132 +154,10 @@ class FLCalibratedABM(mesa.Model):
     @staticmethod
     def normalize_data(column):
         """
-        Method to normalize a column of data.
-
-        Parameters
-        ----------
-        column : pd Series
-            The column of data to be normalized
-
-        Returns
-        -------
-        norm_column : pd.Series
-            The normalized column
-
-        """
-        data = column
-        max_value = data.max()
-        min_value = data.min()
-        norm_column = (data - min_value) / (max_value - min_value)
-        return norm_column
-
-    def _load_and_transform_farmers_data(self, farmers_data):
-        """
-        Load the farmers excel database into a pandas dataframe, transform the
-        features as needed for the calculation of the confidence factor and
-        set the attribute self._farmers_data
-
-        Check that the farmers_data excel file doesn't have multiple rows
-        referring to the same farmer (i.e. with the same ID).
-        In case it has, raises a ValueError exception.
-        Also, drops any blank line from the excel file, in case present.
+        Method to normalize a column of data (see input_data.normalize_data).
 
-        Feature HighestEducationalDegree: encodes it ordially and then
-        normalises it.
-
-        """
-        farmers_dataframe = pd.read_excel(farmers_data, index_col=0)
-
-        farmers_dataframe = farmers_dataframe.dropna(how='all')
-        if farmers_dataframe.isnull().values.any():
-            raise ValueError('The farmers excel database has some missing '
-                             'values. Please fill in the right values or '
-                             'remove the farmer and the relative farm from the'
-                             ' database.')
-
-        farmers_id = farmers_dataframe.index
-
-        duplicated_farmers_id = farmers_id[farmers_id.duplicated()].unique()
-        if not duplicated_farmers_id.empty:
-            raise ValueError('The farmers dataset has multiple rows with the '
-                             'following ID values: ' +
-                             ', '.join(duplicated_farmers_id.values))
-
-        education_encoding = {'Primary': 1,
-                              'Secondary': 2,
-                              'Undergraduate': 3,
-                              'Graduate': 4}
-        farmers_dataframe['HighestEducationalDegree'].replace(
-            education_encoding, inplace=True
-            )
-        farmers_dataframe['HighestEducationalDegree'] = self.normalize_data(
-            farmers_dataframe['HighestEducationalDegree']
-            )
-
-        self._farmers_data = farmers_dataframe
-
-    def _load_and_transform_farms_data(self, farms_data):
-        """
-        Load the farms excel database into a pandas dataframe, transform the
-        features as needed for the calculation of the confidence factor and
-        set the attribute self._farms_data
-
-        Checks:
-            Ignores, if present, blank lines from the excel file
-            Check that the farms_data excel file:
-                - Doesn't have multiple rows referring to the same farmer (i.e.
-                  with the same ID).
-                - Has exactly the same indexes (i.e.IDs) as the farmers_data
-                  excel. Otherwise, raises a ValueError exception.
-
-        Feature PastureSurface: normalizes it
-        Feature LegalForm: encodes it as 1 if "Individual" or 0 if "Associated"
-        Feature PercentRentedLand: not modified since already normalized
         """
-        farms_dataframe = pd.read_excel(farms_data, index_col=0)
-
-        farms_dataframe = farms_dataframe.dropna(how='all')
-        if farms_dataframe.isnull().values.any():
-            raise ValueError('The farms excel database has some missing values'
-                             '. Please fill in the right values or remove the '
-                             'farm and the relative farmer from the database.')
-
-        farms_id = farms_dataframe.index
-        duplicated_farms_id = farms_id[farms_id.duplicated()].unique()
-        if not duplicated_farms_id.empty:
-            raise ValueError('The farms dataset has multiple rows with the '
-                             'following ID values: ' +
-                             ', '.join(duplicated_farms_id.values))
-
-        farmers_id = self._farmers_data.index
-        id_in_farmers_and_not_in_farms = [id_ for id_ in farmers_id.values
-                                          if id_ not in farms_id.values]
-        id_in_farms_and_not_in_farmers = [id_ for id_ in farms_id.values
-                                          if id_ not in farmers_id.values]
-        if id_in_farmers_and_not_in_farms and id_in_farms_and_not_in_farmers:
-            raise ValueError('Rows with the following ID values are in the'
-                             ' farmers dataset but not in the farms one: '
-                             + ', '.join(id_in_farmers_and_not_in_farms)
-                             + '\n' + 'Rows with the following ID values '
-                             'are in the farms dataset but not in the '
-                             'farmers one: '
-                             + ', '.join(id_in_farms_and_not_in_farmers))
-        if id_in_farmers_and_not_in_farms:
-            raise ValueError('Rows with the following ID values are in the'
-                             ' farmers dataset but not in the farms one: '
-                             + ', '.join(id_in_farmers_and_not_in_farms))
-        if id_in_farms_and_not_in_farmers:
-            raise ValueError('Rows with the following ID values are in the'
-                             ' farms dataset but not in the farmers one: '
-                             + ', '.join(id_in_farms_and_not_in_farmers))
-
-        farms_dataframe['PastureSurface'] = self.normalize_data(
-            farms_dataframe['PastureSurface']
-            )
-        legal_form_encoding = {'Individual': 1, 'Associated': 0}
-        farms_dataframe['LegalForm'].replace(legal_form_encoding, inplace=True)
-
-        self._farms_data = farms_dataframe
+        return input_data.normalize_data(column)
 
     @staticmethod
     def _replace_strings_with_objects(dataframe, column, mapping):
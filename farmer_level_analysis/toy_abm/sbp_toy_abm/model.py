@@ -1,13 +1,12 @@
 # -*- coding: utf-8 -*-
 
-import pandas as pd
-
 import mesa
 import mesa.time
 import mesa.datacollection
 
 from . import agents
-from .model_inputs import farmers_data, farms_data, payments, pastures_costs
+from . import input_data
+from .model_inputs import payments, pastures_costs
 
 
 def get_percentage_adopted(model):
@@ -56,7 +55,8 @@ class FLToyABM(mesa.Model):
     def __init__(self,
                  payments=payments,
                  pastures_costs=pastures_costs,
-                 discount_rate=0.05):
+                 discount_rate=0.05,
+                 farms_input_data=None):
         """
         Initalization of the model.
 
@@ -68,6 +68,10 @@ class FLToyABM(mesa.Model):
             Maps each pasture to its installation and maintenance yearly costs
         discount_rate : float
             Discount rate for economic calculations
+        farms_input_data : input_data.InputData
+            Farmers and farms data already loaded and validated by
+            input_data.load_input_data. If None, the default excel databases
+            are loaded (only the first time, since they are cached)
         seed : int
             Seed for pseudonumber generation
 
@@ -87,11 +91,13 @@ class FLToyABM(mesa.Model):
         self._initialize_pastures()
 
         # Farmers and farms instantiation
-        self._farmers_data = []
-        self._load_farmers_data(farmers_data)
-
-        self._farms_data = []
-        self._load_farms_data(farms_data)
+        if farms_input_data is None:
+            farms_input_data = input_data.load_input_data()
+        # The farmers data are shared with the other models and only read,
+        # while the farms data are copied since their pastures are replaced
+        # with the objects of this model
+        self._farmers_data = farms_input_data.farmers_data
+        self._farms_data = farms_input_data.farms_data.copy()
 
         self._replace_strings_with_objects(self._farms_data,
                                            'Pasture',
@@ -129,87 +135,6 @@ class FLToyABM(mesa.Model):
     def total_farmers(self, value):
         self._total_farmers = value
 
-    def _load_farmers_data(self, farmers_data):
-        """
-        Load the farmers excel database into a pandas dataframe and set the
-        attribute self._farmers_data
-
-        Check that the farmers_data excel file doesn't have multiple rows
-        referring to the same farmer (i.e. with the same ID).
-        In case it has, raises a ValueError exception.
-        Also, drops any blank line from the excel file, in case present.
-
-        """
-        farmers_dataframe = pd.read_excel(farmers_data, index_col=0)
-
-        farmers_dataframe = farmers_dataframe.dropna(how='all')
-        if farmers_dataframe.isnull().values.any():
-            raise ValueError('The farmers excel database has some missing '
-                             'values. Please fill in the right values or '
-                             'remove the farmer and the relative farm from the'
-                             ' database.')
-
-        farmers_id = farmers_dataframe.index
-
-        duplicated_farmers_id = farmers_id[farmers_id.duplicated()].unique()
-        if not duplicated_farmers_id.empty:
-            raise ValueError('The farmers dataset has multiple rows with the '
-                             'following ID values: ' +
-                             ', '.join(duplicated_farmers_id.values))
-        self._farmers_data = farmers_dataframe
-
-    def _load_farms_data(self, farms_data):
-        """
-        Convert the farms excel database into a pandas dataframe and check that
-        it respect the requirements.
-
-        Checks:
-            Ignores, if present, blank lines from the excel file
-            Check that the farms_data excel file:
-                - Doesn't have multiple rows referring to the same farmer (i.e.
-                  with the same ID).
-                - Has exactly the same indexes (i.e.IDs) as the farmers_data
-                  excel. Otherwise, raises a ValueError exception.
-
-        """
-        farms_dataframe = pd.read_excel(farms_data, index_col=0)
-
-        farms_dataframe = farms_dataframe.dropna(how='all')
-        if farms_dataframe.isnull().values.any():
-            raise ValueError('The farms excel database has some missing values'
-                             '. Please fill in the right values or remove the '
-                             'farm and the relative farmer from the database.')
-
-        farms_id = farms_dataframe.index
-        duplicated_farms_id = farms_id[farms_id.duplicated()].unique()
-        if not duplicated_farms_id.empty:
-            raise ValueError('The farms dataset has multiple rows with the '
-                             'following ID values: ' +
-                             ', '.join(duplicated_farms_id.values))
-
-        farmers_id = self._farmers_data.index
-        id_in_farmers_and_not_in_farms = [id_ for id_ in farmers_id.values
-                                          if id_ not in farms_id.values]
-        id_in_farms_and_not_in_farmers = [id_ for id_ in farms_id.values
-                                          if id_ not in farmers_id.values]
-        if id_in_farmers_and_not_in_farms and id_in_farms_and_not_in_farmers:
-            raise ValueError('Rows with the following ID values are in the'
-                             ' farmers dataset but not in the farms one: '
-                             + ', '.join(id_in_farmers_and_not_in_farms)
-                             + '\n' + 'Rows with the following ID values '
-                             'are in the farms dataset but not in the '
-                             'farmers one: '
-                             + ', '.join(id_in_farms_and_not_in_farmers))
-        if id_in_farmers_and_not_in_farms:
-            raise ValueError('Rows with the following ID values are in the'
-                             ' farmers dataset but not in the farms one: '
-                             + ', '.join(id_in_farmers_and_not_in_farms))
-        if id_in_farms_and_not_in_farmers:
-            raise ValueError('Rows with the following ID values are in the'
-                             ' farms dataset but not in the farmers one: '
-                             + ', '.join(id_in_farms_and_not_in_farmers))
-        self._farms_data = farms_dataframe
-
     @staticmethod
     def _replace_strings_with_objects(dataframe, column, mapping):
         """
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from municipalities_abm import validation
+from municipalities_abm.ensemble import EnsembleResults, run_single
+from municipalities_abm.model import SBPAdoption
+from municipalities_abm.policy_schedule import PolicySchedule
+from municipalities_abm.replicates import ReplicateEngine
+from municipalities_abm.synthetic import write_synthetic_bundle
+from municipalities_abm.world import World
+
+"""
+Seed-fixed checks of the optimized code paths of the model against the
+reference ones, on small cases. The runs of the model use a synthetic
+bundle of N_MUNICIPALITIES municipalities (see the synthetic module), with
+the ML models of the ml_model folder.
+
+Run from this folder as:
+    python checks.py [check ...]
+Each check raises an AssertionError if it fails. With no arguments, all the
+checks are run.
+
+"""
+
+N_MUNICIPALITIES = 40
+FIRST_YEAR = 1996
+LAST_YEAR = 2005
+SEEDS = (3, 4, 5)
+
+_world = None
+
+
+def synthetic_world():
+    """
+    Return the headless World of a synthetic bundle, written in a temporary
+    folder and built at the first call.
+
+    """
+    global _world
+    if _world is None:
+        folder = tempfile.mkdtemp()
+        bundle = write_synthetic_bundle(folder + '/synthetic.sbpb',
+                                        N_MUNICIPALITIES, seed=0)
+        _world = World(bundle=bundle.path, headless=True)
+    return _world
+
+
+def _run_batched_and_per_agent(seed):
+    """
+    Run the model from FIRST_YEAR to LAST_YEAR with and without batched
+    inference and return the two models.
+
+    """
+    world = synthetic_world()
+    batched, per_agent = (
+        SBPAdoption.from_world(world, seed=seed, initial_year=FIRST_YEAR,
+                               batched_inference=batched_inference)
+        for batched_inference in (True, False)
+        )
+    for _ in range(FIRST_YEAR, LAST_YEAR + 1):
+        batched.step()
+        per_agent.step()
+    return batched, per_agent
+
+
+def check_batched_step():
+    """
+    The batched step of the model gives the same outputs of the step methods
+    of the municipalities.
+
+    """
+    for seed in SEEDS:
+        batched, per_agent = _run_batched_and_per_agent(seed)
+        pd.testing.assert_frame_equal(
+            batched.datacollector.get_model_vars_dataframe(),
+            per_agent.datacollector.get_model_vars_dataframe(),
+            check_exact=True
+            )
+        assert np.array_equal(batched.adoption_state.adoption,
+                              per_agent.adoption_state.adoption)
+
+
+def check_adoption_state():
+    """
+    The adoption state advanced for all the municipalities at once is the
+    same advanced municipality by municipality, and the views of the
+    municipalities read it.
+
+    """
+    for seed in SEEDS:
+        batched, per_agent = _run_batched_and_per_agent(seed)
+        (arrays, scalars), (ref_arrays, ref_scalars) = (
+            model.adoption_state.to_dict() for model in (batched, per_agent)
+            )
+        assert scalars == ref_scalars
+        assert arrays.keys() == ref_arrays.keys()
+        for name, array in arrays.items():
+            assert np.array_equal(array, ref_arrays[name]), name
+
+        state = batched.adoption_state
+        for munic in batched.schedule.agents:
+            for year in range(FIRST_YEAR, LAST_YEAR + 1):
+                col = year - state.first_year
+                assert (munic.yearly_adoption[year]
+                        == state.adoption[munic.index, col])
+                assert (munic.yearly_adoption_ha[year]
+                        == state.adoption[munic.index, col]
+                        * munic.perm_pastures_ha)
+            assert (munic.cumul_adoption_tot
+                    == state.cumul_adoption_tot[munic.index])
+
+
+def _reference_features(model, munic, features, estimator):
+    """
+    Return the features of a municipality in the year of the model built
+    from its attributes, one by one, as the step method of the municipality
+    did before the feature matrix.
+
+    """
+    year = model.year
+    neighbors = [model.mappings.get_municipality(name)
+                 for name in munic.neighbors]
+    attributes = pd.Series(index=features, dtype=float)
+    attributes['adoption_pr_y_munic'] = munic.yearly_adoption[year - 1]
+    attributes['adoption_pr_y_port'] = model.adoption_pr_y_port
+    attributes['adoption_pr_y_neighbours_adj'] = (
+        sum(neigh.yearly_adoption_ha[year - 1] for neigh in neighbors)
+        / munic.neighbors_perm_pastures_ha
+        )
+    attributes['tot_cumul_adoption_pr_y_munic'] = munic.cumul_adoption_tot
+    attributes['tot_cumul_adoption_pr_y_neighbours_adj'] = (
+        sum(neigh.cumul_adoption_tot_ha for neigh in neighbors)
+        / munic.neighbors_perm_pastures_ha
+        )
+    attributes['tot_cumul_adoption_pr_y_port'] = model.cumul_adoption_tot_port
+    attributes.update(pd.Series(munic.census_data))
+    if estimator == 'regr':
+        attributes['sbp_payment'] = (
+            model.government.retrieve_payments(year)[munic.index]
+            )
+    attributes['pastures_area_munic'] = munic.perm_pastures_ha
+    environment = model.mappings.get_environment(munic.Municipality)
+    attributes.update(environment.average_climate)
+    attributes.update(environment.soil)
+    assert not attributes.isnull().any()
+    return attributes.to_numpy()
+
+
+def check_features():
+    """
+    The feature matrices assembled for the estimators have, in each year,
+    the features of each municipality built from its attributes.
+
+    """
+    model = SBPAdoption.from_world(synthetic_world(), seed=SEEDS[0],
+                                   initial_year=FIRST_YEAR)
+    for _ in range(FIRST_YEAR, LAST_YEAR + 1):
+        for estimator, assembler in model.feature_assemblers.items():
+            matrix = assembler.assemble(model)
+            reference = np.array([
+                _reference_features(model, munic, assembler.features,
+                                    estimator)
+                for munic in model.schedule.agents
+                ])
+            # The sums over the neighbours are not in the same order of the
+            # sparse products of the model
+            assert np.allclose(matrix, reference, rtol=1e-12, atol=0)
+        model.step()
+
+
+def check_replicate_engine():
+    """
+    The replicates simulated together by a ReplicateEngine have the same
+    outputs of separate runs of the model with their seeds, with and without
+    the deduplication of the classifier rows.
+
+    """
+    world = synthetic_world()
+    separate = [run_single(world, seed, FIRST_YEAR, LAST_YEAR)
+                for seed in SEEDS]
+    for deduplicate in (False, True):
+        outputs = ReplicateEngine(world, SEEDS, FIRST_YEAR, LAST_YEAR,
+                                  deduplicate=deduplicate).run()
+        for n_run, run_outputs in enumerate(separate):
+            for output, run_output in zip(outputs, run_outputs):
+                assert np.array_equal(output[n_run], run_output)
+
+
+def check_adjusted_r2():
+    """
+    The adjusted R2 is NaN when the observations are not more than the
+    features plus one, and the national validation uses the number of
+    observations given.
+
+    """
+    assert np.isnan(validation.adjusted_r2(0.5, 17, 21))
+    assert np.isnan(validation.adjusted_r2(0.5, 22, 21))
+    assert np.isclose(validation.adjusted_r2(0.5, 100, 21),
+                      1 - 0.5 * 99 / 78)
+
+    years = np.arange(1996, 2013)
+    rng = np.random.default_rng(0)
+    observed = pd.Series(rng.uniform(100., 200., len(years)), index=years)
+    predicted = observed.to_numpy() + rng.normal(0., 10., (3, len(years)))
+    results = EnsembleResults([0, 1, 2], years, ['A'],
+                              np.zeros((3, 1, len(years))), predicted,
+                              np.cumsum(predicted, axis=1))
+    per_run, summary = validation.macro_validation(results, observed)
+    assert per_run['adjusted_r2'].isna().all()
+    assert (per_run['r2'] <= 1).all()
+    per_run, summary = validation.macro_validation(results, observed,
+                                                   n_observations=500)
+    assert (per_run['adjusted_r2'] <= per_run['r2']).all()
+
+
+def check_policy_schedule():
+    """
+    The payments of a table are national, by district or by municipality as
+    given by its columns, the non-numeric columns are ignored, and a column
+    without prefix that is both a district and a municipality, or a numeric
+    column that is neither, is an error.
+
+    """
+    municipalities = ['Beja', 'Serpa', 'Lisboa', 'Sintra', 'Porto']
+    districts = ['Beja', 'Beja', 'Lisboa', 'Lisboa', 'Porto']
+    frame = pd.DataFrame({'sbp_payment': [50., 55.],
+                          'district:Beja': [60., 65.],
+                          'municipality:Beja': [70., 75.],
+                          'Sintra': [80., 85.],
+                          'Notes': ['first', 'second']},
+                         index=[2000, 2001])
+    schedule = PolicySchedule.from_frame(frame, municipalities, districts)
+    assert np.array_equal(schedule.payments, [[70., 60., 50., 80., 50.],
+                                              [75., 65., 55., 85., 55.]])
+
+    for column, message in (('Beja', 'both'), ('Lisbon', 'Lisbon'),
+                            ('district:Serpa', 'district:Serpa')):
+        try:
+            PolicySchedule.from_frame(frame.assign(**{column: 1.}),
+                                      municipalities, districts)
+        except ValueError as error:
+            assert message in str(error), error
+        else:
+            raise AssertionError(column + ' accepted as a payment column.')
+
+
+CHECKS = [check_batched_step, check_adoption_state, check_features,
+          check_replicate_engine, check_adjusted_r2, check_policy_schedule]
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or [check.__name__ for check in CHECKS]
+    checks = {check.__name__: check for check in CHECKS}
+    for name in names:
+        checks[name]()
+        print(name + ': OK')
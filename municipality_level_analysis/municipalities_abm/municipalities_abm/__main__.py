@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import sys
+
+"""
+Command line interface of the package.
+
+Commands
+----------
+ensemble
+    Run a Monte Carlo ensemble of the model and write its outputs, e.g.:
+        python -m municipalities_abm ensemble --runs 100 --years 1996-2021
+            --workers 8 --out output
+sweep
+    Run the model under several schedules of SBP payments and write the
+    outputs of each scenario, e.g.:
+        python -m municipalities_abm sweep low.xlsx high.xlsx --runs 20
+            --out output
+profile
+    Run the model once with the phases of the steps timed and print where
+    the time of each simulated year goes, e.g.:
+        python -m municipalities_abm profile --years 1996-2021
+            --cprofile 2000-2001
+
+"""
+
+
+def _parse_years(years):
+    """
+    Parse a range of years written as "first-last" (both included) or as a
+    single year.
+
+    """
+    try:
+        first_year, _, last_year = years.partition('-')
+        first_year = int(first_year)
+        last_year = int(last_year) if last_year else first_year
+    except ValueError:
+        raise argparse.ArgumentTypeError('Years have to be written as '
+                                         '"first-last", e.g. 1996-2021.')
+    if last_year < first_year:
+        raise argparse.ArgumentTypeError('The last year cannot be previous '
+                                         'to the first one.')
+    return first_year, last_year
+
+
+def _ensemble(args):
+    from .ensemble import EnsembleRunner
+
+    first_year, last_year = args.years
+    runner = EnsembleRunner(first_year, last_year, workers=args.workers,
+                            replicates=args.replicates,
+                            cache_size=args.cache_size,
+                            sbp_payments_path=args.payments,
+                            bundle=args.bundle)
+    seeds = range(args.first_seed, args.first_seed + args.runs)
+    if args.sparse:
+        from .results_sink import SparseResultSink
+
+        sink = SparseResultSink(args.out, args.runs_per_partition,
+                                resume=args.resume)
+        runner.run(seeds, sink=sink, statistics=args.statistics)
+    else:
+        runner.run(seeds, statistics=args.statistics).save(args.out)
+    if args.statistics:
+        runner.statistics.save(args.out)
+    print('Outputs of', len(seeds), 'runs written to', args.out)
+    return 0
+
+
+def _sweep(args):
+    from .prediction_cache import PredictionCache
+    from .sweep import load_payment_scenarios, run_payment_sweep
+    from .world import World
+
+    first_year, last_year = args.years
+    world = World(headless=True, bundle=args.bundle)
+    cache = PredictionCache(args.cache_size) if args.cache_size else None
+    seeds = range(args.first_seed, args.first_seed + args.runs)
+    results = run_payment_sweep(world, load_payment_scenarios(args.scenarios),
+                                seeds, first_year, last_year,
+                                prediction_cache=cache,
+                                batch_size=args.batch_size)
+    results.save(args.out, runs=args.save_runs)
+    print('Outputs of', len(results.scenarios), 'scenarios with', len(seeds),
+          'runs each written to', args.out)
+    return 0
+
+
+def _profile(args):
+    from .model import SBPAdoption
+
+    first_year, last_year = args.years
+    model = SBPAdoption(initial_year=first_year,
+                        sbp_payments_path=args.payments, seed=args.seed,
+                        bundle=args.bundle, headless=True,
+                        batched_inference=not args.per_agent)
+    profiler = model.enable_profiling(args.cprofile)
+    for _ in range(first_year, last_year + 1):
+        model.step()
+    print(profiler)
+    if args.cprofile is not None:
+        print()
+        print(profiler.cprofile_stats(limit=args.cprofile_limit))
+        if args.cprofile_out is not None:
+            profiler.dump_cprofile(args.cprofile_out)
+    return 0
+
+
+def _add_world_arguments(parser):
+    parser.add_argument('--payments', default=None,
+                        help='xlsx or csv file with the SBP payments, '
+                        'national or by district or municipality (default: '
+                        'the ones of the bundle or of the model inputs)')
+    parser.add_argument('--bundle', default=None,
+                        help='Scenario bundle to load the data from (default: '
+                        'the original files)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m municipalities_abm')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ensemble_parser = subparsers.add_parser(
+        'ensemble', help='Run a Monte Carlo ensemble of the model'
+        )
+    ensemble_parser.add_argument('--runs', type=int, default=100,
+                                 help='Number of runs (default: %(default)s)')
+    ensemble_parser.add_argument('--years', type=_parse_years,
+                                 default=(1996, 2021),
+                                 help='Simulated years, first and last '
+                                 'included (default: 1996-2021)')
+    ensemble_parser.add_argument('--workers', type=int, default=None,
+                                 help='Number of worker processes (default: '
+                                 'one per CPU)')
+    ensemble_parser.add_argument('--replicates', type=int, default=1,
+                                 help='Number of runs simulated together by '
+                                 'each task, with a single call to the ML '
+                                 'models per year (default: %(default)s)')
+    ensemble_parser.add_argument('--cache-size', type=int, default=0,
+                                 help='Maximum number of ML predictions '
+                                 'cached by each worker and reused across '
+                                 'runs (default: %(default)s, no cache)')
+    ensemble_parser.add_argument('--first-seed', type=int, default=0,
+                                 help='Seed of the first run, the following '
+                                 'ones are consecutive (default: %(default)s)')
+    ensemble_parser.add_argument('--out', required=True,
+                                 help='Folder where the outputs are written')
+    ensemble_parser.add_argument('--sparse', action='store_true',
+                                 help='Stream the outputs to sparse npz '
+                                 'partitions while the ensemble runs, '
+                                 'instead of writing csv files at the end')
+    ensemble_parser.add_argument('--statistics', action='store_true',
+                                 help='Also write the mean, standard '
+                                 'deviation, confidence interval and '
+                                 'quantiles of the outputs over the runs')
+    ensemble_parser.add_argument('--resume', action='store_true',
+                                 help='With --sparse, keep the runs already '
+                                 'written in the output folder by an '
+                                 'interrupted ensemble and run only the '
+                                 'missing seeds (the --statistics are '
+                                 'calculated on all the runs)')
+    ensemble_parser.add_argument('--runs-per-partition', type=int,
+                                 default=100,
+                                 help='Runs of each sparse partition '
+                                 '(default: %(default)s)')
+    _add_world_arguments(ensemble_parser)
+    ensemble_parser.set_defaults(func=_ensemble)
+
+    sweep_parser = subparsers.add_parser(
+        'sweep', help='Run the model under several payment scenarios'
+        )
+    sweep_parser.add_argument('scenarios', nargs='+',
+                              help='Spreadsheets with the SBP payments of '
+                              'each scenario, in the format of the model '
+                              'inputs')
+    sweep_parser.add_argument('--runs', type=int, default=10,
+                              help='Number of runs of each scenario '
+                              '(default: %(default)s)')
+    sweep_parser.add_argument('--years', type=_parse_years,
+                              default=(1996, 2021),
+                              help='Simulated years, first and last included '
+                              '(default: 1996-2021)')
+    sweep_parser.add_argument('--first-seed', type=int, default=0,
+                              help='Seed of the first run of each scenario, '
+                              'the following ones are consecutive (default: '
+                              '%(default)s)')
+    sweep_parser.add_argument('--batch-size', type=int, default=None,
+                              help='Maximum number of runs simulated '
+                              'together (default: all)')
+    sweep_parser.add_argument('--cache-size', type=int, default=0,
+                              help='Maximum number of ML predictions cached '
+                              'and reused across runs (default: '
+                              '%(default)s, no cache)')
+    sweep_parser.add_argument('--out', required=True,
+                              help='Folder where the outputs are written')
+    sweep_parser.add_argument('--save-runs', action='store_true',
+                              help='Also write the outputs of every run of '
+                              'each scenario, in a subfolder per scenario')
+    sweep_parser.add_argument('--bundle', default=None,
+                              help='Scenario bundle to load the data from '
+                              '(default: the original files)')
+    sweep_parser.set_defaults(func=_sweep)
+
+    profile_parser = subparsers.add_parser(
+        'profile', help='Time the phases of the steps of a run'
+        )
+    profile_parser.add_argument('--years', type=_parse_years,
+                                default=(1996, 2021),
+                                help='Simulated years, first and last '
+                                'included (default: 1996-2021)')
+    profile_parser.add_argument('--seed', type=int, default=0,
+                                help='Seed of the run (default: %(default)s)')
+    profile_parser.add_argument('--per-agent', action='store_true',
+                                help='Predict the adoption in the step of '
+                                'each municipality instead of in batch')
+    profile_parser.add_argument('--cprofile', type=_parse_years, default=None,
+                                help='Years to run also under cProfile, '
+                                'e.g. 2000-2001')
+    profile_parser.add_argument('--cprofile-limit', type=int, default=30,
+                                help='Functions printed from the cProfile '
+                                'statistics (default: %(default)s)')
+    profile_parser.add_argument('--cprofile-out', default=None,
+                                help='File where the cProfile statistics '
+                                'are dumped')
+    _add_world_arguments(profile_parser)
+    profile_parser.set_defaults(func=_profile)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'resume', False) and not args.sparse:
+        parser.error('--resume requires --sparse.')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+
+import collections.abc
+
+import numpy as np
+import pandas as pd
+
+"""
+Adoption state of a run of SBPAdoption, stored as arrays.
+
+The yearly adoption of all the municipalities is a (municipalities x years)
+matrix and the cumulative adoptions are vectors, all allocated once for a
+number of years that grows in chunks, so that the memory and the cost of a
+step don't depend on the number of agent objects or on the dicts they hold.
+The municipalities expose their rows through read-only views (see
+YearlyAdoptionView), with the same interface of the dicts they used to own.
+
+"""
+
+# First year of the yearly adoption of Portugal (earlier years of the
+# historical data are not included in its totals)
+PORT_FIRST_YEAR = 1995
+
+# First year that a run can simulate (the historical adoption covers the
+# previous ones)
+FIRST_SIMULATED_YEAR = 1996
+
+# Number of years added to the matrix every time it is full
+_YEARS_CHUNK = 32
+
+# Attributes saved by AdoptionState.to_dict (all except the permanent pastures
+# areas, that are static)
+_STATE_ARRAYS = ('years', 'known_years', 'adoption', 'cumul_adoption_10y',
+                 'cumul_adoption_tot', 'cumul_adoption_10y_ha',
+                 'cumul_adoption_tot_ha', 'adoption_in_year',
+                 'yearly_adoption_ha_port')
+_STATE_SCALARS = ('first_year', 'n_years', 'adoption_pr_y_port',
+                  'cumul_adoption_10y_port', 'cumul_adoption_tot_port',
+                  'cumul_adoption_10y_ha_port', 'cumul_adoption_tot_ha_port',
+                  'adoption_in_year_port_ha', 'last_port_year')
+
+
+def check_initial_year(initial_year):
+    """
+    Raise a ValueError if a run cannot start in initial_year.
+
+    """
+    if initial_year < FIRST_SIMULATED_YEAR:
+        raise ValueError("The model cannot be initialized in a year "
+                         "previous to " + str(FIRST_SIMULATED_YEAR))
+
+
+def clamp_adoptions(adoptions, cumul_adoption_tot):
+    """
+    Set the negative adoptions predicted to 0 and limit the others so that
+    the cumulative adoption of each municipality doesn't exceed its
+    permanent pastures area. The negative adoptions are reported once per
+    call.
+
+    Parameters
+    ----------
+    adoptions : float or numpy array
+        Fractions of the permanent pastures areas adopted in the year
+    cumul_adoption_tot : float or numpy array
+        Total fractions of the permanent pastures areas already adopted
+
+    Returns
+    -------
+    float or numpy array
+        Adoptions clamped
+
+    """
+    adoptions = np.asarray(adoptions, dtype=float)
+    cumul_adoption_tot = np.asarray(cumul_adoption_tot, dtype=float)
+    negative = adoptions < 0
+    n_negative = np.count_nonzero(negative)
+    if n_negative == 1:
+        print("Negative adoption predicted of:", str(adoptions[negative][0]))
+    elif n_negative:
+        print("Negative adoption predicted for", n_negative,
+              "municipalities, minimum:", str(adoptions[negative].min()))
+    exceeding = ~negative & (cumul_adoption_tot + adoptions > 1)
+    clamped = np.where(negative, 0.,
+                       np.where(exceeding,
+                                np.maximum(1 - cumul_adoption_tot, 0),
+                                adoptions))
+    return clamped if clamped.ndim else float(clamped)
+
+
+class YearlyAdoptionView(collections.abc.Mapping):
+    """
+    Read-only mapping of each year (historical or already simulated) to the
+    adoption of a municipality in that year, reading directly the arrays of
+    the AdoptionState.
+
+    """
+
+    def __init__(self, state, munic_idx, in_ha=False):
+        self._state = state
+        self._munic_idx = munic_idx
+        self._in_ha = in_ha
+
+    def __getitem__(self, year):
+        state = self._state
+        if not isinstance(year, (int, np.integer)):
+            raise KeyError(year)
+        col = year - state.first_year
+        if not (0 <= col < state.n_years and state.known_years[col]):
+            raise KeyError(year)
+        adoption = state.adoption[self._munic_idx, col]
+        if self._in_ha:
+            return adoption * state.perm_pastures_ha[self._munic_idx]
+        return adoption
+
+    def __iter__(self):
+        return iter(self._state.years.tolist())
+
+    def __len__(self):
+        return len(self._state.years)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class AdoptionState:
+    """
+    Class holding the adoption state of the municipalities and of Portugal.
+
+    Attributes
+    ----------
+    first_year : int
+        Year of the first column of the adoption matrix
+    years : numpy array
+        Years with an adoption (historical or simulated), in order
+    known_years : numpy array
+        For each column of the adoption matrix, True if the year is in years
+    n_years : int
+        Number of columns of the adoption matrix
+    perm_pastures_ha : numpy array
+        Area of permanent pastures in hectares of each municipality
+    adoption : numpy array
+        (municipalities x n_years) matrix of the yearly adoption, divided by
+        the permanent pastures area of the municipality
+    cumul_adoption_10y, cumul_adoption_tot : numpy array
+        Adoption of each municipality in the last 10 years and in total,
+        divided by its permanent pastures area
+    cumul_adoption_10y_ha, cumul_adoption_tot_ha : numpy array
+        Same as above, in hectares
+    adoption_in_year : numpy array
+        Adoption predicted for the current year, applied by the advance method
+    yearly_adoption_ha_port : numpy array
+        Yearly adoption of Portugal in hectares, for each column of the
+        adoption matrix
+    perm_pastures_ha_port : float
+        Area of permanent pastures in hectares of Portugal
+    adoption_pr_y_port, cumul_adoption_10y_port, cumul_adoption_tot_port : float
+        Adoption of Portugal in the previous year, in the last 10 years and in
+        total, divided by its permanent pastures area
+    cumul_adoption_10y_ha_port, cumul_adoption_tot_ha_port : float
+        Same as above, in hectares
+    adoption_in_year_port_ha : float
+        Adoption of Portugal in the current year, summed by the advance method
+    last_port_year : int
+        Last year in which the adoption of Portugal was updated
+
+    """
+
+    def __init__(self, perm_pastures_ha, adoption_years, adoption_matrix,
+                 initial_year):
+        """
+        Initialize the state from the historical adoption, restricted to the
+        years before the initial year of the simulation (the ones after are
+        modelled).
+
+        Parameters
+        ----------
+        perm_pastures_ha : numpy array
+            Area of permanent pastures in hectares of each municipality
+        adoption_years : numpy array
+            Years of the historical adoption
+        adoption_matrix : numpy array
+            (municipalities x adoption_years) matrix of the historical adoption
+        initial_year : int
+            Year in which the simulation starts
+
+        """
+        self.perm_pastures_ha = perm_pastures_ha
+        n_munic = len(perm_pastures_ha)
+
+        is_past_year = adoption_years < initial_year
+        past_years = np.asarray(adoption_years[is_past_year], dtype=np.int64)
+        yearly_adoption = adoption_matrix[:, is_past_year]
+
+        self.first_year = int(past_years.min(initial=PORT_FIRST_YEAR))
+        self.n_years = initial_year - self.first_year + _YEARS_CHUNK
+        self.adoption = np.zeros((n_munic, self.n_years))
+        self.known_years = np.zeros(self.n_years, dtype=bool)
+        self.yearly_adoption_ha_port = np.zeros(self.n_years)
+
+        past_cols = past_years - self.first_year
+        self.adoption[:, past_cols] = yearly_adoption
+        self.known_years[past_cols] = True
+        self.years = past_years
+
+        yearly_adoption_ha = yearly_adoption * perm_pastures_ha[:, None]
+        self.cumul_adoption_10y = yearly_adoption[
+            :, past_years >= (initial_year - 10)
+            ].sum(axis=1)
+        self.cumul_adoption_tot = yearly_adoption.sum(axis=1)
+        self.cumul_adoption_10y_ha = self.cumul_adoption_10y * perm_pastures_ha
+        self.cumul_adoption_tot_ha = self.cumul_adoption_tot * perm_pastures_ha
+        self.adoption_in_year = np.zeros(n_munic)
+
+        # Portugal
+        self.perm_pastures_ha_port = perm_pastures_ha.sum()
+        port_years = past_years >= PORT_FIRST_YEAR
+        self.yearly_adoption_ha_port[past_cols[port_years]] = (
+            yearly_adoption_ha[:, port_years].sum(axis=0)
+            )
+        self.last_port_year = initial_year - 1
+        port_ha = self.port_series()
+        self.adoption_pr_y_port = (port_ha.loc[initial_year - 1]
+                                   / self.perm_pastures_ha_port)
+        self.cumul_adoption_10y_ha_port = port_ha.loc[
+            (initial_year - 10): initial_year
+            ].sum()
+        self.cumul_adoption_10y_port = (self.cumul_adoption_10y_ha_port
+                                        / self.perm_pastures_ha_port)
+        self.cumul_adoption_tot_ha_port = port_ha.sum()
+        self.cumul_adoption_tot_port = (self.cumul_adoption_tot_ha_port
+                                        / self.perm_pastures_ha_port)
+        self.adoption_in_year_port_ha = 0
+
+    def to_dict(self):
+        """
+        Return all the dynamic attributes of the state: a dict of arrays
+        (copied) and a dict of scalars.
+
+        """
+        arrays = {name: np.array(getattr(self, name))
+                  for name in _STATE_ARRAYS}
+        scalars = {}
+        for name in _STATE_SCALARS:
+            value = getattr(self, name)
+            scalars[name] = (value.item() if isinstance(value, np.generic)
+                             else value)
+        return arrays, scalars
+
+    @classmethod
+    def from_dict(cls, perm_pastures_ha, arrays, scalars):
+        """
+        Rebuild a state from the permanent pastures areas and the output of
+        to_dict.
+
+        """
+        state = cls.__new__(cls)
+        state.perm_pastures_ha = perm_pastures_ha
+        state.perm_pastures_ha_port = perm_pastures_ha.sum()
+        for name in _STATE_ARRAYS:
+            setattr(state, name, np.array(arrays[name]))
+        for name in _STATE_SCALARS:
+            setattr(state, name, scalars[name])
+        return state
+
+    def _column(self, year):
+        """
+        Return the column of the year in the adoption matrix, extending the
+        matrix by a chunk of years if the year is beyond its end.
+
+        """
+        col = year - self.first_year
+        if col >= self.n_years:
+            n_new = max(_YEARS_CHUNK, col - self.n_years + 1)
+            self.adoption = np.concatenate(
+                [self.adoption, np.zeros((len(self.adoption), n_new))], axis=1
+                )
+            self.known_years = np.concatenate(
+                [self.known_years, np.zeros(n_new, dtype=bool)]
+                )
+            self.yearly_adoption_ha_port = np.concatenate(
+                [self.yearly_adoption_ha_port, np.zeros(n_new)]
+                )
+            self.n_years += n_new
+        return col
+
+    def yearly_adoption(self, munic_idx, in_ha=False):
+        """
+        Return the read-only view of the yearly adoption of a municipality,
+        divided by its permanent pastures area or in hectares.
+
+        """
+        return YearlyAdoptionView(self, munic_idx, in_ha)
+
+    def adoption_in(self, year):
+        """
+        Return the adoption of all the municipalities in a year (0 for the
+        years without adoption data), divided by their permanent pastures
+        area.
+
+        """
+        col = year - self.first_year
+        if 0 <= col < self.n_years:
+            return self.adoption[:, col]
+        return np.zeros(len(self.adoption))
+
+    def advance(self, year, munic_idx=slice(None)):
+        """
+        Apply the adoption predicted for the year to the municipalities with
+        index munic_idx (all by default), updating their cumulative adoptions
+        and summing their adoption in hectares to the one of Portugal.
+
+        """
+        col = self._column(year)
+        adoption = self.adoption_in_year[munic_idx]
+        adoption_ha = adoption * self.perm_pastures_ha[munic_idx]
+        if col >= 10:
+            adopt_to_remove = self.adoption[munic_idx, col - 10]
+        else:
+            adopt_to_remove = 0
+
+        self.adoption[munic_idx, col] = adoption
+        if not self.known_years[col]:
+            self.known_years[col] = True
+            self.years = np.append(self.years, year)
+
+        self.cumul_adoption_10y[munic_idx] = (
+            self.cumul_adoption_10y[munic_idx] + adoption - adopt_to_remove
+            )
+        self.cumul_adoption_tot[munic_idx] += adoption
+        self.cumul_adoption_10y_ha[munic_idx] = (
+            self.cumul_adoption_10y[munic_idx]
+            * self.perm_pastures_ha[munic_idx]
+            )
+        self.cumul_adoption_tot_ha[munic_idx] += adoption_ha
+
+        # Sequential sum in order of municipality (as the agents advancing one
+        # by one), so that the result doesn't depend on how many are advanced
+        # together
+        self.adoption_in_year_port_ha = np.cumsum(
+            np.append(self.adoption_in_year_port_ha, adoption_ha)
+            )[-1]
+
+    def update_port(self, year):
+        """
+        Update all the adoption attributes regarding Portugal at the end of
+        the year, after the advance of the municipalities.
+
+        """
+        col = self._column(year)
+        self.yearly_adoption_ha_port[col] = self.adoption_in_year_port_ha
+        self.last_port_year = year
+        if year - 10 >= PORT_FIRST_YEAR:
+            adopt_to_remove = self.yearly_adoption_ha_port[col - 10]
+        else:
+            adopt_to_remove = 0
+
+        self.adoption_pr_y_port = (self.adoption_in_year_port_ha
+                                   / self.perm_pastures_ha_port)
+        self.cumul_adoption_10y_ha_port = (self.cumul_adoption_10y_ha_port
+                                           + self.adoption_in_year_port_ha
+                                           - adopt_to_remove)
+        self.cumul_adoption_10y_port = (self.cumul_adoption_10y_ha_port
+                                        / self.perm_pastures_ha_port)
+        self.cumul_adoption_tot_ha_port += self.adoption_in_year_port_ha
+        self.cumul_adoption_tot_port = (self.cumul_adoption_tot_ha_port
+                                        / self.perm_pastures_ha_port)
+        self.adoption_in_year_port_ha = 0
+
+    def adoption_ha_port(self, year):
+        """
+        Return the adoption of Portugal in the year, in hectares.
+
+        """
+        return self.yearly_adoption_ha_port[year - self.first_year]
+
+    def port_series(self):
+        """
+        Return the yearly adoption of Portugal in hectares from PORT_FIRST_YEAR
+        to the last year updated, as a pandas Series indexed by year.
+
+        """
+        last_year = self.last_port_year
+        start = PORT_FIRST_YEAR - self.first_year
+        stop = last_year - self.first_year + 1
+        return pd.Series(self.yearly_adoption_ha_port[start:stop],
+                         index=np.arange(PORT_FIRST_YEAR, last_year + 1))
+
+    def total_adoption_ha_port(self, year):
+        """
+        Return the total area adopted in Portugal from PORT_FIRST_YEAR until
+        the year (included), in hectares.
+
+        """
+        start = PORT_FIRST_YEAR - self.first_year
+        stop = year - self.first_year + 1
+        return np.cumsum(self.yearly_adoption_ha_port[start:stop])[-1]
@@ -1,6 +1,15 @@
 # -*- coding: utf-8 -*-
 
 
-from .municipality import Municipality
+from .municipality import BaseMunicipality, HeadlessMunicipality
 from .government import Government
 from .environment import MunicipalityEnvironment
+
+
+def __getattr__(name):
+    # Municipality requires mesa_geo, imported only when the class is used
+    if name == 'Municipality':
+        from .geo_municipality import Municipality
+        return Municipality
+    raise AttributeError("module " + repr(__name__) + " has no attribute "
+                         + repr(name))
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+from mesa_geo.geoagent import GeoAgent
+
+from .municipality import BaseMunicipality
+
+
+class Municipality(BaseMunicipality, GeoAgent):
+    """
+    Class for Municipality object, placed in the GeoSpace of the model with
+    its geometry.
+
+    """
+
+    def __init__(self, unique_id, model, shape):
+        """
+        Initialize a Municipality agent.
+
+        """
+        super().__init__(unique_id, model, shape)
+        self._initialize_attributes()
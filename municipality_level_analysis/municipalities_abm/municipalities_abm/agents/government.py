@@ -10,8 +10,8 @@ class Government(mesa.Agent):
 
     Attributes
     ----------
-    sbp_payments : pd Series
-        Payment offered to adopt SBP for each year
+    policy_schedule : PolicySchedule
+        Payment offered to adopt SBP to each municipality for each year
 
     Methods
     ----------
@@ -20,21 +20,21 @@ class Government(mesa.Agent):
 
     """
 
-    def __init__(self, unique_id, model, sbp_payments):
+    def __init__(self, unique_id, model, policy_schedule):
         """
         Parameters
         ----------
-        sbp_payments : pandas Series
-            Payment offered to adopt SBP for each year
+        policy_schedule : PolicySchedule
+            Payment offered to adopt SBP to each municipality for each year
 
         """
 
         super().__init__(unique_id, model)
-        self._sbp_payments = sbp_payments
+        self._policy_schedule = policy_schedule
         
     @property
-    def sbp_payments(self):
-        return self._sbp_payments
+    def policy_schedule(self):
+        return self._policy_schedule
 
     def retrieve_payments(self, year):
         """
@@ -52,12 +52,9 @@ class Government(mesa.Agent):
 
         Returns
         ------
-        int
-            Payment offered in the year requested in €/hectare
+        numpy array
+            Payment offered to each municipality in the year requested in
+            €/hectare (read-only)
 
         """
-        try:
-            return self.sbp_payments.loc[year, 'sbp_payment']
-        except KeyError:
-            raise KeyError('Payment for ' + str(year) + ' not available.'
-                           'Year outside the time span of the model.')
+        return self.policy_schedule.payments_in(year)
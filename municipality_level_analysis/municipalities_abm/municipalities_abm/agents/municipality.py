@@ -2,14 +2,15 @@
 
 import pandas as pd
 
-from mesa_geo.geoagent import GeoAgent
+import mesa
 
-from ..mapping_class import mappings
+from ..adoption_state import clamp_adoptions
 
 
-class Municipality(GeoAgent):
+class BaseMunicipality:
     """
-    Class for Municipality object.
+    Attributes and methods shared by the Municipality agents, with and without
+    geometry (see Municipality and HeadlessMunicipality).
 
     Municipalities:
         .....
@@ -20,24 +21,33 @@ class Municipality(GeoAgent):
         Name of the municipality
     District : str
         Name of the district which municipality is part of
+    index : int
+        Position of the municipality in the data of the model's World
     neighbors : list
         Names (strings) of the neighboring Municipality objects
+    neighbors_idx : numpy array
+        Indexes (positions in the data of the model's World) of the
+        neighboring Municipality objects
     neighbors_perm_pastures_ha : float
         Sum of the permanent pastures area in the neighbouring municipalities
     census_data : dict
         Value for census variables of the municipality
     perm_pastures_ha : float
         Area of permanent pastures in hectare in the municipality
-    yearly_adoption : dict
+    yearly_adoption : YearlyAdoptionView
         Adoption of SBP in the municipality per year, divided by the permanent
-        pastures area of the municipality
+        pastures area of the municipality (read-only mapping, view of the
+        AdoptionState of the model)
     cumul_adoption_10y : float
         Adoptoin of SBP in the municipality in the last 10 years, divided by
         the permanent pastures area od the municipality
-    yearly_adoption_ha : dict
+    yearly_adoption_ha : YearlyAdoptionView
         Adoption of SBP in the municipality per year in hectares
     cumul_adoption_10y_ha : float
-        Adoptoin of SBP in the municipality in the last 10 years in hectares  
+        Adoptoin of SBP in the municipality in the last 10 years in hectares
+    cumul_adoption_tot, cumul_adoption_tot_ha : float
+        Total adoption of SBP in the municipality, divided by the permanent
+        pastures area and in hectares
     # environment : MunicipalityEnvironment object
     #     Entity reporting the environmental conditions of the municipality
 
@@ -48,88 +58,96 @@ class Municipality(GeoAgent):
 
     """
 
-    def __init__(self, unique_id, model, shape):
+    def _initialize_attributes(self):
         """
-        Initialize a Municipality agent.
+        Called by the __init__ method of the agent classes.
 
         """
-        super().__init__(unique_id, model, shape)
-
         # Attributes set by the Agent Creator from the Shapefile during the
         # initialization
         self.Municipality = ""
         self.District = ""
 
         # Attributes set during initialization of the municipalities
+        self.index = None
         self.neighbors = None
+        self.neighbors_idx = None
         self.neighbors_perm_pastures_ha = None
         self.census_data = None
         self.perm_pastures_ha = None
 
-        self.yearly_adoption = None
-        self.cumul_adoption_10y = None
-        self.yearly_adoption_ha = None
-        self.cumul_adoption_10y_ha = None
+    # The adoption state is held by the AdoptionState of the model (see the
+    # adoption_state module): the municipality only exposes its row of it
+
+    @property
+    def yearly_adoption(self):
+        return self.model.adoption_state.yearly_adoption(self.index)
+
+    @property
+    def yearly_adoption_ha(self):
+        return self.model.adoption_state.yearly_adoption(self.index,
+                                                         in_ha=True)
+
+    @property
+    def cumul_adoption_10y(self):
+        return self.model.adoption_state.cumul_adoption_10y[self.index]
 
-        self.cumul_adoption_tot = None
-        self.cumul_adoption_tot_ha = None  # For visualization
+    @property
+    def cumul_adoption_10y_ha(self):
+        return self.model.adoption_state.cumul_adoption_10y_ha[self.index]
 
-        # Attributes used to save state before running advance method
-        self._adoption_in_year = None
+    @property
+    def cumul_adoption_tot(self):
+        return self.model.adoption_state.cumul_adoption_tot[self.index]
+
+    @property
+    def cumul_adoption_tot_ha(self):
+        return self.model.adoption_state.cumul_adoption_tot_ha[self.index]
+
+    @property
+    def adoption_in_year(self):
+        return self.model.adoption_state.adoption_in_year[self.index]
 
     def get_neighbors_and_pastures_area(self):
         """
-        Called by the model during instantiation of Municipalities.
-
         Get touching neighbors (a list of their names, to avoid errors during
         the serialization in Json format for the visualization).
         Calcualte the total area of permanent pastures in these neighbouring
         municipalities.
 
+        The neighbours are the ones of the cached topology of the model's
+        World (see the topology module), not searched again in the grid.
+
         # To get them based on a certain distance, use
         # get_neighbors_within_distance grid's method instead.
 
         """
-        neighbors = self.model.grid.get_neighbors(self)
-        self.neighbors = [neighbor.Municipality for neighbor in neighbors]
-        perm_pastures_ha_all_neighbors = [
-            neigh.perm_pastures_ha for neigh in neighbors
-            ]
-        self.neighbors_perm_pastures_ha = sum(perm_pastures_ha_all_neighbors)
-
-    def set_cumul_adoption_10y(self, year):
-        """
-        Called by the model during instantiation of Municipalities.
+        municipalities = self.model.schedule.agents
+        neighbors = [municipalities[j] for j in self.neighbors_idx]
+        self.set_neighbors_and_pastures_area(neighbors)
 
-        Calculate the total adoption over the previou 10 years and
-        set the cumul_adoption_10y attribute
-
-        Returns
-        -------
-        None.
-
-        """
-        yearly_adoption_10y = [v for k, v in self.yearly_adoption.items()
-                               if k >= (year - 10)]
-        self.cumul_adoption_10y = sum(yearly_adoption_10y)
-
-    def set_tot_cumul_adoption(self):
+    def set_neighbors_and_pastures_area(self, neighbors):
         """
-        Called by the model during instantiation of Municipalities.
+        Set the names of the neighboring municipalities and the total area of
+        permanent pastures in them.
 
-        Calculate the total adoption over all the previous years and
-        set the cumul_adoption_tot attribute
-
-        Returns
-        -------
-        None.
+        Parameters
+        ----------
+        neighbors : list
+            Neighboring Municipality objects
 
         """
-        self.cumul_adoption_tot = sum(self.yearly_adoption.values())
+        self.neighbors = [neighbor.Municipality for neighbor in neighbors]
+        perm_pastures_ha_all_neighbors = [
+            neigh.perm_pastures_ha for neigh in neighbors
+            ]
+        self.neighbors_perm_pastures_ha = sum(perm_pastures_ha_all_neighbors)
 
     def step(self):
         """
-        Step method called by the step of the model.
+        Step method called by the step of the model when it does not predict
+        the adoption of all the municipalities in batch (see
+        SBPAdoption.batched_inference).
 
         It retrieves all the data and pass them in the right order to the ML
         model to predict the fraction of permanent pastures area in the
@@ -141,21 +159,15 @@ class Municipality(GeoAgent):
         None.
 
         """
-        ml_clsf_input_data = self._retrieve_data(self.model.ml_clsf_feats,
-                                                 self.model.year,
-                                                 'clsf')
-        ml_regr_input_data = self._retrieve_data(self.model.ml_regr_feats,
-                                                 self.model.year,
-                                                 'regr')
-        self.predict_adoption(self.model.ml_clsf, ml_clsf_input_data,
-                              self.model.ml_regr, ml_regr_input_data)
-
-    def _retrieve_data(self, features, year, estimator):
+        self.predict_adoption(self.model.ml_clsf, self._retrieve_data('clsf'),
+                              self.model.ml_regr, self._retrieve_data('regr'))
+
+    def _retrieve_data(self, estimator):
         """
         Method to return all the data that need to be passed to the ML model
-        to predict the adoption in the year.
-        Estimator has to be "clsf" or "regr" and is required to retrieve the
-        correct census features.
+        to predict the adoption in the year, taken from the feature matrix
+        of the model (see the features module).
+        Estimator has to be "clsf" or "regr".
 
         Returns
         -------
@@ -164,121 +176,99 @@ class Municipality(GeoAgent):
             to predict adoption.
 
         """
-        attributes = pd.Series(index=features)
+        assembler = self.model.feature_assemblers[estimator]
+        matrix = assembler.assemble(self.model)
+        return pd.DataFrame(matrix[self.index:self.index + 1],
+                            columns=assembler.features)
 
-        # Adoption
-        attributes["adoption_pr_y_munic"] = self.yearly_adoption[year - 1]
-        attributes["adoption_pr_y_port"] = self.model.adoption_pr_y_port
-        adoption_pr_y_neigh, cumul_adoption_neigh = (
-            self._get_neigh_adoption('tot')
-            )
-        attributes["adoption_pr_y_neighbours_adj"] = adoption_pr_y_neigh
+    def _get_neigh_adoption(self, tot_or_10y):
+        """
+        Return the adoption of the previous year and the cumulative one (in
+        total or over 10 years) in the neighbouring municipalities, taken from
+        the ones calculated by the model for all the municipalities at once
+        (see SBPAdoption.get_neighbors_adoption).
 
-        attributes["tot_cumul_adoption_pr_y_munic"] = (
-            self.cumul_adoption_tot
-            )
-        attributes["tot_cumul_adoption_pr_y_neighbours_adj"] = (
-            cumul_adoption_neigh
-            )
-        attributes["tot_cumul_adoption_pr_y_port"] = (
-            self.model.cumul_adoption_tot_port
+        """
+        adoption_pr_y, cumul_adoption = self.model.get_neighbors_adoption(
+            tot_or_10y
             )
+        return adoption_pr_y[self.index], cumul_adoption[self.index]
 
-        # Others
-        attributes.update(self.census_data)
-        if estimator == 'regr':
-            attributes['sbp_payment'] = (
-                self.model.government.retrieve_payments(year)
-                )
-        attributes['pastures_area_munic'] = self.perm_pastures_ha
-        environment = mappings.environments[self.Municipality]
-        attributes.update(environment.average_climate)
-        attributes.update(environment.soil)
-
-        if attributes.isnull().any():
-            missing_attr = attributes[attributes.isnull()].index.tolist()
-            raise ValueError("The following attributes to input to the machine"
-                             " learning model are missing: "
-                             + ", ".join(missing_attr))
-
-        return attributes.to_frame().T
-
-    def _get_neigh_adoption(self, tot_or_10y):
+    def predict_adoption(self, classifier, input_clsf, regressor, input_regr):
         """
-        Calculate and return the adoption of the previous year and the
-        cumulaive over 10 years in the neighbouring municipalities.
+        Predict the adoption in the year: if the municipality has not already
+        adopted SBP on all its permanent pastures, the classifier gives the
+        probability of adopting and, if the municipality adopts, the regressor
+        gives the fraction of permanent pastures adopted.
+        The uniform number compared with the probability is the one drawn for
+        the municipality in the year by the random streams of the model, so
+        it doesn't depend on the order of activation.
 
         """
-        year = self.model.year
-        munic_map = mappings.municipalities
-        adoptions_ha = [munic_map[neigh].yearly_adoption_ha[year-1]
-                        for neigh in self.neighbors]
-        adoption_pr_y_ha = sum(adoptions_ha)
-        adoption_pr_y = adoption_pr_y_ha / self.neighbors_perm_pastures_ha
-
-        if tot_or_10y == '10y':
-            adoptions_10y_ha = [munic_map[neigh].cumul_adoption_10y_ha
-                                for neigh in self.neighbors]
-            cumul_adoption_10y_ha = sum(adoptions_10y_ha)
-            cumul_adoption = (
-                cumul_adoption_10y_ha / self.neighbors_perm_pastures_ha
-                )
-        if tot_or_10y == 'tot':
-            adoptions_tot_ha = [munic_map[neigh].cumul_adoption_tot_ha
-                                for neigh in self.neighbors]
-            cumul_adoption_tot_ha = sum(adoptions_tot_ha)
-            cumul_adoption = (
-                cumul_adoption_tot_ha / self.neighbors_perm_pastures_ha
-                )
-        return adoption_pr_y, cumul_adoption
+        if self.cumul_adoption_tot >= 1:
+            self.set_adoption_in_year(0)
+            return
+        prob_adopt = classifier.predict_proba(input_clsf)[0][1]
+        draw = self.model.random_streams.uniforms(self.model.year)[self.index]
+        if draw < prob_adopt:
+            self.set_adoption_in_year(regressor.predict(input_regr)[0])
+        else:
+            self.set_adoption_in_year(0)
+
+    def set_adoption_in_year(self, adoption):
+        """
+        Store the adoption of the year, applied by the advance method.
 
-    def predict_adoption(self, classifier, input_clsf, regressor, input_regr):
-         if self.cumul_adoption_tot < 1:
-            prob_adopt = classifier.predict_proba(input_clsf)[0][1]
-            if self.model.random.uniform(0, 1) < prob_adopt:
-                adoption = regressor.predict(input_regr)
-                if adoption < 0:
-                    print("Negative adoption predicted of:", str(adoption))
-                    self._adoption_in_year = 0
-                elif self.cumul_adoption_tot + adoption > 1:
-                    adoption = 1 - self.cumul_adoption_tot
-                else:
-                    self._adoption_in_year = adoption[0]
-            else:
-                self._adoption_in_year = 0
+        A negative adoption predicted is set to 0 and the adoption is limited
+        so that the cumulative adoption doesn't exceed the permanent pastures
+        area of the municipality (see adoption_state.clamp_adoptions).
+
+        Parameters
+        ----------
+        adoption : float
+            Fraction of the permanent pastures area adopted in the year
+
+        """
+        self.model.adoption_state.adoption_in_year[self.index] = (
+            clamp_adoptions(adoption, self.cumul_adoption_tot)
+            )
 
     def advance(self):
         """
         Advance method called by the step of the model after the step() methods
         of all municipalities are all called.
 
-        Updates all the attributes regarding adoption considering the
-        prediction for the year.
+        Updates the adoption state of the municipality considering the
+        prediction for the year and sums the hectares adopted to the total
+        adoption in Portugal in the year (see AdoptionState.advance).
 
-        Sum the hectares adopted to the total adoption in Portugal in the year.
+        """
+        self.model.adoption_state.advance(self.model.year, self.index)
 
-        Returns
-        -------
-        None.
 
-        """
-        year = self.model.year
+class HeadlessMunicipality(BaseMunicipality, mesa.Agent):
+    """
+    Class for Municipality object without geometry, used by the model in
+    headless mode: it behaves exactly as Municipality but it is not placed in
+    any space.
 
-        self.yearly_adoption[year] = self._adoption_in_year
-        self.yearly_adoption_ha[year] = (
-            self._adoption_in_year * self.perm_pastures_ha
-            )
-        try:
-            adopt_to_remove = self.yearly_adoption[year - 10]
-        except KeyError:
-            adopt_to_remove = 0
-        self.cumul_adoption_10y = (self.cumul_adoption_10y
-                                   + self._adoption_in_year
-                                   - adopt_to_remove)
-        self.cumul_adoption_tot += self._adoption_in_year
-        self.cumul_adoption_10y_ha = (
-            self.cumul_adoption_10y * self.perm_pastures_ha
-            )
-        self.cumul_adoption_tot_ha += self.yearly_adoption_ha[year]
+    """
 
-        self.model.adoption_in_year_port_ha += self.yearly_adoption_ha[year]
+    def __init__(self, unique_id, model):
+        """
+        Initialize a HeadlessMunicipality agent.
+
+        """
+        super().__init__(unique_id, model)
+        self._initialize_attributes()
+
+
+def __getattr__(name):
+    # Municipality is defined in the geo_municipality module, since it
+    # requires mesa_geo, that is imported only when needed (not in headless
+    # mode)
+    if name == 'Municipality':
+        from .geo_municipality import Municipality
+        return Municipality
+    raise AttributeError("module " + repr(__name__) + " has no attribute "
+                         + repr(name))
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pathlib
+import tempfile
+
+"""
+Atomic writing of the files shared between processes (caches, bundles,
+checkpoints and outputs).
+
+A file is written in a temporary file in the same folder and then moved to
+its final path with os.replace, which is atomic: a process reading the path
+concurrently finds either the previous file or the complete new one, never a
+partially written file. If the writing fails, the temporary file is removed.
+
+"""
+
+
+def save_atomically(path, write, mode='wb'):
+    """
+    Write a file atomically (see the module description), creating its
+    folder if missing.
+
+    Parameters
+    ----------
+    path : path str
+        Final path of the file
+    write : callable
+        Called with the open temporary file to write its content
+    mode : str
+        Mode in which the temporary file is opened ('wb' or 'w')
+
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as tmp_file:
+            write(tmp_file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
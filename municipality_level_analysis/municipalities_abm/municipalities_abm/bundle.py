@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import pathlib
+import struct
+
+import numpy as np
+import pandas as pd
+
+from . import input_data
+from .atomic_files import save_atomically
+from .topology import GEO_CRS, touching_neighbors
+from .model_inputs import (bundle_path, municipalities_shp_path,
+                           census_data_path, adoption_data_path,
+                           av_climate_data_path, soil_data_path,
+                           sbp_payments_path)
+
+"""
+Scenario bundle: all the input data of SBPAdoption compiled in a single
+versioned binary file, loaded through memory-mapping.
+
+Layout of the file
+----------
+prefix : 24 bytes
+    Magic string, format version (uint32), reserved (uint32) and length in
+    bytes of the header (uint64), little-endian.
+header : json
+    Metadata (names of municipalities, features and years, attributes of the
+    shapefile, hash of the source files) and, for each array, its dtype, shape
+    and offset from the start of the data section.
+data section
+    Raw C-contiguous arrays, each starting at a multiple of 64 bytes:
+        census : (municipalities x census features) float64
+        adoption : (municipalities x years) float64
+        climate : (municipalities x climate features) float64
+        soil : (municipalities x soil features) float64
+        sbp_payments : (payment years,) float64
+        geometry_wkb : uint8, WKB of all the municipalities one after another
+        geometry_offsets : (municipalities + 1,) int64, offsets in geometry_wkb
+        adjacency_indptr, adjacency_indices : int64, touching neighbours of
+            each municipality in CSR format
+
+All the arrays are aligned on the municipalities of the shapefile, in the same
+order. The data are stored already transformed by the custom transformers, so
+loading a bundle requires no parsing nor computation.
+
+"""
+
+MAGIC = b'SBPBUNDL'
+FORMAT_VERSION = 1
+
+_PREFIX = struct.Struct('<8sIIQ')
+_ALIGNMENT = 64
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+class ScenarioBundle:
+    """
+    Class giving access to the content of a compiled scenario bundle.
+
+    The arrays are memory-mapped and read-only: they are read from the disk
+    only when (and if) they are accessed.
+
+    Attributes
+    ----------
+    path : pathlib Path
+        Path of the bundle file
+    format_version : int
+        Version of the format the bundle was written with
+    source_hash : str
+        SHA-256 digest of the source files the bundle was compiled from
+    municipalities : list
+        Names of the municipalities, in the order of the arrays
+    unique_ids : list
+        Unique identifier (CCA_2 code) of each municipality
+    attributes : dict
+        Maps each column of the shapefile (except the geometry) to the list of
+        its values
+    crs : str
+        Coordinate reference system of the geometries
+    arrays : dict
+        Maps each array name to the memory-mapped array
+
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        with open(self.path, 'rb') as file:
+            prefix = file.read(_PREFIX.size)
+            if len(prefix) < _PREFIX.size:
+                raise ValueError(str(self.path) + ' is not a scenario bundle.')
+            magic, version, _, header_len = _PREFIX.unpack(prefix)
+            if magic != MAGIC:
+                raise ValueError(str(self.path) + ' is not a scenario bundle.')
+            if version != FORMAT_VERSION:
+                raise ValueError('The scenario bundle ' + str(self.path)
+                                 + ' has format version ' + str(version)
+                                 + ', while version ' + str(FORMAT_VERSION)
+                                 + ' is required. Compile it again.')
+            header = json.loads(file.read(header_len).decode('utf-8'))
+
+        self.format_version = version
+        self._meta = header['meta']
+        self.source_hash = self._meta['source_hash']
+        self.attributes = self._meta['attributes']
+        self.municipalities = self.attributes['Municipality']
+        self.unique_ids = self._meta['unique_ids']
+        self.crs = self._meta['crs']
+
+        data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        data_start = _aligned(_PREFIX.size + header_len)
+        self.arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            shape = tuple(spec['shape'])
+            start = data_start + spec['offset']
+            stop = start + dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            self.arrays[name] = data[start:stop].view(dtype).reshape(shape)
+
+    def __len__(self):
+        return len(self.municipalities)
+
+    def _municipalities_frame(self, array_name, columns):
+        return pd.DataFrame(self.arrays[array_name],
+                            index=pd.Index(self.municipalities,
+                                           name='Municipality'),
+                            columns=columns)
+
+    def census_data(self):
+        """
+        Return the transformed census data, indexed by municipality.
+
+        """
+        return self._municipalities_frame('census',
+                                          self._meta['census_features'])
+
+    def adoption_data(self):
+        """
+        Return the yearly adoption of each municipality (divided by its
+        permanent pastures area), with the years as integer columns.
+
+        """
+        return self._municipalities_frame('adoption',
+                                          self._meta['adoption_years'])
+
+    def climate_data(self):
+        """
+        Return the transformed average climate data, indexed by municipality.
+
+        """
+        return self._municipalities_frame('climate',
+                                          self._meta['climate_features'])
+
+    def soil_data(self):
+        """
+        Return the transformed soil data, indexed by municipality.
+
+        """
+        return self._municipalities_frame('soil', self._meta['soil_features'])
+
+    def sbp_payments(self):
+        """
+        Return the payment offered for SBP in each year, in the same format
+        as the spreadsheet loaded by input_data.load_sbp_payments.
+
+        """
+        return pd.DataFrame(
+            {'sbp_payment': self.arrays['sbp_payments']},
+            index=pd.Index(self._meta['payment_years'], name='Year')
+            )
+
+    def geometries(self):
+        """
+        Return the list of the shapely geometries of the municipalities.
+
+        """
+        import shapely.wkb
+
+        blob = self.arrays['geometry_wkb']
+        offsets = self.arrays['geometry_offsets']
+        return [shapely.wkb.loads(bytes(blob[start:stop]))
+                for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    def adjacency(self):
+        """
+        Return the adjacency matrix of the municipalities as a scipy CSR
+        matrix, with 1 where two municipalities touch each other.
+
+        """
+        import scipy.sparse
+
+        indptr = self.arrays['adjacency_indptr']
+        indices = self.arrays['adjacency_indices']
+        n_munic = len(self)
+        return scipy.sparse.csr_matrix(
+            (np.ones(len(indices)), indices, indptr), shape=(n_munic, n_munic)
+            )
+
+
+def load_bundle(path=bundle_path):
+    """
+    Open a compiled scenario bundle.
+
+    Returns
+    -------
+    ScenarioBundle
+
+    """
+    return ScenarioBundle(path)
+
+
+def compile_bundle(path=bundle_path,
+                   shapefile_path=municipalities_shp_path,
+                   census_path=census_data_path,
+                   adoption_path=adoption_data_path,
+                   climate_path=av_climate_data_path,
+                   soil_path=soil_data_path,
+                   payments_path=sbp_payments_path):
+    """
+    Compile all the input data of the model in a scenario bundle.
+
+    Parameters
+    ----------
+    path : path str
+        Path where the bundle is written. If a file already exists, it is
+        replaced only after the new bundle is completely written.
+    shapefile_path, census_path, adoption_path, climate_path, soil_path,
+    payments_path : path str
+        Paths to the source files (defaults in the model_inputs module)
+
+    Raises
+    ------
+    ValueError
+        Raised if any dataset is missing data for some municipalities of the
+        shapefile
+
+    Returns
+    -------
+    ScenarioBundle
+        The compiled bundle, opened.
+
+    """
+    source_files = (input_data.shapefile_paths(shapefile_path)
+                    + [pathlib.Path(p) for p in (census_path, adoption_path,
+                                                 climate_path, soil_path,
+                                                 payments_path)])
+    source_hash = input_data.hash_files(source_files)
+
+    municipalities_data = input_data.load_municipalities_shapefile(
+        shapefile_path
+        )
+    names = municipalities_data['Municipality']
+
+    census = input_data.align_on_municipalities(
+        input_data.load_census_data(census_path), names, 'Census'
+        )
+    adoption = input_data.align_on_municipalities(
+        input_data.load_adoption_data(adoption_path), names, 'Adoption'
+        )
+    climate = input_data.align_on_municipalities(
+        input_data.load_climate_data(climate_path), names, 'Average climate'
+        )
+    soil = input_data.align_on_municipalities(
+        input_data.load_soil_data(soil_path), names, 'Soil'
+        )
+    sbp_payments = input_data.load_sbp_payments(payments_path)
+
+    geometries = municipalities_data.geometry.to_crs(GEO_CRS)
+    wkbs = [geom.wkb for geom in geometries]
+    geometry_offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+    geometry_offsets[1:] = np.cumsum([len(wkb) for wkb in wkbs])
+    geometry_wkb = np.frombuffer(b''.join(wkbs), dtype=np.uint8)
+
+    adjacency_indptr, adjacency_indices = touching_neighbors(geometries)
+
+    attributes = {col: municipalities_data[col].tolist()
+                  for col in municipalities_data.columns
+                  if col != municipalities_data.geometry.name}
+    meta = {
+        'source_hash': source_hash,
+        'crs': GEO_CRS,
+        'unique_ids': attributes.pop('CCA_2'),
+        'attributes': attributes,
+        'census_features': census.columns.tolist(),
+        'adoption_years': [int(year) for year in adoption.columns],
+        'climate_features': climate.columns.tolist(),
+        'soil_features': soil.columns.tolist(),
+        'payment_years': [int(year) for year in sbp_payments.index],
+        }
+    arrays = {
+        'census': census.to_numpy(dtype=np.float64),
+        'adoption': adoption.to_numpy(dtype=np.float64),
+        'climate': climate.to_numpy(dtype=np.float64),
+        'soil': soil.to_numpy(dtype=np.float64),
+        'sbp_payments': sbp_payments['sbp_payment'].to_numpy(
+            dtype=np.float64
+            ),
+        'geometry_wkb': geometry_wkb,
+        'geometry_offsets': geometry_offsets,
+        'adjacency_indptr': adjacency_indptr,
+        'adjacency_indices': adjacency_indices,
+        }
+    _write_bundle(path, meta, arrays)
+    return ScenarioBundle(path)
+
+
+def _write_bundle(path, meta, arrays):
+    """
+    Called by compile_bundle.
+
+    Write the bundle atomically (see the atomic_files module).
+
+    """
+    specs = {}
+    offset = 0
+    contiguous_arrays = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        offset = _aligned(offset)
+        specs[name] = {'dtype': array.dtype.str,
+                       'shape': list(array.shape),
+                       'offset': offset}
+        offset += array.nbytes
+        contiguous_arrays[name] = array
+
+    header = json.dumps({'meta': meta, 'arrays': specs}).encode('utf-8')
+    data_start = _aligned(_PREFIX.size + len(header))
+
+    def write(file):
+        file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, 0, len(header)))
+        file.write(header)
+        for name, array in contiguous_arrays.items():
+            file.write(b'\0' * (data_start + specs[name]['offset']
+                                - file.tell()))
+            file.write(array.tobytes())
+
+    save_atomically(path, write)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compile the input data of the model in a scenario bundle.'
+        )
+    parser.add_argument('path', nargs='?', default=bundle_path,
+                        help='Path of the bundle to write (default: '
+                        '%(default)s)')
+    parser.add_argument('--payments', default=sbp_payments_path,
+                        help='Spreadsheet with the SBP payments (default: '
+                        '%(default)s)')
+    args = parser.parse_args()
+    bundle = compile_bundle(args.path, payments_path=args.payments)
+    print('Scenario bundle with', len(bundle), 'municipalities written to',
+          bundle.path)
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import os
+import pathlib
+import time
+
+import numpy as np
+import pandas as pd
+
+from .adoption_state import PORT_FIRST_YEAR, check_initial_year
+from .model_inputs import clsf_folder_path, regr_folder_path
+from .prediction_cache import PredictionCache
+from .replicates import ReplicateEngine
+from .world import World
+
+"""
+Monte Carlo ensembles of SBPAdoption runs.
+
+The runs of an ensemble differ only by their seed, so they are distributed
+over a pool of processes, each of which builds its (headless) World only once
+when it starts and then runs all the seeds it receives on it. Only the
+adoption outputs of each run are sent back to the main process. Since the
+adoption draws of a run depend only on its seed (see the random_streams
+module), the outputs don't depend on the number of workers nor on the order
+in which the runs are completed.
+Each task of the pool can run several seeds together with a ReplicateEngine
+(see the replicates module), so that the ML estimators are called once per
+year for all of them, and all the tasks of a worker can share the same
+PredictionCache (see the prediction_cache module).
+
+Run as:
+    python -m municipalities_abm ensemble --runs N --years 1996-2021
+        --workers K --out DIR
+
+"""
+
+# World and prediction cache of the worker process, built by
+# _initialize_worker
+_worker_world = None
+_worker_cache = None
+
+
+def _initialize_worker(world_kwargs, cache_size):
+    global _worker_world, _worker_cache
+    _worker_world = World(headless=True, **world_kwargs)
+    if cache_size:
+        _worker_cache = PredictionCache(cache_size)
+
+
+def _run_in_worker(seeds, first_year, last_year):
+    outputs = run_batch(_worker_world, seeds, first_year, last_year,
+                        _worker_cache)
+    return outputs, os.getpid(), _cache_counters(_worker_cache)
+
+
+def _cache_counters(cache):
+    if cache is None:
+        return 0, 0
+    return cache.hits, cache.misses
+
+
+def _names_in_worker():
+    return _worker_world.names
+
+
+def run_single(world, seed, first_year, last_year, prediction_cache=None):
+    """
+    Run the model on a World from first_year to last_year (included) and
+    return its adoption outputs. The ML estimators are called through the
+    prediction cache, if any.
+
+    Returns
+    -------
+    munic_adoption : numpy array
+        (municipalities x years) yearly adoption of each municipality, divided
+        by its permanent pastures area
+    yearly_adoption_port : numpy array
+        Area adopted in Portugal in each year, in hectares
+    cumul_adoption_port : numpy array
+        Total area adopted in Portugal until each year, in hectares
+
+    """
+    from .model import SBPAdoption
+
+    model = SBPAdoption.from_world(world, seed=seed, initial_year=first_year,
+                                   headless=True,
+                                   prediction_cache=prediction_cache)
+    for _ in range(first_year, last_year + 1):
+        model.step()
+
+    state = model.adoption_state
+    first_col = first_year - state.first_year
+    last_col = last_year - state.first_year + 1
+    munic_adoption = state.adoption[:, first_col:last_col].copy()
+    yearly_adoption_port = state.yearly_adoption_ha_port[
+        PORT_FIRST_YEAR - state.first_year:last_col
+        ]
+    cumul_adoption_port = np.cumsum(yearly_adoption_port)
+    n_years = last_year - first_year + 1
+    return (munic_adoption, yearly_adoption_port[-n_years:].copy(),
+            cumul_adoption_port[-n_years:])
+
+
+def run_batch(world, seeds, first_year, last_year, prediction_cache=None):
+    """
+    Run the model once for each seed, as run_single, and return the outputs
+    of all the runs stacked (runs as first dimension). A single seed is run
+    by an SBPAdoption model, more seeds are run together by a
+    ReplicateEngine.
+
+    """
+    if len(seeds) == 1:
+        return tuple(output[None] for output
+                     in run_single(world, seeds[0], first_year, last_year,
+                                   prediction_cache))
+    return ReplicateEngine(world, seeds, first_year, last_year,
+                           prediction_cache).run()
+
+
+class EnsembleResults:
+    """
+    Class for the outputs of all the runs of an ensemble.
+
+    Attributes
+    ----------
+    seeds : list
+        Seed of each run
+    years : numpy array
+        Simulated years
+    municipalities : tuple
+        Names of the municipalities
+    munic_adoption : numpy array
+        (runs x municipalities x years) yearly adoption of each municipality,
+        divided by its permanent pastures area
+    yearly_adoption_port : numpy array
+        (runs x years) area adopted in Portugal in each year, in hectares
+    cumul_adoption_port : numpy array
+        (runs x years) total area adopted in Portugal until each year, in
+        hectares
+
+    """
+
+    def __init__(self, seeds, years, municipalities, munic_adoption,
+                 yearly_adoption_port, cumul_adoption_port):
+        self.seeds = list(seeds)
+        self.years = np.asarray(years)
+        self.municipalities = tuple(municipalities)
+        self.munic_adoption = munic_adoption
+        self.yearly_adoption_port = yearly_adoption_port
+        self.cumul_adoption_port = cumul_adoption_port
+
+    @property
+    def run_names(self):
+        return ['Run ' + str(n_run + 1) for n_run in range(len(self.seeds))]
+
+    def municipalities_frame(self):
+        """
+        Return the yearly adoption of the municipalities, with (Municipality,
+        Year) as index and a column per run (as collected in the validation
+        notebook).
+
+        """
+        index = pd.MultiIndex.from_product([self.municipalities, self.years],
+                                           names=['Municipality', 'Year'])
+        data = self.munic_adoption.reshape(len(self.seeds), -1).T
+        return pd.DataFrame(data, index=index, columns=self.run_names)
+
+    def portugal_frame(self, cumulative=False):
+        """
+        Return the yearly (or cumulative) adoption of Portugal in hectares,
+        with the years as index and a column per run.
+
+        """
+        data = (self.cumul_adoption_port if cumulative
+                else self.yearly_adoption_port)
+        return pd.DataFrame(data.T, index=pd.Index(self.years, name='Year'),
+                            columns=self.run_names)
+
+    def save(self, out_folder):
+        """
+        Write the outputs as csv files in out_folder (created if missing):
+            - municipalities_yearly_adoption.csv
+            - portugal_yearly_adoption.csv
+            - portugal_cumulative_adoption.csv
+            - seeds.csv, with the seed of each run
+
+        """
+        out_folder = pathlib.Path(out_folder)
+        out_folder.mkdir(parents=True, exist_ok=True)
+        self.municipalities_frame().to_csv(
+            out_folder / 'municipalities_yearly_adoption.csv'
+            )
+        self.portugal_frame().to_csv(
+            out_folder / 'portugal_yearly_adoption.csv'
+            )
+        self.portugal_frame(cumulative=True).to_csv(
+            out_folder / 'portugal_cumulative_adoption.csv'
+            )
+        pd.Series(self.seeds, index=self.run_names, name='Seed').to_csv(
+            out_folder / 'seeds.csv'
+            )
+
+
+class EnsembleRunner:
+    """
+    Class running an ensemble of SBPAdoption runs, one per seed, on a pool of
+    processes.
+
+    Attributes
+    ----------
+    first_year, last_year : int
+        First and last simulated years
+    workers : int
+        Number of worker processes. With 1, the runs are executed in the main
+        process
+    replicates : int
+        Number of runs simulated together by each task (see run_batch)
+    cache_size : int
+        Maximum number of predictions in the PredictionCache of each worker
+        (0 if the predictions are not cached)
+    cache_hits, cache_misses : int
+        Rows whose prediction was and was not found in the caches of the
+        workers during the last run of the ensemble
+    statistics : EnsembleStatistics or None
+        Statistics of the runs of the last ensemble, if requested. They are
+        updated after each completed batch of runs, so they can be read
+        while the ensemble is running (except when it is resumed, see run)
+    world_kwargs : dict
+        Parameters used by each worker to build its World
+
+    Methods
+    ----------
+    run
+        Run the ensemble and return its EnsembleResults
+
+    """
+
+    def __init__(self,
+                 first_year=1996,
+                 last_year=2021,
+                 workers=None,
+                 replicates=1,
+                 cache_size=0,
+                 ml_clsf_folder=clsf_folder_path,
+                 ml_regr_folder=regr_folder_path,
+                 sbp_payments_path=None,
+                 bundle=None,
+                 verbose=True):
+        """
+        Parameters
+        ----------
+        first_year, last_year : int
+            First and last years to simulate
+        workers : int
+            Number of worker processes. If None, one per CPU
+        replicates : int
+            Number of runs simulated together by each task. With more than 1,
+            the runs are vectorized by a ReplicateEngine (the outputs are the
+            same)
+        cache_size : int
+            Maximum number of predictions of the ML estimators cached by
+            each worker and shared by all its runs. With 0, the predictions
+            are not cached
+        ml_clsf_folder, ml_regr_folder, sbp_payments_path, bundle
+            Parameters of the World of the runs (see World)
+        verbose : bool
+            If True, the progress is printed after each run
+
+        """
+        check_initial_year(first_year)
+        if last_year < first_year:
+            raise ValueError('The last year of the ensemble cannot be '
+                             'previous to the first one.')
+        self.first_year = first_year
+        self.last_year = last_year
+        if replicates < 1:
+            raise ValueError('The number of replicates per task has to be '
+                             'positive.')
+        self.workers = workers or os.cpu_count() or 1
+        self.replicates = replicates
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.statistics = None
+        self.world_kwargs = {'ml_clsf_folder': ml_clsf_folder,
+                             'ml_regr_folder': ml_regr_folder,
+                             'sbp_payments_path': sbp_payments_path,
+                             'bundle': (None if bundle is None
+                                        else str(bundle))}
+        self.verbose = verbose
+
+    def run(self, seeds, sink=None, statistics=False):
+        """
+        Run the model once for each seed.
+
+        Parameters
+        ----------
+        seeds : iterable of int or int
+            Seeds of the runs. If an int n, the seeds are 0, ..., n-1 (as in
+            the validation notebook)
+        sink : SparseResultSink
+            If given, the outputs of the runs are not kept in memory but
+            passed to the sink as soon as they are completed (see the
+            results_sink module). The sink is opened and closed by this
+            method. If the sink resumes an interrupted ensemble, the seeds
+            whose outputs it already holds are not run again
+        statistics : bool
+            If True, the outputs of each batch of runs are also added to the
+            EnsembleStatistics of the statistics attribute (see the
+            ensemble_statistics module). The batches are added in the order
+            of the seeds, whatever the order in which they are completed by
+            the workers, so the statistics (in particular the P-square
+            quantiles, which depend on the order of the runs) are the same
+            with any number of workers. When the sink resumes an ensemble,
+            they are calculated at the end from all the runs of the seeds
+            in the sink, the ones completed before included (see
+            SparseResults.statistics)
+
+        Returns
+        -------
+        EnsembleResults or None
+            None if the outputs were passed to a sink
+
+        """
+        if isinstance(seeds, (int, np.integer)):
+            seeds = range(seeds)
+        seeds = list(seeds)
+        if not seeds:
+            raise ValueError('An ensemble needs at least one seed.')
+        ensemble_seeds = seeds
+        resumed = False
+        if sink is not None:
+            completed = sink.completed_seeds()
+            resumed = bool(completed)
+            if resumed and self.verbose:
+                print('Resuming the ensemble:', len(completed),
+                      'runs already completed.')
+            seeds = [seed for seed in seeds if seed not in completed]
+            if not seeds:
+                if statistics:
+                    self.statistics = _sink_statistics(sink, ensemble_seeds,
+                                                      self.replicates)
+                return None
+        # The statistics of a resumed ensemble are calculated at the end,
+        # from the sink
+        aggregate = statistics and not resumed
+        years = np.arange(self.first_year, self.last_year + 1)
+        batches = [seeds[start:start + self.replicates]
+                   for start in range(0, len(seeds), self.replicates)]
+        outputs = [None] * len(batches)
+        progress = _Progress(len(seeds), self.verbose)
+        # Last counters of the cache of each process
+        cache_counters = {}
+        # Batches completed but not yet added to the statistics, and next
+        # batch to add
+        pending_statistics = {}
+        next_statistics = 0
+
+        def start(names):
+            if aggregate:
+                # Imported here, the workers don't need the statistics
+                from .ensemble_statistics import EnsembleStatistics
+
+                self.statistics = EnsembleStatistics(names, years)
+            if sink is not None:
+                sink.open(names, years)
+
+        def collect(n_batch, batch_outputs):
+            nonlocal next_statistics
+            if aggregate:
+                pending_statistics[n_batch] = batch_outputs
+                while next_statistics in pending_statistics:
+                    self.statistics.update(
+                        *pending_statistics.pop(next_statistics)
+                        )
+                    next_statistics += 1
+            if sink is None:
+                outputs[n_batch] = batch_outputs
+            else:
+                sink.write(batches[n_batch], *batch_outputs)
+            progress.update(batches[n_batch])
+
+        try:
+            if self.workers == 1:
+                world = World(headless=True, **self.world_kwargs)
+                names = world.names
+                start(names)
+                cache = (PredictionCache(self.cache_size) if self.cache_size
+                         else None)
+                for n_batch, batch in enumerate(batches):
+                    collect(n_batch, run_batch(world, batch, self.first_year,
+                                               self.last_year, cache))
+                cache_counters[os.getpid()] = _cache_counters(cache)
+            else:
+                with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=min(self.workers, len(batches)),
+                        initializer=_initialize_worker,
+                        initargs=(self.world_kwargs, self.cache_size)
+                        ) as executor:
+                    names_future = executor.submit(_names_in_worker)
+                    futures = {
+                        executor.submit(_run_in_worker, batch,
+                                        self.first_year,
+                                        self.last_year): n_batch
+                        for n_batch, batch in enumerate(batches)
+                        }
+                    names = names_future.result()
+                    start(names)
+                    for future in concurrent.futures.as_completed(futures):
+                        batch_outputs, pid, counters = future.result()
+                        cache_counters[pid] = max(
+                            cache_counters.get(pid, (0, 0)), counters
+                            )
+                        collect(futures[future], batch_outputs)
+        finally:
+            if sink is not None:
+                sink.close()
+
+        self.cache_hits = sum(hits for hits, _ in cache_counters.values())
+        self.cache_misses = sum(misses for _, misses
+                                in cache_counters.values())
+        if self.verbose and self.cache_size:
+            print('Prediction cache: {} hits, {} misses'.format(
+                self.cache_hits, self.cache_misses
+                ))
+
+        if sink is not None:
+            if statistics and resumed:
+                self.statistics = _sink_statistics(sink, ensemble_seeds,
+                                                      self.replicates)
+            return None
+        munic_adoption, yearly_adoption_port, cumul_adoption_port = (
+            np.concatenate(arrays) for arrays in zip(*outputs)
+            )
+        return EnsembleResults(seeds, years, names, munic_adoption,
+                               yearly_adoption_port, cumul_adoption_port)
+
+
+def _sink_statistics(sink, seeds, runs_per_batch):
+    """
+    Return the EnsembleStatistics of the runs of the seeds written by a sink,
+    added in batches of runs_per_batch runs as the ensemble does.
+
+    """
+    from .results_sink import SparseResults
+
+    return SparseResults(sink.out_folder).statistics(seeds, runs_per_batch)
+
+
+class _Progress:
+    """
+    Printer of the number of runs completed, of the throughput and of the
+    estimated time to the end of the ensemble.
+
+    """
+
+    def __init__(self, n_runs, verbose):
+        self.n_runs = n_runs
+        self.verbose = verbose
+        self.completed = 0
+        self.start = time.perf_counter()
+
+    def update(self, seeds):
+        self.completed += len(seeds)
+        if not self.verbose:
+            return
+        elapsed = time.perf_counter() - self.start
+        throughput = self.completed / elapsed
+        eta = (self.n_runs - self.completed) / throughput
+        seeds = ('seed ' + str(seeds[0]) if len(seeds) == 1
+                 else 'seeds ' + str(seeds[0]) + '-' + str(seeds[-1]))
+        print('Runs {}/{} completed ({}) - {:.2f} runs/s - elapsed {} - '
+              'ETA {}'.format(self.completed, self.n_runs, seeds, throughput,
+                              _format_time(elapsed), _format_time(eta)),
+              flush=True)
+
+
+def _format_time(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{:d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
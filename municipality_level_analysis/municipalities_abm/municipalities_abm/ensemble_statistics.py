@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+"""
+Statistics of the outputs of an ensemble, updated run by run.
+
+The mean and the variance of each output (every municipality-year, and every
+year of the yearly and cumulative adoption of Portugal) are updated with the
+Welford algorithm (in the form of Chan et al. for batches of runs) and the
+quantiles with the P-square algorithm of Jain and Chlamtac, which keeps five
+markers per quantile instead of all the observations. The memory used
+doesn't depend on the number of runs, and the statistics of the runs
+completed so far can be read at any time while the ensemble is running.
+
+The confidence intervals are the ones of the validation notebook: the t
+interval of the mean, with the standard error of the runs.
+
+"""
+
+
+class _PSquareQuantile:
+    """
+    Estimator of a quantile of each element of an array of observations,
+    with the P-square algorithm vectorized over the elements.
+
+    """
+
+    def __init__(self, p, shape):
+        self.p = p
+        self.shape = shape
+        self.count = 0
+        self._first = []
+        self._heights = None
+        self._positions = None
+        self._desired = np.array([1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5])
+        self._increments = np.array([0, p / 2, p, (1 + p) / 2, 1])
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        self.count += 1
+        if self.count <= 5:
+            self._first.append(values)
+            if self.count == 5:
+                self._heights = np.sort(self._first, axis=0)
+                self._positions = np.tile(np.arange(1., 6.)[:, None],
+                                          (1, len(values)))
+            return
+
+        heights, positions = self._heights, self._positions
+        heights[0] = np.minimum(heights[0], values)
+        heights[4] = np.maximum(heights[4], values)
+        cell = (values >= heights[1:4]).sum(axis=0)
+        positions += np.arange(5)[:, None] > cell
+        self._desired = self._desired + self._increments
+
+        for i in range(1, 4):
+            delta = self._desired[i] - positions[i]
+            move = (((delta >= 1) & (positions[i + 1] - positions[i] > 1))
+                    | ((delta <= -1) & (positions[i - 1] - positions[i] < -1)))
+            if not move.any():
+                continue
+            sign = np.where(delta >= 0, 1., -1.)
+            q_prev, q_i, q_next = heights[i - 1], heights[i], heights[i + 1]
+            n_prev, n_i, n_next = (positions[i - 1], positions[i],
+                                   positions[i + 1])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q_i + sign / (n_next - n_prev) * (
+                    (n_i - n_prev + sign) * (q_next - q_i) / (n_next - n_i)
+                    + (n_next - n_i - sign) * (q_i - q_prev) / (n_i - n_prev)
+                    )
+                linear = np.where(
+                    sign > 0,
+                    q_i + (q_next - q_i) / (n_next - n_i),
+                    q_i - (q_prev - q_i) / (n_prev - n_i)
+                    )
+            new_height = np.where((q_prev < parabolic) & (parabolic < q_next),
+                                  parabolic, linear)
+            heights[i] = np.where(move, new_height, q_i)
+            positions[i] = np.where(move, n_i + sign, n_i)
+
+    def value(self):
+        if self.count == 0:
+            return np.full(self.shape, np.nan)
+        if self.count <= 5:
+            return np.quantile(self._first, self.p, axis=0).reshape(self.shape)
+        return self._heights[2].reshape(self.shape)
+
+
+class RunningStatistics:
+    """
+    Class updating the mean, the variance and some quantiles of each element
+    of the outputs of the runs.
+
+    Attributes
+    ----------
+    shape : tuple
+        Shape of the output of a run
+    quantiles : tuple
+        Probabilities of the quantiles estimated
+    count : int
+        Number of runs observed
+    mean : numpy array
+        Mean of each element
+
+    Methods
+    ----------
+    update
+        Add the outputs of some runs
+    variance, std, sem
+        Variance, standard deviation and standard error of the mean
+    confidence_interval
+        t confidence interval of the mean
+    quantile
+        Estimate of a quantile
+    summary
+        All the statistics of each element
+
+    """
+
+    def __init__(self, shape, quantiles=(0.025, 0.5, 0.975)):
+        self.shape = tuple(shape)
+        self.quantiles = tuple(quantiles)
+        self.count = 0
+        self.mean = np.zeros(self.shape)
+        self._m2 = np.zeros(self.shape)
+        self._quantiles = {p: _PSquareQuantile(p, self.shape)
+                           for p in self.quantiles}
+
+    def update(self, outputs):
+        """
+        Add the outputs of some runs, stacked on the first dimension.
+
+        """
+        outputs = np.asarray(outputs, dtype=float)
+        if outputs.shape[1:] != self.shape:
+            raise ValueError('The outputs have shape ' + str(outputs.shape[1:])
+                             + ' instead of ' + str(self.shape) + '.')
+        n_new = len(outputs)
+        if not n_new:
+            return
+        new_mean = outputs.mean(axis=0)
+        new_m2 = ((outputs - new_mean) ** 2).sum(axis=0)
+        total = self.count + n_new
+        delta = new_mean - self.mean
+        self.mean = self.mean + delta * n_new / total
+        self._m2 = self._m2 + new_m2 + delta ** 2 * self.count * n_new / total
+        self.count = total
+        for run_outputs in outputs:
+            for estimator in self._quantiles.values():
+                estimator.update(run_outputs)
+
+    def variance(self, ddof=1):
+        if self.count <= ddof:
+            return np.full(self.shape, np.nan)
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof=1):
+        return np.sqrt(self.variance(ddof))
+
+    def sem(self):
+        return self.std() / np.sqrt(self.count)
+
+    def confidence_interval(self, confidence=0.95):
+        """
+        Return the lower and upper bounds of the t confidence interval of the
+        mean of each element (NaN with less than two runs).
+
+        """
+        if self.count < 2:
+            nan = np.full(self.shape, np.nan)
+            return nan, nan
+        # Imported here, scipy.stats is slow to import and is needed only
+        # for the outputs
+        import scipy.stats
+
+        half_width = self.sem() * scipy.stats.t.ppf((1 + confidence) / 2.,
+                                                    self.count - 1)
+        return self.mean - half_width, self.mean + half_width
+
+    def quantile(self, p):
+        try:
+            return self._quantiles[p].value()
+        except KeyError:
+            raise KeyError('The quantile ' + str(p) + ' is not estimated.')
+
+    def summary(self, confidence=0.95):
+        """
+        Return a dict mapping the name of each statistic (mean, std, ci_low,
+        ci_high and one per quantile, as q0.5) to its array.
+
+        """
+        ci_low, ci_high = self.confidence_interval(confidence)
+        summary = {'mean': self.mean, 'std': self.std(),
+                   'ci_low': ci_low, 'ci_high': ci_high}
+        for p in self.quantiles:
+            summary['q' + str(p)] = self.quantile(p)
+        return summary
+
+
+class EnsembleStatistics:
+    """
+    Class aggregating the outputs of the runs of an ensemble as they are
+    completed (see EnsembleRunner.run).
+
+    Attributes
+    ----------
+    municipalities : tuple
+        Names of the municipalities
+    years : numpy array
+        Simulated years
+    confidence : float
+        Confidence level of the intervals
+    municipalities_stats : RunningStatistics
+        Statistics of the yearly adoption of each municipality-year, divided
+        by the permanent pastures area
+    yearly_port_stats, cumul_port_stats : RunningStatistics
+        Statistics of the yearly and cumulative adoption of Portugal in each
+        year, in hectares
+
+    Methods
+    ----------
+    update
+        Add the outputs of some runs
+    municipalities_frame, portugal_frame
+        Return the statistics as DataFrames
+    save
+        Write the statistics as csv files
+
+    """
+
+    def __init__(self, municipalities, years,
+                 quantiles=(0.025, 0.5, 0.975), confidence=0.95):
+        """
+        Parameters
+        ----------
+        municipalities : list
+            Names of the municipalities
+        years : list
+            Simulated years
+        quantiles : tuple
+            Probabilities of the quantiles to estimate
+        confidence : float
+            Confidence level of the intervals of the means
+
+        """
+        self.municipalities = tuple(municipalities)
+        self.years = np.asarray(years)
+        self.confidence = confidence
+        self.municipalities_stats = RunningStatistics(
+            (len(self.municipalities), len(self.years)), quantiles
+            )
+        self.yearly_port_stats = RunningStatistics((len(self.years), ),
+                                                   quantiles)
+        self.cumul_port_stats = RunningStatistics((len(self.years), ),
+                                                  quantiles)
+
+    @property
+    def n_runs(self):
+        return self.yearly_port_stats.count
+
+    def update(self, munic_adoption, yearly_adoption_port,
+               cumul_adoption_port):
+        """
+        Add the outputs of some runs (as returned by ensemble.run_batch).
+        The quantiles are estimates that depend on the order in which the
+        runs are added (EnsembleRunner.run adds them in the order of the
+        seeds).
+
+        """
+        self.municipalities_stats.update(munic_adoption)
+        self.yearly_port_stats.update(yearly_adoption_port)
+        self.cumul_port_stats.update(cumul_adoption_port)
+
+    def municipalities_frame(self):
+        """
+        Return the statistics of the yearly adoption of the municipalities,
+        with (Municipality, Year) as index and a column per statistic.
+
+        """
+        index = pd.MultiIndex.from_product([self.municipalities, self.years],
+                                           names=['Municipality', 'Year'])
+        summary = self.municipalities_stats.summary(self.confidence)
+        return pd.DataFrame({name: values.ravel()
+                             for name, values in summary.items()},
+                            index=index)
+
+    def portugal_frame(self, cumulative=False):
+        """
+        Return the statistics of the yearly (or cumulative) adoption of
+        Portugal in hectares, with the years as index and a column per
+        statistic.
+
+        """
+        stats = self.cumul_port_stats if cumulative else self.yearly_port_stats
+        return pd.DataFrame(stats.summary(self.confidence),
+                            index=pd.Index(self.years, name='Year'))
+
+    def save(self, out_folder):
+        """
+        Write the statistics as csv files in out_folder:
+            - municipalities_adoption_statistics.csv
+            - portugal_yearly_adoption_statistics.csv
+            - portugal_cumulative_adoption_statistics.csv
+
+        """
+        out_folder = pathlib.Path(out_folder)
+        out_folder.mkdir(parents=True, exist_ok=True)
+        self.municipalities_frame().to_csv(
+            out_folder / 'municipalities_adoption_statistics.csv'
+            )
+        self.portugal_frame().to_csv(
+            out_folder / 'portugal_yearly_adoption_statistics.csv'
+            )
+        self.portugal_frame(cumulative=True).to_csv(
+            out_folder / 'portugal_cumulative_adoption_statistics.csv'
+            )
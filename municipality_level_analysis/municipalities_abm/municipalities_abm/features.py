@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+"""
+Assembly of the input features of the ML estimators.
+
+The census, climate, soil and pastures area features of the municipalities
+don't change during a run: their columns are written once, in the order of the
+features.csv file of the estimator, in a contiguous float matrix
+(municipalities x features). At each step only the columns of the adoption
+features (and the SBP payment for the regressor) are written again, in place.
+The matrix can hold the rows of several replicates of the model (see the
+replicates module): the rows of each replicate are contiguous, so the row of
+municipality i of replicate r is r * municipalities + i.
+
+"""
+
+# Features that change at every step, for all the estimators
+ADOPTION_FEATURES = ('adoption_pr_y_munic',
+                     'adoption_pr_y_port',
+                     'adoption_pr_y_neighbours_adj',
+                     'tot_cumul_adoption_pr_y_munic',
+                     'tot_cumul_adoption_pr_y_neighbours_adj',
+                     'tot_cumul_adoption_pr_y_port')
+
+# Feature that changes at every step, only for the regressor
+PAYMENT_FEATURE = 'sbp_payment'
+
+
+class FeatureAssembler:
+    """
+    Class assembling the matrix of the features of an ML estimator for all
+    the municipalities of a model.
+
+    Attributes
+    ----------
+    features : tuple
+        Names of the features, in the order expected by the estimator
+    estimator : str
+        "clsf" or "regr"
+    dynamic_features : tuple
+        Names of the features written again at every step
+    n_replicates : int
+        Number of replicates whose rows are in the matrix
+    matrix : numpy array
+        (replicates * municipalities x features) matrix, updated in place by
+        assemble and write
+
+    Methods
+    ----------
+    assemble
+        Write the adoption features of the current year of a model in the
+        matrix
+    write
+        Write the dynamic features of a year in the matrix
+    rows
+        Return the rows of the matrix of some municipalities
+
+    """
+
+    def __init__(self, features, world, estimator, n_replicates=1):
+        """
+        Resolve the position of each feature and fill the static columns.
+
+        Parameters
+        ----------
+        features : list
+            Names of the features, in the order expected by the estimator
+        world : World
+            Static state of the model
+        estimator : str
+            "clsf" or "regr". Only the regressor gets the SBP payment
+        n_replicates : int
+            Number of replicates of the model whose rows are held
+
+        Raises
+        ------
+        ValueError
+            Raised if any of the features is neither an adoption feature nor
+            a static feature of the world
+
+        """
+        self.features = tuple(features)
+        self.estimator = estimator
+        self.n_replicates = n_replicates
+
+        dynamic_features = ADOPTION_FEATURES
+        if estimator == 'regr':
+            dynamic_features += (PAYMENT_FEATURE, )
+        static_features = world.static_features
+
+        missing_attr = [feat for feat in self.features
+                        if feat not in dynamic_features
+                        and feat not in static_features]
+        if missing_attr:
+            raise ValueError("The following attributes to input to the machine"
+                             " learning model are missing: "
+                             + ", ".join(missing_attr))
+
+        self.matrix = np.zeros((n_replicates * len(world),
+                                len(self.features)))
+        self._replicates_matrix = self.matrix.reshape(n_replicates,
+                                                      len(world), -1)
+        self._dynamic_columns = []
+        for col, feat in enumerate(self.features):
+            if feat in dynamic_features:
+                self._dynamic_columns.append((col, feat))
+            else:
+                self._replicates_matrix[:, :, col] = static_features[feat]
+        self.dynamic_features = tuple(feat for _, feat
+                                      in self._dynamic_columns)
+
+        self._rows_buffer = np.empty_like(self.matrix)
+        self._assembled_year = None
+
+    def invalidate(self):
+        """
+        Force the adoption features to be written again at the next call of
+        assemble (called when the adoption state of the model is reset).
+
+        """
+        self._assembled_year = None
+
+    def assemble(self, model):
+        """
+        Write the adoption features of the current year of the model (and the
+        payment for the regressor) in the matrix and return it. During a year
+        the adoption state changes only after all the predictions, so the
+        columns are written only at the first call of the year.
+
+        Parameters
+        ----------
+        model : SBPAdoption
+            Model whose adoption state is used
+
+        Returns
+        -------
+        numpy array
+            The (municipalities x features) matrix. It is overwritten in the
+            following years, so it has to be copied to be kept
+
+        """
+        year = model.year
+        if self._assembled_year == year:
+            return self.matrix
+
+        state = model.adoption_state
+        adoption_pr_y_neigh, cumul_adoption_neigh = (
+            model.get_neighbors_adoption('tot')
+            )
+        values = {
+            'adoption_pr_y_munic': state.adoption_in(year - 1),
+            'adoption_pr_y_port': model.adoption_pr_y_port,
+            'adoption_pr_y_neighbours_adj': adoption_pr_y_neigh,
+            'tot_cumul_adoption_pr_y_munic': state.cumul_adoption_tot,
+            'tot_cumul_adoption_pr_y_neighbours_adj': cumul_adoption_neigh,
+            'tot_cumul_adoption_pr_y_port': model.cumul_adoption_tot_port
+            }
+        if PAYMENT_FEATURE in self.dynamic_features:
+            values[PAYMENT_FEATURE] = model.government.retrieve_payments(year)
+        return self.write(year, values)
+
+    def write(self, year, values):
+        """
+        Write the dynamic features of the year in the matrix and return it.
+
+        Parameters
+        ----------
+        year : int
+            Year of the values
+        values : dict
+            Maps each dynamic feature to its values, broadcastable to
+            (replicates x municipalities): a scalar for a value shared by
+            all, a (replicates x 1) array for a value of each replicate (as
+            the adoption of Portugal) or a (municipalities, ) vector for a
+            value of each municipality
+
+        Returns
+        -------
+        numpy array
+            The matrix
+
+        """
+        for col, feat in self._dynamic_columns:
+            self._replicates_matrix[:, :, col] = values[feat]
+        self._assembled_year = year
+        return self.matrix
+
+    def rows(self, munic_idx):
+        """
+        Return the rows of the matrix of the municipalities with the indexes
+        given, gathered in a buffer allocated once (overwritten by the next
+        call).
+
+        """
+        out = self._rows_buffer[:len(munic_idx)]
+        return np.take(self.matrix, munic_idx, axis=0, out=out)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import pathlib
+
+import pandas as pd
+
+from .model_inputs import (municipalities_shp_path, census_data_path,
+                           adoption_data_path, av_climate_data_path,
+                           soil_data_path, sbp_payments_path)
+
+"""
+Functions loading the input data of the model from the original files.
+
+Each function returns the data as used by the model, i.e. already transformed
+with the relative custom transformer when needed.
+geopandas and the custom transformers (and so scikit-learn) are imported only
+by the functions using them, so that importing the package does not load
+them.
+
+"""
+
+
+def load_municipalities_shapefile(path=municipalities_shp_path,
+                                  geometry=True):
+    """
+    Load the shapefile of the municipalities and check that it has no missing
+    values.
+
+    Parameters
+    ----------
+    geometry : bool
+        If False, only the attribute table is read, without parsing the
+        geometries
+
+    Returns
+    -------
+    municipalities_data : geopandas GeoDataFrame or pandas DataFrame
+        Shape (if requested) and attributes of each municipality.
+
+    """
+    import geopandas as gpd
+
+    municipalities_data = gpd.read_file(path, ignore_geometry=not geometry)
+    municipalities_data.rename(columns={'Municipali': 'Municipality'},
+                               inplace=True)
+
+    data_is_null = municipalities_data.isnull()
+    if data_is_null.values.any():
+        munic_with_nan = municipalities_data[
+                            data_is_null.any(axis=1)].index.tolist()
+        raise ValueError('The municipalities dataset is missing values for'
+                         ' the following municipalities: ' +
+                         ', '.join(map(str, munic_with_nan)))
+    return municipalities_data
+
+
+def load_census_data(path=census_data_path):
+    """
+    Load the census data of the municipalities and transform them for the ML
+    models.
+
+    """
+    from .custom_transformers import TransformCensusFeatures
+
+    census_data = pd.read_csv(path, index_col='Municipality')
+    return TransformCensusFeatures().fit_transform(census_data)
+
+
+def load_adoption_data(path=adoption_data_path):
+    """
+    Load the yearly adoption of each municipality, divided by its permanent
+    pastures area. The columns (the years) are returned as integers.
+
+    """
+    adoption_data = pd.read_csv(path, index_col='Municipality')
+    adoption_data.columns = adoption_data.columns.astype(int)
+    return adoption_data
+
+
+def load_climate_data(path=av_climate_data_path):
+    """
+    Load the average climate data of the municipalities and transform them for
+    the ML models.
+
+    """
+    from .custom_transformers import TransformClimateFeatures
+
+    average_climate_data = pd.read_csv(path, index_col=['Municipality'])
+    return TransformClimateFeatures().fit_transform(average_climate_data)
+
+
+def load_soil_data(path=soil_data_path):
+    """
+    Load the soil data of the municipalities and transform them for the ML
+    models.
+
+    """
+    from .custom_transformers import TransformSoilFeatures
+
+    soil_data = pd.read_csv(path, index_col=['Municipality'])
+    return TransformSoilFeatures().fit_transform(soil_data)
+
+
+def load_sbp_payments(path=sbp_payments_path):
+    """
+    Load the payment offered for SBP in each year, indexed by year, from an
+    xlsx or a csv file (see the policy_schedule module for the columns).
+
+    """
+    if pathlib.Path(path).suffix.lower() == '.csv':
+        return pd.read_csv(path, index_col='Year')
+    return pd.read_excel(path, index_col='Year')
+
+
+def align_on_municipalities(data, names, dataset_name):
+    """
+    Return the rows of a dataset indexed by municipality in the order of
+    names.
+
+    Parameters
+    ----------
+    data : pandas DataFrame
+        Dataset indexed by the name of the municipalities
+    names : pandas Series
+        Names of the municipalities, in the order wanted
+    dataset_name : str
+        Name of the dataset, used in the error message
+
+    Raises
+    ------
+    ValueError
+        Raised if the dataset is missing any of the municipalities
+
+    """
+    missing = names[~names.isin(data.index)]
+    if not missing.empty:
+        raise ValueError(dataset_name + ' data are missing for the following'
+                         ' municipalities: ' + ', '.join(missing))
+    return data.reindex(names.values)
+
+
+def join_on_municipalities(datasets, names):
+    """
+    Join several datasets indexed by municipality in a single DataFrame
+    aligned on names, checking in a single vectorized pass that no value is
+    missing.
+
+    Parameters
+    ----------
+    datasets : dict
+        Maps the name of each dataset (used in the error message) to the
+        DataFrame, indexed by the name of the municipalities
+    names : sequence of str
+        Names of the municipalities, in the order wanted
+
+    Raises
+    ------
+    ValueError
+        Raised if any dataset is missing any of the municipalities or has
+        missing values for them, reporting all of them at once
+
+    Returns
+    -------
+    pandas DataFrame
+        DataFrame indexed by names, with as columns a MultiIndex with the
+        name of the dataset on the first level (so that dataset can be
+        retrieved with joined[dataset_name])
+
+    """
+    joined = pd.concat(datasets, axis=1).reindex(
+        pd.Index(names, name='Municipality')
+        )
+    missing = joined.isnull().T.groupby(level=0, sort=False).any().T
+    if missing.values.any():
+        messages = [dataset_name + ' data are missing for the following '
+                    'municipalities: ' + ', '.join(
+                        missing.index[missing[dataset_name]]
+                        )
+                    for dataset_name in missing.columns
+                    if missing[dataset_name].any()]
+        raise ValueError('\n'.join(messages))
+    return joined
+
+
+def shapefile_paths(path=municipalities_shp_path):
+    """
+    Return the paths of all the files composing a shapefile (.shp, .shx,
+    .dbf, .prj, ...), sorted by name.
+
+    """
+    path = pathlib.Path(path)
+    return sorted(path.parent.glob(path.stem + '.*'))
+
+
+def hash_files(paths):
+    """
+    Calculate the SHA-256 digest of the content of a sequence of files.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest, changing if the content of any file changes.
+
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(pathlib.Path(path).name.encode())
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
@@ -1,47 +1,77 @@
 # -*- coding: utf-8 -*-
 
-import pandas as pd
-
 class Mappings:
     """
-    Class storing all the identificative string - object mappings.
+    Class storing all the identificative string - object mappings of a
+    model.
+
+    Each SBPAdoption instance has its own Mappings (its mappings attribute),
+    so several models can run side by side in the same process. The objects
+    are stored by index of the municipality (its position in the data of the
+    World, i.e. its index attribute), and the names are only used to find
+    that index.
 
     Attributes
     ----------
-    municipialities : dict
-        Links each Municipality object (the values) to a string representing
-        their name (the keys)
+    municipalities : tuple
+        Municipality objects, by index
+    environments : tuple
+        MunicipalityEnvironment objects, by index
+    indexes : dict
+        Maps the name of each municipality to its index
 
     Methods
     ----------
+    get_municipality
+        Retrieve a Municipality object from its name
+    get_environment
+        Retrieve a MunicipalityEnvironment object from the name of its
+        municipality
 
     """
 
-    def __init__(self):
+    def __init__(self, municipalities=(), environments=()):
+        """
+        Parameters
+        ----------
+        municipalities : list
+            Municipality objects, ordered by index
+        environments : list
+            MunicipalityEnvironment objects, in the same order
 
-        self.municipalities = pd.Series()
-        self.environments = pd.Series()
+        """
+        self.municipalities = tuple(municipalities)
+        self.environments = tuple(environments)
+        self.indexes = {munic.Municipality: i
+                        for i, munic in enumerate(self.municipalities)}
 
-    # def from_municipality_get_farms(self, municipality):
-    #     """
-    #     Method to retrieve the farms located in a certain municipality.
+    def get_municipality(self, name):
+        """
+        Return the Municipality object with the name given.
 
-    #     Parameters
-    #     ----------
-    #     municipality : str
-    #         Name of the municipality to retrieve the farms located in
+        Raises
+        ------
+        KeyError
+            Raised if no municipality has that name
 
-    #     Returns
-    #     -------
-    #     list
-    #         List of Farm objects located in the municipality
+        """
+        try:
+            return self.municipalities[self.indexes[name]]
+        except KeyError:
+            raise KeyError('No municipality called ' + str(name) + '.')
 
-    #     """
-    #     if municipality not in self.municipalities:
-    #         print('No municipality called ' + municipality + ".")
-    #     else:
-    #         farms_in_munic = self.municipalities[municipality].farms
-    #         return [self.farms[str] for str in farms_in_munic]
+    def get_environment(self, name):
+        """
+        Return the MunicipalityEnvironment object of the municipality with the
+        name given.
 
+        Raises
+        ------
+        KeyError
+            Raised if no municipality has that name
 
-mappings = Mappings()
+        """
+        try:
+            return self.environments[self.indexes[name]]
+        except KeyError:
+            raise KeyError('No municipality called ' + str(name) + '.')
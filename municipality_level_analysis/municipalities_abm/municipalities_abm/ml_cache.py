@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import hashlib
+import os
+import pathlib
+
+import numpy as np
+
+from .atomic_files import save_atomically
+from .model_inputs import ml_cache_folder_path
+
+"""
+Content-addressed cache of the fitted ML models.
+
+The estimators saved in the ml_model folders are not fitted: they have to be
+fitted on dataset.csv and labels.csv before being used by the model. Since
+fitting them (in particular the SVM and ExtraTrees models) is the most
+expensive part of the instantiation of SBPAdoption, the fitted estimator is
+stored once in the cache folder under a key calculated from the content of
+all the files it depends on (model.pkl, dataset.csv, labels.csv and
+features.csv) and on the version of scikit-learn. A change in any of these
+inputs changes the key, so the stale entry is simply not used anymore.
+joblib and scikit-learn are imported only when an estimator is loaded.
+
+"""
+
+ML_MODEL_FILES = ('model.pkl', 'dataset.csv', 'labels.csv', 'features.csv')
+
+# Fitted estimators already loaded in this process, mapped by their key
+_fitted_estimators = {}
+
+
+def get_ml_model_key(ml_folder):
+    """
+    Calculate the key identifying the fitted estimator of a ML model folder.
+
+    Parameters
+    ----------
+    ml_folder : path str
+        Path to the folder where the ML model, its training dataset and labels
+        and the name of its features are located
+
+    Returns
+    -------
+    str
+        Hexadecimal SHA-256 digest of the content of the files of the folder
+        and of the scikit-learn version.
+
+    """
+    import sklearn
+
+    digest = hashlib.sha256()
+    digest.update(sklearn.__version__.encode())
+    for file_name in ML_MODEL_FILES:
+        digest.update(file_name.encode())
+        with open(os.path.join(ml_folder, file_name), 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_ml_features(ml_folder):
+    """
+    Return the list of the names of the features of a ML model, in the order
+    expected by the estimator.
+
+    """
+    with open(os.path.join(ml_folder, 'features.csv')) as inputfile:
+        rd = csv.reader(inputfile)
+        return list(rd)[0]
+
+
+def fit_ml_model(ml_folder):
+    """
+    Load the estimator of a ML model folder and fit it on its dataset.
+
+    Returns
+    -------
+    estimator : sklearn estimator
+        The estimator fitted on dataset.csv and labels.csv
+
+    """
+    import joblib
+
+    estimator = joblib.load(os.path.join(ml_folder, 'model.pkl'))
+    dataset = np.genfromtxt(os.path.join(ml_folder, 'dataset.csv'),
+                            delimiter=',')
+    labels = np.genfromtxt(os.path.join(ml_folder, 'labels.csv'),
+                           delimiter=',')
+    estimator.fit(dataset, labels)
+    return estimator
+
+
+def load_fitted_ml_model(ml_folder, cache_folder=ml_cache_folder_path):
+    """
+    Return the fitted estimator of a ML model folder, fitting it only if it
+    is not already in the cache.
+
+    Parameters
+    ----------
+    ml_folder : path str
+        Path to the folder where the ML model, its training dataset and labels
+        and the name of its features are located
+    cache_folder : path str or None
+        Path to the folder where the fitted estimators are stored. If None,
+        the estimator is fitted without using the cache.
+
+    Returns
+    -------
+    estimator : sklearn estimator
+        The fitted estimator
+
+    """
+    if cache_folder is None:
+        return fit_ml_model(ml_folder)
+
+    key = get_ml_model_key(ml_folder)
+    if key in _fitted_estimators:
+        return _fitted_estimators[key]
+
+    import joblib
+
+    cache_path = pathlib.Path(cache_folder) / (key + '.pkl')
+    try:
+        estimator = joblib.load(cache_path)
+    except Exception:
+        # Missing entry, or one that cannot be loaded anymore (damaged file,
+        # class changed or removed): the estimator is fitted again and the
+        # entry overwritten
+        estimator = fit_ml_model(ml_folder)
+        _store_in_cache(estimator, cache_path)
+
+    _fitted_estimators[key] = estimator
+    return estimator
+
+
+def _store_in_cache(estimator, cache_path):
+    """
+    Called by load_fitted_ml_model.
+
+    Dump the estimator atomically in the cache (see the atomic_files module).
+
+    """
+    import joblib
+
+    save_atomically(cache_path,
+                    lambda tmp_file: joblib.dump(estimator, tmp_file))
+
+
+def clear_ml_cache(cache_folder=ml_cache_folder_path):
+    """
+    Remove all the fitted estimators from the cache folder and from memory.
+
+    """
+    _fitted_estimators.clear()
+    cache_folder = pathlib.Path(cache_folder)
+    if cache_folder.exists():
+        for cache_file in cache_folder.glob('*.pkl'):
+            cache_file.unlink()
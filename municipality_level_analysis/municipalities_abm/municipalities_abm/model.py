@@ -1,25 +1,25 @@
 # -*- coding: utf-8 -*-
 
 
-import pandas as pd
-import geopandas as gpd
+import json
+
 import numpy as np
-import os
-import pathlib
-import csv
-import joblib
 
 import mesa
 import mesa.time
 import mesa.datacollection
-import mesa_geo
 
 from . import agents
-from .mapping_class import mappings
-from .model_inputs import sbp_payments_path, clsf_folder_path, regr_folder_path
-from .custom_transformers import (TransformCensusFeatures,
-                                  TransformClimateFeatures,
-                                  TransformSoilFeatures)
+from .atomic_files import save_atomically
+from .adoption_state import (AdoptionState, check_initial_year,
+                             clamp_adoptions)
+from .features import FeatureAssembler
+from .mapping_class import Mappings
+from .model_inputs import clsf_folder_path, regr_folder_path
+from .prediction_cache import CachedEstimator
+from .random_streams import RandomStreams
+from .topology import GEO_CRS
+from .world import World
 
 
 # Functions for datacollector
@@ -35,7 +35,7 @@ def get_total_area_adopted(model):
         Total area switched to SBP in Portugal since 1996.
 
     """
-    total_area_pt = model.yearly_adoption_ha_port.cumsum()[model.year]
+    total_area_pt = model.adoption_state.total_adoption_ha_port(model.year)
     return total_area_pt
 
 
@@ -43,9 +43,36 @@ class SBPAdoption(mesa.Model):
     """
     Model for SBP adoption.
 
+    All the static data (geometries, neighbours, census, climate and soil
+    data, ML models and payments) are held by a World object, that can be
+    shared by several models: the model itself only holds the adoption state
+    of the run.
+
+    In headless mode no GeoSpace is built and the municipalities are
+    HeadlessMunicipality agents without geometry: the adoption trajectories
+    are the same as in the geo mode, but the model cannot be visualized on a
+    map.
+
     Attributes #TO UPDATE
     ----------
-    municipalities_data : pd dataframe
+    world : World
+        Static state of the model
+    headless : bool
+        True if the model runs without GeoSpace and geometries
+    grid : mesa_geo GeoSpace or None
+        Space of the municipalities (None in headless mode)
+    mappings : Mappings
+        Registry of the municipalities and environments of this model, to
+        retrieve them through the names of the municipalities
+    random_streams : RandomStreams
+        Streams of the adoption draws of the run, derived from its seed (see
+        the random_streams module)
+    prediction_cache : PredictionCache or None
+        Cache of the predictions of the ML estimators, kept across resets and
+        possibly shared with other models
+    profiler : StepProfiler or None
+        Instrumentation of the phases of the steps, if enabled (see
+        enable_profiling)
 
 
     """
@@ -54,8 +81,13 @@ class SBPAdoption(mesa.Model):
                  ml_clsf_folder=clsf_folder_path,
                  ml_regr_folder=regr_folder_path,
                  initial_year=1996,
-                 sbp_payments_path=sbp_payments_path,
-                 seed=None):
+                 sbp_payments_path=None,
+                 seed=None,
+                 bundle=None,
+                 world=None,
+                 headless=False,
+                 batched_inference=True,
+                 prediction_cache=None):
         """
         Initalization of the model.
 
@@ -66,7 +98,9 @@ class SBPAdoption(mesa.Model):
             start (the adoptions from this year will be predicted)
         sbp_payments_path : path str
             Path to the spreadsheed with the total payment in €/hectare 
-            provided by the Portuguese Carbon Fund for each year
+            provided by the Portuguese Carbon Fund for each year. If None,
+            the payments of the bundle or, without a bundle, the default
+            spreadsheet are used
         clsf_folder_path : path str
             Path to the folder where the ML classifier model and the name of its
             features are located
@@ -74,70 +108,136 @@ class SBPAdoption(mesa.Model):
             Path to the folder where the ML regressor model and the name of its
             features are located
         seed : int
-            Seed for pseudonumber generation
+            Seed for pseudonumber generation. The adoption draws of each year
+            are derived from it (see the random_streams module), so the same
+            seed gives the same trajectory in serial, batched or parallel
+            runs
+        bundle : ScenarioBundle or path str
+            Scenario bundle (see the bundle module) from which all the input
+            data are loaded instead of the original files. If None, the data
+            are loaded from the original files
+        world : World
+            Static state of the model. If given, it is used as it is and the
+            ml_clsf_folder, ml_regr_folder, sbp_payments_path and bundle
+            parameters are ignored. If None, a new World is built from them
+        headless : bool
+            If True, the model is built without GeoSpace and geometries (and
+            a new World is built headless too)
+        batched_inference : bool
+            If True, at each step the adoption of all the municipalities is
+            predicted with a single call to each ML estimator. If False, each
+            municipality calls the estimators in its own step method. The
+            results are the same
+        prediction_cache : PredictionCache
+            Cache through which the ML estimators are called (see the
+            prediction_cache module). It can be shared by all the models of
+            an ensemble built on the same World. If None, the estimators are
+            called directly
 
         """
 
         super().__init__()
-
-        # Add mappings as an attribute since once the model runs, possible to
-        # extract the municipalities through their names
-        self.mappings = mappings
+        self._seed = seed
+
+        check_initial_year(initial_year)
+        self._initial_year = initial_year
+        self._year = initial_year
+
+        if world is None:
+            world = World(ml_clsf_folder, ml_regr_folder, sbp_payments_path,
+                          bundle, headless)
+        elif world.headless and not headless:
+            raise ValueError("A headless World can only be used by a model "
+                             "in headless mode.")
+        self._world = world
+        self._headless = headless
+        self.batched_inference = batched_inference
+        self._prediction_cache = prediction_cache
+        if prediction_cache is None:
+            self._ml_clsf, self._ml_regr = world.ml_clsf, world.ml_regr
+        else:
+            self._ml_clsf = CachedEstimator(world.ml_clsf, prediction_cache)
+            self._ml_regr = CachedEstimator(world.ml_regr, prediction_cache)
 
         self.schedule = mesa.time.SimultaneousActivation(self)
-        self.grid = mesa_geo.GeoSpace()
-
-        if (initial_year < 1996):
-            raise ValueError("The model cannot be initialized in a year "
-                             "previous to 1996")
+        if headless:
+            self.grid = None
         else:
-            self._year = initial_year
+            import mesa_geo
+            self.grid = mesa_geo.GeoSpace()
 
-        self._ml_clsf = None
-        self._ml_clsf_feats = None
-        self._ml_regr = None
-        self._ml_regr_feats = None
-        self._upload_ml_models(ml_clsf_folder, ml_regr_folder)
+        self._random_streams = RandomStreams(seed, len(world))
 
-        self.government = self._initialize_government(sbp_payments_path)
+        self.government = agents.Government(self.next_id(), self,
+                                            world.policy_schedule)
 
-        self.perm_pastures_ha_port = None
-        self.yearly_adoption_ha_port = None
-        self.cumul_adoption_10y_ha_port = None
-        self.cumul_adoption_tot_ha_port = None
-        self.adoption_pr_y_port = None
-        self.cumul_adoption_10y_port = None
-        self.cumul_adoption_tot_port = None
-        self._initialize_municipalities_and_adoption()
+        self.mappings = None
+        self._initialize_municipalities()
+        self._register_in_mappings()
 
-        self._initialize_environments()
+        self._feature_assemblers = {
+            'clsf': FeatureAssembler(world.ml_clsf_feats, world, 'clsf'),
+            'regr': FeatureAssembler(world.ml_regr_feats, world, 'regr')
+            }
 
-        # Attribute updated by the municipalities to calculate total adoption
-        # in the year in Portugal
-        self._adoption_in_year_port_ha = 0
+        self._adoption_state = None
+        self._neighbors_adoption = None
+        self._initialize_adoption()
 
-        self.datacollector = mesa.datacollection.DataCollector(
-            # agent_reporters={
-            #     'FARM_ID': lambda a: a.code,
-            #     'Pasture': lambda a: a.farm.pasture_type.type},
-            model_reporters={
-                'Year': lambda m: m.year,
-                'Total area of SBP sown [ha]': get_total_area_adopted,
-                'Area sown in the last year [ha/y]': (
-                    lambda m: m.yearly_adoption_ha_port[m.year]
-                    )
-                })
+        self.datacollector = None
+        self._initialize_datacollector()
 
-        # Section of code for visualization, to not start from 0 in the chart
-        # if there was adoption in the year before
-        dc_vars = self.datacollector.model_vars
-        dc_vars['Year'].append(self.year - 1)
-        dc_vars['Total area of SBP sown [ha]'].append(
-            self.yearly_adoption_ha_port.cumsum()[self.year - 1]
-            )
-        dc_vars['Area sown in the last year [ha/y]'].append(
-            self.yearly_adoption_ha_port[self.year - 1]
-            )
+        self._profiler = None
+
+    @classmethod
+    def from_world(cls, world, seed=None, initial_year=1996, headless=None,
+                   batched_inference=True, prediction_cache=None):
+        """
+        Instantiate a model sharing the static state of an existing World.
+
+        Parameters
+        ----------
+        world : World
+            Static state of the model
+        seed : int
+            Seed for pseudonumber generation
+        initial_year : int
+            Year in which the simulation has to start
+        headless : bool
+            If the model has to run in headless mode. If None, it is headless
+            only if the World is
+        batched_inference : bool
+            If the adoption of all the municipalities has to be predicted in
+            batch at each step
+        prediction_cache : PredictionCache
+            Cache of the predictions of the ML estimators
+
+        Returns
+        -------
+        SBPAdoption
+
+        """
+        if headless is None:
+            headless = world.headless
+        return cls(initial_year=initial_year, seed=seed, world=world,
+                   headless=headless, batched_inference=batched_inference,
+                   prediction_cache=prediction_cache)
+
+    @property
+    def world(self):
+        return self._world
+
+    @property
+    def bundle(self):
+        return self._world.bundle
+
+    @property
+    def headless(self):
+        return self._headless
+
+    @property
+    def initial_year(self):
+        return self._initial_year
 
     @property
     def year(self):
@@ -147,13 +247,63 @@ class SBPAdoption(mesa.Model):
     def year(self, new_val):
         self._year = new_val
 
+    @property
+    def random_streams(self):
+        return self._random_streams
+
+    @property
+    def adoption_state(self):
+        return self._adoption_state
+
+    @property
+    def feature_assemblers(self):
+        return self._feature_assemblers
+
+    # Adoption of Portugal, held by the adoption state
+
     @property
     def adoption_in_year_port_ha(self):
-        return self._adoption_in_year_port_ha
+        return self._adoption_state.adoption_in_year_port_ha
 
     @adoption_in_year_port_ha.setter
     def adoption_in_year_port_ha(self, new_val):
-        self._adoption_in_year_port_ha = new_val
+        self._adoption_state.adoption_in_year_port_ha = new_val
+
+    @property
+    def perm_pastures_ha_port(self):
+        return self._adoption_state.perm_pastures_ha_port
+
+    @property
+    def yearly_adoption_ha_port(self):
+        return self._adoption_state.port_series()
+
+    @property
+    def adoption_pr_y_port(self):
+        return self._adoption_state.adoption_pr_y_port
+
+    @property
+    def cumul_adoption_10y_ha_port(self):
+        return self._adoption_state.cumul_adoption_10y_ha_port
+
+    @property
+    def cumul_adoption_10y_port(self):
+        return self._adoption_state.cumul_adoption_10y_port
+
+    @property
+    def cumul_adoption_tot_ha_port(self):
+        return self._adoption_state.cumul_adoption_tot_ha_port
+
+    @property
+    def cumul_adoption_tot_port(self):
+        return self._adoption_state.cumul_adoption_tot_port
+
+    @property
+    def prediction_cache(self):
+        return self._prediction_cache
+
+    @property
+    def profiler(self):
+        return self._profiler
 
     @property
     def ml_clsf(self):
@@ -161,7 +311,7 @@ class SBPAdoption(mesa.Model):
 
     @property
     def ml_clsf_feats(self):
-        return self._ml_clsf_feats
+        return self._world.ml_clsf_feats
 
     @property
     def ml_regr(self):
@@ -169,302 +319,449 @@ class SBPAdoption(mesa.Model):
 
     @property
     def ml_regr_feats(self):
-        return self._ml_regr_feats
+        return self._world.ml_regr_feats
 
-    def _upload_ml_models(self, ml_clsf_folder, ml_regr_folder):
+    def checkpoint(self, path):
         """
-        Called by the __init__ method.
+        Save the dynamic state of the model in an npz file, from which the
+        run can be resumed with SBPAdoption.restore.
 
-        Load the ML models and set the model attributes.
+        Only the state of the run is saved: adoption state, current year,
+        state of the random generators, schedule counters and data collected.
+        The static data are referenced by the fingerprint of the World (and
+        by the hash of the sources of the bundle, if any), together with the
+        parameters to build the World again.
+        The file is written atomically (see the atomic_files module), so a
+        crash during the writing never corrupts a previous checkpoint.
+
+        Parameters
+        ----------
+        path : path str
+            Path of the checkpoint file
 
         """
-        self._ml_clsf = joblib.load(
-            os.path.join(ml_clsf_folder, 'model.pkl')
-            )
-        self._ml_clsf_feats = self._retrieve_ml_features(
-             os.path.join(ml_clsf_folder, 'features.csv')
-             )
-        clsf_dataset = np.genfromtxt(
-            os.path.join(ml_clsf_folder, 'dataset.csv'), delimiter=','
-            )
-        clsf_labels = np.genfromtxt(
-            os.path.join(ml_clsf_folder, 'labels.csv'), delimiter=','
-            )
-        self._ml_clsf.fit(clsf_dataset, clsf_labels)
+        world = self._world
+        state_arrays, state_scalars = self._adoption_state.to_dict()
+        seed_seq = self._random_streams.seed_sequence
+        version, internal_state, gauss_next = self.random.getstate()
+        meta = {
+            'world_fingerprint': world.fingerprint,
+            'bundle_hash': (None if world.bundle is None
+                            else world.bundle.source_hash),
+            'world_sources': world.sources,
+            'headless': self._headless,
+            'batched_inference': self.batched_inference,
+            'initial_year': self._initial_year,
+            'year': self._year,
+            'seed': self._seed,
+            'random_state': [version, list(internal_state), gauss_next],
+            'random_streams': {'entropy': seed_seq.entropy,
+                               'spawn_key': list(seed_seq.spawn_key)},
+            'schedule_steps': self.schedule.steps,
+            'schedule_time': self.schedule.time,
+            'state_scalars': state_scalars,
+            'model_vars': {
+                name: [value.item() if isinstance(value, np.generic)
+                       else value for value in values]
+                for name, values in self.datacollector.model_vars.items()
+                }
+            }
+        arrays = {'state_' + name: array
+                  for name, array in state_arrays.items()}
+
+        save_atomically(path, lambda tmp_file: np.savez(
+            tmp_file, meta=np.array(json.dumps(meta)), **arrays
+            ))
+
+    @classmethod
+    def restore(cls, path, world=None, prediction_cache=None):
+        """
+        Instantiate a model from a checkpoint saved by the checkpoint method,
+        ready to continue the run from the year in which it was saved.
 
-        self._ml_regr = joblib.load(
-            os.path.join(ml_regr_folder, 'model.pkl')
-            )
-        self._ml_regr_feats = self._retrieve_ml_features(
-             os.path.join(ml_regr_folder, 'features.csv')
-             )
-        regr_dataset = np.genfromtxt(
-            os.path.join(ml_regr_folder, 'dataset.csv'), delimiter=','
+        Parameters
+        ----------
+        path : path str
+            Path of the checkpoint file
+        world : World
+            Static state of the model. If None, it is built again with the
+            parameters saved in the checkpoint
+        prediction_cache : PredictionCache
+            Cache of the predictions of the ML estimators
+
+        Raises
+        ------
+        ValueError
+            Raised if the static data of the World are not the ones of the
+            checkpointed model
+
+        Returns
+        -------
+        SBPAdoption
+
+        """
+        with np.load(path) as checkpoint:
+            meta = json.loads(str(checkpoint['meta']))
+            state_arrays = {name[len('state_'):]: checkpoint[name]
+                            for name in checkpoint.files
+                            if name.startswith('state_')}
+        if world is None:
+            world = World(headless=meta['headless'], **meta['world_sources'])
+        if world.fingerprint != meta['world_fingerprint']:
+            raise ValueError('The data of the World are not the ones of the '
+                             'model saved in ' + str(path) + '.')
+
+        model = cls(initial_year=meta['initial_year'], seed=meta['seed'],
+                    world=world, headless=meta['headless'],
+                    batched_inference=meta['batched_inference'],
+                    prediction_cache=prediction_cache)
+        model._restore_state(meta, state_arrays)
+        return model
+
+    def _restore_state(self, meta, state_arrays):
+        """
+        Called by the restore method.
+
+        Replace the state of the new model with the one of the checkpoint.
+
+        """
+        self.year = meta['year']
+        version, internal_state, gauss_next = meta['random_state']
+        self.random.setstate((version, tuple(internal_state), gauss_next))
+        streams = meta['random_streams']
+        self._random_streams = RandomStreams(
+            np.random.SeedSequence(streams['entropy'],
+                                   spawn_key=tuple(streams['spawn_key'])),
+            len(self._world)
             )
-        regr_labels = np.genfromtxt(
-            os.path.join(ml_regr_folder, 'labels.csv'), delimiter=','
+        self.schedule.steps = meta['schedule_steps']
+        self.schedule.time = meta['schedule_time']
+
+        self._adoption_state = AdoptionState.from_dict(
+            self._world.perm_pastures_ha, state_arrays, meta['state_scalars']
             )
-        self._ml_regr.fit(regr_dataset, regr_labels)
+        self._neighbors_adoption = {}
+        for assembler in self._feature_assemblers.values():
+            assembler.invalidate()
 
-    def _retrieve_ml_features(self, path):
-        with open(path) as inputfile:
-            rd = csv.reader(inputfile)
-            return list(rd)[0]
+        model_vars = self.datacollector.model_vars
+        for name, values in meta['model_vars'].items():
+            model_vars[name] = list(values)
 
-    def _initialize_government(self, sbp_payments_path):
+    def reset(self, seed=None, initial_year=None):
         """
-        Called by the __init__ method.
+        Reset in place the model to the beginning of a new run.
 
-        Instantiate the Government class.
+        Agents, grid and static data are kept: only the random generator, the
+        adoption state of the municipalities and of Portugal, the schedule
+        counters and the datacollector are reinitialized.
+
+        Parameters
+        ----------
+        seed : int
+            Seed for pseudonumber generation of the new run (the random
+            streams of the adoption draws are derived from it again)
+        initial_year : int
+            Year in which the new run has to start. If None, the initial year
+            of the previous run is used
 
         """
-        sbp_payments = pd.read_excel(sbp_payments_path, index_col='Year')
-        government = agents.Government(self.next_id(), self, sbp_payments)
-        return government
+        if initial_year is not None:
+            check_initial_year(initial_year)
+            self._initial_year = initial_year
+        self.year = self._initial_year
+
+        self._seed = seed
+        self.random.seed(seed)
+        self._random_streams = RandomStreams(seed, len(self._world))
+
+        self.schedule.steps = 0
+        self.schedule.time = 0
+
+        self._initialize_adoption()
+        self._initialize_datacollector()
 
-    def _initialize_municipalities_and_adoption(self):
+    def _initialize_municipalities(self):
         """
         Called by the __init__ method.
 
-        - Loads the shapefile of the municipalities
-        - Check that the file has no missing values
-        - Instantiates the municipalities
-        - Call method to load data that need to be set as attribute of
-        municipalities and set them + to set model's attributes regarding
-        pastures and adoption in Portugal
-        - Creates the space grid with the municipalities
+        - Instantiates the municipalities from the geometries and the
+        attributes of the world, as the AgentCreator does from the shapefile
+        (in headless mode, HeadlessMunicipality agents without geometry)
+        - Sets their static attributes (census data, pastures area and
+        neighbours, taken from the cached topology of the world)
+        - Creates the space grid with the municipalities (not in headless
+        mode)
         - Adds each municipality to the schedule
-        - Calls each municipality's method to retrieve its neighboring ones
-        - Creates the municipalities mapping dictionary, necessary to
-        replace in the farms dataset the strings with the relative objects.
 
         """
+        world = self._world
+        if not self._headless:
+            import mesa_geo
+            AC = mesa_geo.AgentCreator(agent_class=agents.Municipality,
+                                       agent_kwargs={"model": self},
+                                       crs=GEO_CRS)
+
+        municipalities = []
+        for i, unique_id in enumerate(world.unique_ids):
+            if self._headless:
+                munic = agents.HeadlessMunicipality(unique_id, self)
+            else:
+                munic = AC.create_agent(shape=world.geometries[i],
+                                        unique_id=unique_id)
+            for attr_name, values in world.attributes.items():
+                setattr(munic, attr_name, values[i])
+            munic.perm_pastures_ha = world.perm_pastures_ha[i]
+            munic.census_data = world.census_data[i]
+            municipalities.append(munic)
+
+        for i, munic in enumerate(municipalities):
+            munic.index = i
+            munic.neighbors_idx = world.neighbors[i]
+            munic.neighbors = [municipalities[j].Municipality
+                               for j in munic.neighbors_idx]
+            munic.neighbors_perm_pastures_ha = (
+                world.neighbors_perm_pastures_ha[i]
+                )
+
+        if not self._headless:
+            self.grid.add_agents(municipalities)
+        for munic in municipalities:
+            self.schedule.add(munic)
+
+    def _register_in_mappings(self):
+        """
+        Called by the __init__ method.
+
+        Creates the mappings of the model, necessary to retrieve the
+        municipalities and their environments through their names (each model
+        has its own, so several models can run in the same process).
 
-        municipalities_shp_path = (pathlib.Path(__file__).parent.parent
-                                   / 'data' / 'municipalities_shp'
-                                   / 'shapefile_for_munic_abm.shp')
-        municipalities_data = gpd.read_file(municipalities_shp_path)
-        municipalities_data.rename(columns={'Municipali': 'Municipality'},
-                                   inplace=True)
+        """
+        self.mappings = Mappings(
+            self.schedule.agents,
+            [self._world.environments[name] for name in self._world.names]
+            )
 
-        data_is_null = municipalities_data.isnull()
-        if data_is_null.values.any():
-            munic_with_nan = municipalities_data[
-                                data_is_null.any(axis=1)].index.tolist()
-            raise ValueError('The municipalities dataset is missing values for'
-                             ' the following municipalities: ' +
-                             ', '.join(munic_with_nan))
+    def _initialize_adoption(self):
+        """
+        Called by the __init__ and reset methods.
 
-        AC = mesa_geo.AgentCreator(agent_class=agents.Municipality,
-                                   agent_kwargs={"model": self})
+        Method to set the adoption state of the municipalities and of
+        Portugal (see the adoption_state module) from the historical adoption
+        matrix of the world.
+        Adoption data are restricted to the years before the intial year
+        of the simulation, since the ones after are modelled.
 
-        municipalities = AC.from_GeoDataFrame(gdf=municipalities_data,
-                                              unique_id='CCA_2')
+        """
+        world = self._world
+        self._adoption_state = AdoptionState(world.perm_pastures_ha,
+                                             world.adoption_years,
+                                             world.adoption_matrix,
+                                             self._year)
+        self._neighbors_adoption = {}
+        for assembler in self._feature_assemblers.values():
+            assembler.invalidate()
+
+    def _initialize_datacollector(self):
+        """
+        Called by the __init__ and reset methods.
 
-        self._set_munic_attributes_from_data_and_adoption_in_port(
-            municipalities
+        """
+        self.datacollector = mesa.datacollection.DataCollector(
+            # agent_reporters={
+            #     'FARM_ID': lambda a: a.code,
+            #     'Pasture': lambda a: a.farm.pasture_type.type},
+            model_reporters={
+                'Year': lambda m: m.year,
+                'Total area of SBP sown [ha]': get_total_area_adopted,
+                'Area sown in the last year [ha/y]': (
+                    lambda m: m.adoption_state.adoption_ha_port(m.year)
+                    )
+                })
+
+        # Section of code for visualization, to not start from 0 in the chart
+        # if there was adoption in the year before
+        dc_vars = self.datacollector.model_vars
+        dc_vars['Year'].append(self.year - 1)
+        dc_vars['Total area of SBP sown [ha]'].append(
+            self._adoption_state.total_adoption_ha_port(self.year - 1)
+            )
+        dc_vars['Area sown in the last year [ha/y]'].append(
+            self._adoption_state.adoption_ha_port(self.year - 1)
             )
 
-        self.grid.add_agents(municipalities)
-        for munic in municipalities:
-            self.schedule.add(munic)
-            munic.get_neighbors_and_pastures_area()
-            self.mappings.municipalities[munic.Municipality] = munic
+    # The following methods are not used during the initiation of the model
 
-    def _set_munic_attributes_from_data_and_adoption_in_port(
-            self,
-            municipalities
-            ):
+    def get_neighbors_adoption(self, tot_or_10y='tot'):
         """
-        Called by the _initialize_municipalities method.
+        Return, for all the municipalities, the adoption of the previous year
+        and the cumulative one (in total or over 10 years) in their
+        neighbouring municipalities, divided by the permanent pastures area of
+        the neighbours.
 
-        Method to load and set the relative attributes of each Municipality
-        for census and adoption data.
-        Census data are transformed for both regressor and classifier.
-        Adoption data are also restricted to the years before the intial year
-        of the simulation, since the ones after are modelled.
-        It also calls the method of the Municipalities to calculate the
-        cumulative adoption in the previous 10 years.
-        While iterating over the municipalities it also calculates the
-        permanent pastures area and the yearly adoption in Portugal, setting
-        the relative model variables. Then from these it calculates the
-        cumulative adoption in the previosu 10 years and divide these values
-        for the permanent pastures area to get the ones used for the model.
-
-        """
-        census_data_path = (pathlib.Path(__file__).parent.parent
-                            / 'data' / 'census_data_for_abm.csv')
-        census_data = pd.read_csv(census_data_path, index_col='Municipality')
-        census_data_tr = TransformCensusFeatures().fit_transform(
-                census_data
-                )
+        Each of them is a single product of the normalized adjacency of the
+        world with the vector of the adoptions in hectares. They are
+        calculated once per year and then reused by all the municipalities,
+        since during the year the adoption state changes only after all the
+        predictions.
 
-        adoption_data_path = (pathlib.Path(__file__).parent.parent
-                              / 'data'
-                              / '% yearly SBP adoption per municipality.csv')
-        adoption_data = pd.read_csv(adoption_data_path,
-                                    index_col='Municipality')
-        adoption_data.columns = adoption_data.columns.astype(int)
-        adoption_cols_to_drop = [col for col in adoption_data.columns
-                                 if col >= self._year]
-        adoption_data.drop(adoption_cols_to_drop, axis=1, inplace=True)
-
-        perm_pastures_ha_tot = 0
-        yearly_adoption_ha_tot = pd.Series(0.,
-                                           index=np.arange(1995, self._year))
-        
-        for munic in municipalities:
-            munic_name = munic.Municipality
-            try:
-                munic_census_data = census_data_tr.loc[munic_name]                
-            except KeyError:
-                print("Census data for the municipality of",
-                      munic_name, "are missing.")
-
-            munic.perm_pastures_ha = (
-                munic_census_data.loc['pastures_area_munic']
-                )
-            munic.census_data = dict(
-                munic_census_data.drop('pastures_area_munic')
-                )
+        Parameters
+        ----------
+        tot_or_10y : str
+            "tot" for the total cumulative adoption, "10y" for the one over
+            the last 10 years
 
-            try:
-                munic_adoption_data = adoption_data.loc[munic_name]
-            except KeyError:
-                print("Adoption data for the municipality of",
-                      munic_name, "are missing.")
-            munic.yearly_adoption = dict(munic_adoption_data)
-            munic.set_cumul_adoption_10y(self._year)
-            munic.set_tot_cumul_adoption()
-
-            munic.yearly_adoption_ha = dict(
-                munic_adoption_data * munic.perm_pastures_ha
-                )
-            munic.cumul_adoption_10y_ha = (
-                munic.cumul_adoption_10y * munic.perm_pastures_ha
-                )
-            munic.cumul_adoption_tot_ha = (
-                munic.cumul_adoption_tot * munic.perm_pastures_ha
-                )
+        Returns
+        -------
+        adoption_pr_y, cumul_adoption : numpy array
+            Adoption of the neighbours of each municipality in the previous
+            year and cumulative
 
-            perm_pastures_ha_tot += munic.perm_pastures_ha
-            yearly_adoption_ha_munic = (
-                munic_adoption_data * munic.perm_pastures_ha
-                )
-            yearly_adoption_ha_tot += yearly_adoption_ha_munic
+        """
+        key = (self.year, tot_or_10y)
+        if key not in self._neighbors_adoption:
+            state = self._adoption_state
+            weights = self._world.neighbors_weights
+            adoption_pr_y = weights @ (state.adoption_in(self.year - 1)
+                                       * state.perm_pastures_ha)
+            if tot_or_10y == 'tot':
+                cumul_adoption = weights @ state.cumul_adoption_tot_ha
+            elif tot_or_10y == '10y':
+                cumul_adoption = weights @ state.cumul_adoption_10y_ha
+            else:
+                raise ValueError('tot_or_10y has to be "tot" or "10y".')
+            self._neighbors_adoption = {key: (adoption_pr_y, cumul_adoption)}
+        return self._neighbors_adoption[key]
+
+    def enable_profiling(self, cprofile_years=None):
+        """
+        Time the phases of the following steps (see the profiling module).
 
-        self.perm_pastures_ha_port = perm_pastures_ha_tot
-        self.yearly_adoption_ha_port = yearly_adoption_ha_tot
-        self.adoption_pr_y_port = (
-            self.yearly_adoption_ha_port.loc[self.year - 1]
-            / self.perm_pastures_ha_port
-            )
+        Parameters
+        ----------
+        cprofile_years : tuple
+            First and last years (included) to run also under cProfile
 
-        self.cumul_adoption_10y_ha_port = (
-            self.yearly_adoption_ha_port.loc[
-                (self.year - 10): self.year
-                ].sum()
-            )
-        self.cumul_adoption_10y_port = (
-            self.cumul_adoption_10y_ha_port
-            / self.perm_pastures_ha_port
-            )
-        self.cumul_adoption_tot_ha_port = (
-            self.yearly_adoption_ha_port.sum()
-            )
-        self.cumul_adoption_tot_port = (
-            self.cumul_adoption_tot_ha_port
-            / self.perm_pastures_ha_port
-            )
+        Returns
+        -------
+        StepProfiler
+            The profiler of the model, with the counters reset
 
-    def _initialize_environments(self):
         """
-        Called by the __init__ method.
+        from .profiling import StepProfiler
 
-        - Loads climate and soil data
-        - Instatiate for each Municipality the relative MunicipalityEnvironment
-          object and set it as an attribute of the Municipality
+        self.disable_profiling()
+        self._profiler = StepProfiler(self, cprofile_years)
+        return self._profiler
 
+    def disable_profiling(self):
         """
-        av_climate_data_path = (pathlib.Path(__file__).parent.parent
-                                / 'data'
-                                / 'municipalities_average_climate_final.csv')
-        soil_data_path = (pathlib.Path(__file__).parent.parent
-                          / 'data'
-                          / 'municipalities_soil_final.csv')
+        Stop timing the steps and remove all the instrumentation. The last
+        profiler is returned and is no longer updated.
 
-        average_climate_data = pd.read_csv(av_climate_data_path,
-                                           index_col=['Municipality'])
-        average_climate_data_tr = TransformClimateFeatures().fit_transform(
-            average_climate_data
-            )
-        soil_data = pd.read_csv(soil_data_path,
-                                index_col=['Municipality'])
-        soil_data_tr = TransformSoilFeatures().fit_transform(soil_data)
-
-        for munic in self.schedule.agents:
-            munic_name = munic.Municipality
-            try:
-                munic_average_climate = average_climate_data_tr.loc[munic_name]
-            except KeyError:
-                print("Average climate data for the municipality of",
-                      munic_name, "are missing.")
-            try:
-                munic_soil = soil_data_tr.loc[munic_name]
-            except KeyError:
-                print("Soil data for the municipality of", munic_name,
-                      "are missing.")
-
-            self.mappings.environments[munic_name] = (
-                agents.MunicipalityEnvironment(
-                    # munic_yearly_climate, munic_soil
-                    munic_average_climate, munic_soil
-                    )
-                )
+        """
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.uninstall()
+            self._profiler = None
+        return profiler
 
-    # The following methods are not used during the initiation of the model
+    def profile_report(self):
+        """
+        Return the table of the calls and the wall time of each phase of the
+        steps profiled (see StepProfiler.report).
+
+        """
+        if self._profiler is None:
+            raise ValueError('The profiling of the model is not enabled.')
+        return self._profiler.report()
 
     def step(self):
         """
         Step method of the model.
 
-        Calls the step methods of the agents added to the schedule.
+        Calls the step methods of the agents added to the schedule (or, with
+        batched inference, predicts the adoption of all of them at once and
+        then advances the adoption state of all of them).
         Calls the method to update adoptions attributes regarding Portugal.
+        If the profiling is enabled, the step is run by the profiler.
+
+        """
+        if self._profiler is not None:
+            self._profiler.step()
+        else:
+            self._step()
+
+    def _step(self):
+        """
+        Called by the step method (or by the profiler).
 
         """
-        self.schedule.step()
+        if self.batched_inference:
+            self._step_municipalities_batched()
+        else:
+            self.schedule.step()
         self._update_adoption_port()
         self.datacollector.collect(self)
         self.year += 1
 
-    def _update_adoption_port(self):
+    def _step_municipalities_batched(self):
         """
-        Method called by the advance() method to update all the adoption
-        attributes regarding Portugal.
-
-        Returns
-        -------
-        None.
+        Called by the step method.
+
+        Same as the step of the SimultaneousActivation schedule, but the step
+        methods of the municipalities are replaced by a single prediction for
+        all of them:
+            - the classifier features of all the municipalities that have not
+              adopted SBP on all their permanent pastures are taken from the
+              feature matrix (see the features module) and passed once to
+              predict_proba
+            - the uniform number of the year of each of them is taken from
+              the random streams of the run (the same draws of the step
+              methods)
+            - the regressor features of the adopting ones are passed once to
+              predict and the adoptions are clamped all together (see
+              adoption_state.clamp_adoptions)
+        and the advance methods are replaced by a single update of the
+        adoption state of all the municipalities.
+        Since all the features are retrieved before the adoption state is
+        advanced, every municipality still sees the state of the previous
+        year.
 
         """
-        self.yearly_adoption_ha_port[self.year] = self.adoption_in_year_port_ha
-        try:
-            adopt_to_remove = self.yearly_adoption_ha_port[self.year - 10]
-        except KeyError:
-            adopt_to_remove = 0
-        self.adoption_pr_y_port = (
-            self.adoption_in_year_port_ha / self.perm_pastures_ha_port
-            )
-        self.cumul_adoption_10y_ha_port = (self.cumul_adoption_10y_ha_port
-                                           + self.adoption_in_year_port_ha
-                                           - adopt_to_remove)
-        self.cumul_adoption_10y_port = (
-            self.cumul_adoption_10y_ha_port / self.perm_pastures_ha_port
-            )
-        self.cumul_adoption_tot_ha_port += self.adoption_in_year_port_ha
+        state = self._adoption_state
+        state.adoption_in_year[:] = 0
+
+        eligible = np.flatnonzero(state.cumul_adoption_tot < 1)
+        if len(eligible):
+            clsf_assembler = self._feature_assemblers['clsf']
+            clsf_assembler.assemble(self)
+            prob_adopt = self.ml_clsf.predict_proba(
+                clsf_assembler.rows(eligible)
+                )[:, 1]
+            draws = self._random_streams.uniforms(self.year)[eligible]
+            adopting = eligible[draws < prob_adopt]
+
+            if len(adopting):
+                regr_assembler = self._feature_assemblers['regr']
+                regr_assembler.assemble(self)
+                adoptions = self.ml_regr.predict(
+                    regr_assembler.rows(adopting)
+                    )
+                state.adoption_in_year[adopting] = clamp_adoptions(
+                    adoptions, state.cumul_adoption_tot[adopting]
+                    )
 
-        self.cumul_adoption_tot_port = (
-            self.cumul_adoption_tot_ha_port / self.perm_pastures_ha_port
-            )
+        state.advance(self.year)
+        self.schedule.steps += 1
+        self.schedule.time += 1
 
-        self.adoption_in_year_port_ha = 0
+    def _update_adoption_port(self):
+        """
+        Method called by the step method, after the advance of all the
+        municipalities, to update all the adoption attributes regarding
+        Portugal.
+
+        """
+        self._adoption_state.update_port(self.year)
@@ -7,6 +7,26 @@ Inputs needed to instantiate the model.
 
 Data
 ----------
+municipalities_shp_path : str
+    Path to the shapefile of the municipalities
+
+census_data_path : str
+    Path to the csv with the census data of each municipality
+
+adoption_data_path : str
+    Path to the csv with the yearly SBP adoption in each municipality, divided
+    by its permanent pastures area
+
+av_climate_data_path : str
+    Path to the csv with the average climate data of each municipality
+
+soil_data_path : str
+    Path to the csv with the soil data of each municipality
+
+bundle_path : str
+    Default path of the scenario bundle compiled from all the data above (see
+    the bundle module)
+
 sbp_payments : str
     Path to the spreadsheed with the total payment in €/hectare provided by the
     Portuguese Carbon Fund for each year.
@@ -19,8 +39,34 @@ regr_folder_path : str
     Path to the folder where the ML regressor model and the name of its
     features are located
 
+ml_cache_folder_path : str
+    Path to the folder where the fitted ML models are cached
+
+topology_cache_folder_path : str
+    Path to the folder where the adjacency topologies of the shapefiles are
+    cached
+
 """
 
+data_folder_path = pathlib.Path(__file__).parent.parent / 'data'
+
+municipalities_shp_path = (data_folder_path / 'municipalities_shp'
+                           / 'shapefile_for_munic_abm.shp')
+
+census_data_path = data_folder_path / 'census_data_for_abm.csv'
+
+adoption_data_path = (data_folder_path
+                      / '% yearly SBP adoption per municipality.csv')
+
+av_climate_data_path = (data_folder_path
+                        / 'municipalities_average_climate_final.csv')
+
+soil_data_path = data_folder_path / 'municipalities_soil_final.csv'
+
+bundle_path = data_folder_path / 'scenario_bundle.sbpb'
+
+topology_cache_folder_path = data_folder_path / 'topology_cache'
+
 sbp_payments_path = (pathlib.Path(__file__).parent.parent / 'data'
                      / 'sbp_payments.xlsx')
 
@@ -30,5 +76,8 @@ clsf_folder_path = (pathlib.Path(__file__).parent.parent / 'ml_model'
 regr_folder_path = (pathlib.Path(__file__).parent.parent / 'ml_model'
                     / 'regressor')
 
+ml_cache_folder_path = (pathlib.Path(__file__).parent.parent / 'ml_model'
+                        / 'fitted_cache')
+
 ml_dataset = (pathlib.Path(__file__).parent.parent
               / 'Municipalities final dataset for analysis.csv')
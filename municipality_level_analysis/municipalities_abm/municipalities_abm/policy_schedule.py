@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from . import input_data
+
+"""
+Schedules of the SBP payments offered to the municipalities.
+
+A PolicySchedule holds the payment of each municipality in each year of a
+contiguous span as a dense (years x municipalities) array, so the payments of
+a year are a row of the array, found by its offset from the first year
+without any pandas lookup in the steps of the model. Payments can be
+national, by district or by municipality: a schedule is built from a table
+with the years as index and as columns:
+    - "sbp_payment": the national payment, as in the spreadsheet of the model
+      inputs, applied to the municipalities without a payment of their own
+    - "district:" followed by the name of a district (e.g. "district:Beja"):
+      the payment of all the municipalities of the district
+    - "municipality:" followed by the name of a municipality (e.g.
+      "municipality:Beja"): the payment of the municipality
+where a municipality column takes precedence over a district column, which
+takes precedence over the national one. The prefix can be omitted for the
+names that are only a district or only a municipality. Columns that are not
+numeric (e.g. notes) are ignored, while any other numeric column is an error,
+so that a misspelled name doesn't silently get the national payment. The
+table can be read from an xlsx or csv file (see input_data.load_sbp_payments)
+or given as a DataFrame or an array from Python.
+
+"""
+
+# Column of the national payment in the payment tables, and prefixes of the
+# columns of the districts and of the municipalities
+NATIONAL_COLUMN = 'sbp_payment'
+DISTRICT_PREFIX = 'district:'
+MUNICIPALITY_PREFIX = 'municipality:'
+
+
+class PolicySchedule:
+    """
+    Class holding the SBP payment of each municipality in each year.
+
+    Attributes
+    ----------
+    municipalities : tuple
+        Names of the municipalities, in the order of the columns
+    years : numpy array
+        Years of the schedule, contiguous
+    first_year, last_year : int
+        First and last years of the schedule
+    payments : numpy array
+        Read-only (years x municipalities) payments in €/hectare
+    is_national : bool
+        True if all the municipalities have the same payment in each year
+
+    Methods
+    ----------
+    payments_in
+        Payments of all the municipalities in a year
+    payment
+        Payment of a municipality in a year
+    to_frame
+        Payments as a DataFrame
+    from_array, from_frame, from_file
+        Build a schedule from an array, a table or a file
+
+    """
+
+    def __init__(self, first_year, payments, municipalities):
+        """
+        Parameters
+        ----------
+        first_year : int
+            Year of the first row of the payments
+        payments : array-like
+            (years x municipalities) payments in €/hectare, one row per year
+            from first_year
+        municipalities : list
+            Names of the municipalities, in the order of the columns
+
+        """
+        payments = np.array(payments, dtype=float)
+        self.municipalities = tuple(municipalities)
+        if (payments.ndim != 2
+                or payments.shape[1] != len(self.municipalities)):
+            raise ValueError('The payments have shape ' + str(payments.shape)
+                             + ' instead of (years x '
+                             + str(len(self.municipalities))
+                             + ' municipalities).')
+        if not len(payments):
+            raise ValueError('A policy schedule needs at least one year.')
+        if np.isnan(payments).any():
+            year, munic = np.argwhere(np.isnan(payments))[0]
+            raise ValueError('No payment for ' + self.municipalities[munic]
+                             + ' in ' + str(first_year + year) + '.')
+        payments.setflags(write=False)
+        self._payments = payments
+        self.first_year = int(first_year)
+        self.last_year = self.first_year + len(payments) - 1
+
+    @property
+    def payments(self):
+        return self._payments
+
+    @property
+    def years(self):
+        return np.arange(self.first_year, self.last_year + 1)
+
+    @property
+    def is_national(self):
+        return bool((self._payments == self._payments[:, :1]).all())
+
+    def payments_in(self, year):
+        """
+        Return the (municipalities, ) read-only payments of a year, in
+        €/hectare.
+
+        Raises
+        ------
+        KeyError
+            Raised if the year is outside the span of the schedule
+
+        """
+        row = year - self.first_year
+        if not 0 <= row < len(self._payments):
+            raise KeyError('Payment for ' + str(year) + ' not available. '
+                           'Year outside the time span of the policy '
+                           'schedule (' + str(self.first_year) + '-'
+                           + str(self.last_year) + ').')
+        return self._payments[row]
+
+    def payment(self, year, index):
+        """
+        Return the payment of the municipality at position index in a year,
+        in €/hectare.
+
+        """
+        return self.payments_in(year)[index]
+
+    def to_frame(self):
+        """
+        Return the payments with the years as index and a column per
+        municipality.
+
+        """
+        return pd.DataFrame(self._payments,
+                            index=pd.Index(self.years, name='Year'),
+                            columns=self.municipalities)
+
+    @classmethod
+    def from_array(cls, first_year, payments, municipalities):
+        """
+        Build a schedule from an array of payments, one row per year from
+        first_year: a (years, ) array of national payments or a (years x
+        municipalities) array.
+
+        """
+        payments = np.asarray(payments, dtype=float)
+        if payments.ndim == 1:
+            payments = np.repeat(payments[:, None], len(municipalities),
+                                 axis=1)
+        return cls(first_year, payments, municipalities)
+
+    @classmethod
+    def from_frame(cls, frame, municipalities, districts=None):
+        """
+        Build a schedule from a table of payments (see the module
+        description). All the years between the first and the last ones of
+        the index have to be present.
+
+        Parameters
+        ----------
+        frame : pandas DataFrame or Series
+            Payments with the years as index. A Series is a national payment
+        municipalities : list
+            Names of the municipalities
+        districts : list
+            District of each municipality, required only if the table has
+            district columns
+
+        Raises
+        ------
+        ValueError
+            Raised if a numeric column is not the national payment, a
+            municipality or a district, if a column without prefix is the
+            name of both a district and a municipality, if no column is a
+            payment or if a municipality has no payment in a year
+
+        """
+        if isinstance(frame, pd.Series):
+            frame = frame.to_frame(NATIONAL_COLUMN)
+        years = [int(year) for year in frame.index]
+        first_year = min(years)
+        rows = np.array(years) - first_year
+        if len(set(years)) < len(years):
+            raise ValueError('The payments have repeated years.')
+
+        municipalities = list(municipalities)
+        munic_positions = {name: n_munic
+                           for n_munic, name in enumerate(municipalities)}
+        districts = np.asarray([] if districts is None else districts,
+                               dtype=object)
+        payments = np.full((max(years) - first_year + 1,
+                            len(municipalities)), np.nan)
+        national = None
+        district_columns = {}
+        munic_columns = {}
+        for col in frame.columns:
+            if col == NATIONAL_COLUMN:
+                national = frame[col].to_numpy(dtype=float)
+                continue
+            if not pd.api.types.is_numeric_dtype(frame[col]):
+                continue
+            name = str(col)
+            is_district = name in districts
+            is_munic = name in munic_positions
+            if name.startswith(DISTRICT_PREFIX):
+                name = name[len(DISTRICT_PREFIX):]
+                is_district, is_munic = name in districts, False
+                if not is_district:
+                    raise ValueError('The payment column "' + str(col)
+                                     + '" is not a district.')
+            elif name.startswith(MUNICIPALITY_PREFIX):
+                name = name[len(MUNICIPALITY_PREFIX):]
+                is_district, is_munic = False, name in munic_positions
+                if not is_munic:
+                    raise ValueError('The payment column "' + str(col)
+                                     + '" is not a municipality.')
+            elif is_district and is_munic:
+                raise ValueError('The payment column "' + name + '" is both '
+                                 'a district and a municipality: write it '
+                                 'as "' + DISTRICT_PREFIX + name + '" or "'
+                                 + MUNICIPALITY_PREFIX + name + '".')
+            elif not (is_district or is_munic):
+                raise ValueError('The payment column "' + name + '" is not "'
+                                 + NATIONAL_COLUMN + '", a municipality or a '
+                                 'district.')
+            values = frame[col].to_numpy(dtype=float)
+            if is_district:
+                district_columns[name] = values
+            else:
+                munic_columns[name] = values
+        if national is None and not district_columns and not munic_columns:
+            raise ValueError('None of the columns ' + str(list(frame.columns))
+                             + ' is a payment.')
+
+        if national is not None:
+            payments[rows] = national[:, None]
+        for name, values in district_columns.items():
+            payments[rows[:, None], np.flatnonzero(districts == name)] = (
+                values[:, None]
+                )
+        for name, values in munic_columns.items():
+            payments[rows, munic_positions[name]] = values
+        return cls(first_year, payments, municipalities)
+
+    @classmethod
+    def from_file(cls, path, municipalities, districts=None):
+        """
+        Build a schedule from an xlsx or csv file with a Year column and the
+        columns of the payments (see from_frame).
+
+        """
+        return cls.from_frame(input_data.load_sbp_payments(path),
+                              municipalities, districts)
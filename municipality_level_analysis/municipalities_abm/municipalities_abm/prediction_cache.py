@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import collections
+
+import numpy as np
+
+"""
+Memoization of the predictions of the ML estimators across runs.
+
+Many rows of features are the same in all the runs of an ensemble (e.g. the
+ones of the first simulated year, in which the adoption state is still the
+historical one, or the ones of the municipalities that never adopted), so the
+predictions of each row are stored, with the exact bytes of the row as key,
+in a cache of bounded size evicting the least recently used entries. A
+PredictionCache is shared by all the runs of a process through
+CachedEstimator wrappers, which have the same predict_proba and predict
+methods of the estimators.
+The predictions of an estimator are keyed on its id, and the cache keeps a
+reference to each estimator whose predictions it stored (until it is
+cleared): an estimator is never garbage collected while the cache may hold
+its predictions, so its id cannot be reused by another estimator (e.g. the
+one of a World built on other ML folders) that would then get them.
+
+"""
+
+
+class PredictionCache:
+    """
+    Class storing the predictions of the estimators for each row of features,
+    with LRU eviction.
+
+    Attributes
+    ----------
+    max_size : int
+        Maximum number of predictions stored
+    hits, misses : int
+        Number of rows whose prediction was and was not found in the cache
+
+    Methods
+    ----------
+    cached_call
+        Return the predictions of some rows, calling the estimator only for
+        the ones not in the cache
+    clear
+        Remove all the predictions and the references to the estimators, and
+        reset the counters
+
+    """
+
+    def __init__(self, max_size=100000):
+        """
+        Parameters
+        ----------
+        max_size : int
+            Maximum number of predictions stored
+
+        """
+        if max_size < 1:
+            raise ValueError('The size of the prediction cache has to be '
+                             'positive.')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        # Estimators with predictions in the cache, mapped by their id
+        self._estimators = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.
+
+    def clear(self):
+        self._entries.clear()
+        self._estimators.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def cached_call(self, estimator, method_name, rows):
+        """
+        Return the predictions of a method of an estimator for some rows of
+        features. The rows not in the cache are passed to the method with a
+        single call and their predictions are stored.
+
+        Parameters
+        ----------
+        estimator : sklearn estimator
+            Fitted estimator
+        method_name : str
+            "predict_proba" or "predict"
+        rows : array-like
+            (rows x features) features
+
+        Returns
+        -------
+        numpy array
+            Predictions of the rows, as returned by the method
+
+        """
+        method = getattr(estimator, method_name)
+        rows = np.ascontiguousarray(rows, dtype=float)
+        if not len(rows):
+            return method(rows)
+        key = (id(estimator), method_name)
+        self._estimators.setdefault(key[0], estimator)
+        entries = self._entries
+        keys = [(key, row.tobytes()) for row in rows]
+        predictions = [None] * len(keys)
+        missing = []
+        for n_row, row_key in enumerate(keys):
+            prediction = entries.get(row_key)
+            if prediction is None:
+                missing.append(n_row)
+            else:
+                entries.move_to_end(row_key)
+                predictions[n_row] = prediction
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            computed = np.asarray(method(rows[missing]))
+            for n_row, prediction in zip(missing, computed):
+                if isinstance(prediction, np.ndarray):
+                    prediction = prediction.copy()
+                predictions[n_row] = prediction
+                entries[keys[n_row]] = prediction
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+        return np.array(predictions)
+
+
+class CachedEstimator:
+    """
+    Wrapper of a fitted estimator whose predict_proba and predict methods go
+    through a PredictionCache. All the other attributes are the ones of the
+    estimator.
+
+    """
+
+    def __init__(self, estimator, cache):
+        """
+        Parameters
+        ----------
+        estimator : sklearn estimator
+            Fitted estimator
+        cache : PredictionCache
+            Cache of the predictions, that can be shared by several estimators
+
+        """
+        self.estimator = estimator
+        self.cache = cache
+
+    def predict_proba(self, rows):
+        return self.cache.cached_call(self.estimator, 'predict_proba', rows)
+
+    def predict(self, rows):
+        return self.cache.cached_call(self.estimator, 'predict', rows)
+
+    def __getattr__(self, name):
+        return getattr(self.estimator, name)
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+import cProfile
+import io
+import pstats
+import time
+
+import pandas as pd
+
+"""
+Opt-in instrumentation of the steps of SBPAdoption.
+
+When the profiling of a model is enabled (see SBPAdoption.enable_profiling),
+a StepProfiler wraps, on the instances only, the methods of each phase of a
+simulated year:
+    - features: FeatureAssembler.assemble (the features of the estimators)
+    - neighbours: SBPAdoption.get_neighbors_adoption
+    - predict_proba, predict: the calls to the ML estimators
+    - advance: AdoptionState.advance
+    - port_update: SBPAdoption._update_adoption_port
+    - collect: DataCollector.collect
+and accumulates the number of calls and the wall time of each of them. The
+time of a phase excludes the one of the phases called inside it (e.g. the
+neighbours aggregation called by the feature assembly), and the time of the
+step not spent in any phase is reported as "other". The calls to the
+estimators are also counted by estimator, with the number of rows passed.
+A range of years can also be run under cProfile.
+
+Nothing is wrapped while the profiling is disabled: the step of the model
+only checks whether a profiler is set.
+
+"""
+
+PHASES = ('features', 'neighbours', 'predict_proba', 'predict', 'advance',
+          'port_update', 'collect')
+
+
+class _TimedEstimator:
+    """
+    Wrapper of an estimator (or of a CachedEstimator) timing its
+    predict_proba and predict methods (the ones that it has: the regressor
+    has no predict_proba). All the other attributes are the ones of the
+    estimator.
+
+    """
+
+    def __init__(self, estimator, name, profiler):
+        self.estimator = estimator
+        self.name = name
+        self.profiler = profiler
+        self._timed_methods = {
+            method: profiler._timed(method, getattr(estimator, method))
+            for method in ('predict_proba', 'predict')
+            if hasattr(estimator, method)
+            }
+
+    def predict_proba(self, rows):
+        return self.profiler.call_estimator(
+            self.name, 'predict_proba', self._timed_methods['predict_proba'],
+            rows
+            )
+
+    def predict(self, rows):
+        return self.profiler.call_estimator(
+            self.name, 'predict', self._timed_methods['predict'], rows
+            )
+
+    def __getattr__(self, name):
+        return getattr(self.estimator, name)
+
+
+class StepProfiler:
+    """
+    Class accumulating the wall time and the calls of each phase of the
+    steps of a model.
+
+    Attributes
+    ----------
+    model : SBPAdoption
+        Model profiled
+    phases : dict
+        Maps each phase (see PHASES, plus "other") to its [calls, seconds]
+    estimators : dict
+        Maps each (estimator, method) to its [calls, rows, seconds]
+    steps : int
+        Number of steps profiled
+    step_time : float
+        Wall time of the steps profiled, in seconds
+    agent_steps : int
+        Municipalities stepped (municipalities times steps)
+    cprofile_years : tuple or None
+        First and last years run under cProfile
+    agent_steps_per_second : float
+        Municipalities stepped per second
+
+    Methods
+    ----------
+    step
+        Run a step of the model, profiled
+    install, uninstall
+        Wrap and unwrap the methods of the phases
+    report, estimators_report
+        Tables of the time of the phases and of the estimators
+    cprofile_stats
+        Statistics of the years run under cProfile
+    reset
+        Clear all the counters
+
+    """
+
+    def __init__(self, model, cprofile_years=None):
+        """
+        Parameters
+        ----------
+        model : SBPAdoption
+            Model to profile
+        cprofile_years : tuple
+            First and last years (included) to run under cProfile. If None,
+            cProfile is not used
+
+        """
+        self.model = model
+        self.cprofile_years = cprofile_years
+        self._wrapped = []
+        self._children = []
+        self.reset()
+
+    def reset(self):
+        self.phases = {phase: [0, 0.] for phase in PHASES + ('other', )}
+        self.estimators = {}
+        self.steps = 0
+        self.step_time = 0.
+        self.agent_steps = 0
+        self._cprofile = None
+
+    @property
+    def agent_steps_per_second(self):
+        return self.agent_steps / self.step_time if self.step_time else 0.
+
+    def _timed(self, phase, function):
+        """
+        Return a wrapper of function adding its calls and its wall time,
+        without the one of the phases called inside it, to the phase.
+
+        """
+        children = self._children
+
+        def timed(*args, **kwargs):
+            children.append(0.)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stats = self.phases[phase]
+                stats[0] += 1
+                stats[1] += elapsed - children.pop()
+                if children:
+                    children[-1] += elapsed
+
+        return timed
+
+    def call_estimator(self, name, method, timed_method, rows):
+        """
+        Called by the _TimedEstimator wrappers.
+
+        """
+        stats = self.estimators.setdefault((name, method), [0, 0, 0.])
+        stats[0] += 1
+        stats[1] += len(rows)
+        start = time.perf_counter()
+        try:
+            return timed_method(rows)
+        finally:
+            stats[2] += time.perf_counter() - start
+
+    def _wrap(self, obj, name, phase):
+        if name in vars(obj):
+            return
+        setattr(obj, name, self._timed(phase, getattr(obj, name)))
+        self._wrapped.append((obj, name))
+
+    def install(self):
+        """
+        Wrap the methods of the phases on the current objects of the model.
+        It is called before each step, since the adoption state and the
+        datacollector are replaced when the model is reset.
+
+        """
+        model = self.model
+        for assembler in model.feature_assemblers.values():
+            self._wrap(assembler, 'assemble', 'features')
+        self._wrap(model, 'get_neighbors_adoption', 'neighbours')
+        self._wrap(model.adoption_state, 'advance', 'advance')
+        self._wrap(model, '_update_adoption_port', 'port_update')
+        self._wrap(model.datacollector, 'collect', 'collect')
+        for name in ('clsf', 'regr'):
+            attribute = '_ml_' + name
+            estimator = getattr(model, attribute)
+            if not isinstance(estimator, _TimedEstimator):
+                setattr(model, attribute,
+                        _TimedEstimator(estimator, name, self))
+
+    def uninstall(self):
+        """
+        Remove all the wrappers, restoring the original methods.
+
+        """
+        for obj, name in self._wrapped:
+            vars(obj).pop(name, None)
+        self._wrapped = []
+        for attribute in ('_ml_clsf', '_ml_regr'):
+            estimator = getattr(self.model, attribute)
+            if isinstance(estimator, _TimedEstimator):
+                setattr(self.model, attribute, estimator.estimator)
+
+    def step(self):
+        """
+        Run a step of the model with all the phases timed (and under
+        cProfile if the year is in cprofile_years).
+
+        """
+        model = self.model
+        self.install()
+        cprofiled = (self.cprofile_years is not None
+                     and self.cprofile_years[0] <= model.year
+                     <= self.cprofile_years[1])
+        if cprofiled:
+            if self._cprofile is None:
+                self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._children.append(0.)
+        start = time.perf_counter()
+        try:
+            model._step()
+        finally:
+            elapsed = time.perf_counter() - start
+            if cprofiled:
+                self._cprofile.disable()
+            self.phases['other'][0] += 1
+            self.phases['other'][1] += elapsed - self._children.pop()
+            self.steps += 1
+            self.step_time += elapsed
+            self.agent_steps += len(model.world)
+
+    def report(self):
+        """
+        Return a DataFrame with the phases as index and as columns the calls,
+        the total time in seconds, the mean time per call in milliseconds and
+        the share of the step time of each phase. The last row is the whole
+        step.
+
+        """
+        index = list(self.phases) + ['step']
+        calls = [stats[0] for stats in self.phases.values()] + [self.steps]
+        seconds = ([stats[1] for stats in self.phases.values()]
+                   + [self.step_time])
+        report = pd.DataFrame({'calls': calls, 'time [s]': seconds},
+                              index=pd.Index(index, name='Phase'))
+        report['time per call [ms]'] = (1000 * report['time [s]']
+                                        / report['calls'].where(
+                                            report['calls'] > 0))
+        report['share of step'] = (report['time [s]'] / self.step_time
+                                   if self.step_time else 0.)
+        return report
+
+    def estimators_report(self):
+        """
+        Return a DataFrame with (Estimator, Method) as index and as columns
+        the calls, the rows predicted, the total time in seconds and the rows
+        predicted per second.
+
+        """
+        index = pd.MultiIndex.from_tuples(list(self.estimators),
+                                          names=['Estimator', 'Method'])
+        report = pd.DataFrame(list(self.estimators.values()), index=index,
+                              columns=['calls', 'rows', 'time [s]'])
+        report['rows per second'] = (report['rows']
+                                     / report['time [s]'].where(
+                                         report['time [s]'] > 0))
+        return report
+
+    def cprofile_stats(self, sort='cumulative', limit=30):
+        """
+        Return the cProfile statistics of the years in cprofile_years,
+        sorted and limited to the first functions, as a string.
+
+        """
+        if self._cprofile is None:
+            raise ValueError('No step was run under cProfile.')
+        out = io.StringIO()
+        pstats.Stats(self._cprofile, stream=out).sort_stats(sort).print_stats(
+            limit
+            )
+        return out.getvalue()
+
+    def dump_cprofile(self, path):
+        """
+        Write the cProfile statistics to a file readable by pstats (e.g. by
+        snakeviz).
+
+        """
+        if self._cprofile is None:
+            raise ValueError('No step was run under cProfile.')
+        self._cprofile.dump_stats(str(path))
+
+    def __str__(self):
+        return (self.report().to_string(float_format='{:.4f}'.format)
+                + '\n\n' + self.estimators_report().to_string(
+                    float_format='{:.4f}'.format
+                    )
+                + '\n\nSteps: {}, agent-steps per second: {:.0f}'.format(
+                    self.steps, self.agent_steps_per_second
+                    ))
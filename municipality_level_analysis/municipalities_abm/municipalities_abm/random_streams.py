@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+"""
+Random streams of the adoption draws of SBPAdoption.
+
+The uniform numbers compared with the probability of adopting given by the
+classifier are not drawn one at a time in the order of the schedule, but all
+together: for each year, an independent stream is derived from the seed of
+the run with a numpy SeedSequence (keyed by the year) and one uniform is drawn
+from it for each municipality, in the order of their index. The draw of a
+municipality in a year therefore depends only on the seed, the year and its
+index, and not on the order of activation, on which municipalities are still
+eligible, on the batching of the predictions or on the process in which the
+run is executed: the same seed always gives the same trajectory.
+
+"""
+
+# Key separating the streams of the adoption draws from any other stream
+# derived from the same seed
+_ADOPTION_DRAWS_KEY = 0
+
+
+class RandomStreams:
+    """
+    Class deriving the random streams of a run from its seed.
+
+    Attributes
+    ----------
+    seed_sequence : numpy SeedSequence
+        Root of all the streams of the run
+    n_municipalities : int
+        Number of uniforms drawn per year
+
+    Methods
+    ----------
+    uniforms
+        Return the adoption draws of all the municipalities in a year
+
+    """
+
+    def __init__(self, seed, n_municipalities):
+        """
+        Parameters
+        ----------
+        seed : int, numpy SeedSequence or None
+            Seed of the run. If None, fresh entropy is taken from the
+            operating system (and stored in seed_sequence.entropy, so that the
+            run can be reproduced)
+        n_municipalities : int
+            Number of municipalities of the model
+
+        """
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self.n_municipalities = n_municipalities
+        self._year = None
+        self._uniforms = None
+
+    def year_sequence(self, year):
+        """
+        Return the SeedSequence of the adoption draws of a year.
+
+        """
+        seed_seq = self.seed_sequence
+        return np.random.SeedSequence(
+            seed_seq.entropy,
+            spawn_key=seed_seq.spawn_key + (_ADOPTION_DRAWS_KEY, year)
+            )
+
+    def uniforms(self, year):
+        """
+        Return the uniforms in [0, 1) drawn for all the municipalities in the
+        year, ordered by their index. They are drawn once per year and then
+        returned again (read-only) to all the callers of the same year.
+
+        """
+        if self._year != year:
+            generator = np.random.Generator(
+                np.random.PCG64(self.year_sequence(year))
+                )
+            self._uniforms = generator.random(self.n_municipalities)
+            self._uniforms.flags.writeable = False
+            self._year = year
+        return self._uniforms
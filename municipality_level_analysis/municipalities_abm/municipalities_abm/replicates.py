@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from .adoption_state import (AdoptionState, PORT_FIRST_YEAR,
+                             check_initial_year, clamp_adoptions)
+from .features import FeatureAssembler, PAYMENT_FEATURE
+from .prediction_cache import CachedEstimator
+from .random_streams import RandomStreams
+
+"""
+Simulation of several replicates (runs with different seeds) of SBPAdoption
+in a single pass.
+
+The adoption state of all the replicates is held in (replicates x
+municipalities) arrays and, at each step, the features of all of them are
+written in the same matrix (see the features module), so that the classifier
+and the regressor are called only once per year for all the replicates
+instead of once per year for each of them. The draws of each replicate are
+the ones of its seed (see the random_streams module), so each replicate
+follows the same trajectory of an SBPAdoption run with that seed.
+
+Each replicate can also have its own yearly SBP payments (see the sweep
+module) and, since the classifier doesn't depend on the payments, the
+classifier rows repeated in several replicates (as the ones of replicates
+with the same seed and different payments, until their adoption diverges)
+can be passed to predict_proba only once.
+
+Only the adoption state needed by the features and by the outputs of the
+ensembles (see the ensemble module) is kept: the yearly adoption of the
+municipalities, their total cumulative adoption and the yearly and total
+adoption of Portugal.
+
+"""
+
+
+class ReplicateEngine:
+    """
+    Class advancing several replicates of SBPAdoption together.
+
+    Attributes
+    ----------
+    world : World
+        Static state shared by all the replicates
+    seeds : list
+        Seed of each replicate
+    first_year, last_year : int
+        First and last simulated years
+    year : int
+        Year simulated by the next step
+    adoption : numpy array
+        (years x replicates x municipalities) yearly adoption, divided by the
+        permanent pastures area of the municipality. The first year is the one
+        of the historical data (state_first_year)
+    cumul_adoption_tot, cumul_adoption_tot_ha : numpy array
+        (replicates x municipalities) total adoption, divided by the permanent
+        pastures area and in hectares
+    yearly_adoption_ha_port : numpy array
+        (replicates x years) adoption of Portugal in hectares
+    adoption_pr_y_port : numpy array
+        Adoption of Portugal in the previous year of each replicate, divided
+        by its permanent pastures area
+    cumul_adoption_tot_ha_port : numpy array
+        Total adoption of Portugal of each replicate, in hectares
+    prediction_cache : PredictionCache or None
+        Cache of the predictions of the ML estimators
+    payments : numpy array or None
+        (replicates x simulated years) payments of each replicate, or None if
+        all the replicates have the payments of the world
+    deduplicate : bool
+        True if the repeated classifier rows are predicted only once
+
+    Methods
+    ----------
+    step
+        Simulate the next year for all the replicates
+    run
+        Simulate all the years and return the outputs of the replicates
+
+    """
+
+    def __init__(self, world, seeds, first_year=1996, last_year=2021,
+                 prediction_cache=None, payments=None, deduplicate=False):
+        """
+        Initialize the adoption state of all the replicates from the
+        historical adoption of the world (as SBPAdoption does).
+
+        Parameters
+        ----------
+        world : World
+            Static state of the model
+        seeds : list
+            Seed of each replicate
+        first_year, last_year : int
+            First and last years to simulate
+        prediction_cache : PredictionCache
+            Cache through which the ML estimators are called (see the
+            prediction_cache module). If None, they are called directly
+        payments : array-like
+            (replicates x years) SBP payment of each replicate in each year
+            from first_year to last_year, in €/hectare. If None, the payments
+            of the world are used
+        deduplicate : bool
+            If True, the repeated classifier rows of a year are passed to
+            predict_proba only once
+
+        """
+        check_initial_year(first_year)
+        if last_year < first_year:
+            raise ValueError('The last year to simulate cannot be previous to '
+                             'the first one.')
+        self.world = world
+        self.seeds = list(seeds)
+        self.first_year = first_year
+        self.last_year = last_year
+        self.year = first_year
+        self.prediction_cache = prediction_cache
+        self.deduplicate = deduplicate
+        if payments is not None:
+            payments = np.asarray(payments, dtype=float)
+            expected_shape = (len(self.seeds), last_year - first_year + 1)
+            if payments.shape != expected_shape:
+                raise ValueError('The payments have shape '
+                                 + str(payments.shape) + ' instead of '
+                                 + str(expected_shape) + ' (replicates x '
+                                 'years).')
+        self.payments = payments
+        if prediction_cache is None:
+            self._ml_clsf, self._ml_regr = world.ml_clsf, world.ml_regr
+        else:
+            self._ml_clsf = CachedEstimator(world.ml_clsf, prediction_cache)
+            self._ml_regr = CachedEstimator(world.ml_regr, prediction_cache)
+
+        n_replicates, n_munic = len(self.seeds), len(world)
+        self._random_streams = [RandomStreams(seed, n_munic)
+                                for seed in self.seeds]
+        self._feature_assemblers = {
+            'clsf': FeatureAssembler(world.ml_clsf_feats, world, 'clsf',
+                                     n_replicates),
+            'regr': FeatureAssembler(world.ml_regr_feats, world, 'regr',
+                                     n_replicates)
+            }
+
+        state = AdoptionState(world.perm_pastures_ha, world.adoption_years,
+                              world.adoption_matrix, first_year)
+        self.state_first_year = state.first_year
+        n_years = last_year - state.first_year + 1
+        n_past_years = min(n_years, state.n_years)
+        self.adoption = np.zeros((n_years, n_replicates, n_munic))
+        self.adoption[:n_past_years] = (
+            state.adoption[:, :n_past_years].T[:, None, :]
+            )
+        self.cumul_adoption_tot = np.tile(state.cumul_adoption_tot,
+                                          (n_replicates, 1))
+        self.cumul_adoption_tot_ha = np.tile(state.cumul_adoption_tot_ha,
+                                             (n_replicates, 1))
+
+        self.perm_pastures_ha_port = state.perm_pastures_ha_port
+        self.yearly_adoption_ha_port = np.zeros((n_replicates, n_years))
+        self.yearly_adoption_ha_port[:, :n_past_years] = (
+            state.yearly_adoption_ha_port[:n_past_years]
+            )
+        self.adoption_pr_y_port = np.full(n_replicates,
+                                          state.adoption_pr_y_port)
+        self.cumul_adoption_tot_ha_port = np.full(
+            n_replicates, state.cumul_adoption_tot_ha_port
+            )
+
+    @property
+    def n_replicates(self):
+        return len(self.seeds)
+
+    def _adoption_in(self, year):
+        """
+        Return the (replicates x municipalities) adoption in a year (0 for the
+        years without adoption data).
+
+        """
+        col = year - self.state_first_year
+        if 0 <= col < len(self.adoption):
+            return self.adoption[col]
+        return np.zeros(self.adoption.shape[1:])
+
+    def _retrieve_payment(self, year):
+        """
+        Return the SBP payments of the year: the (municipalities, ) payments
+        of the policy schedule of the world, common to all the replicates,
+        or the (replicates x 1) payments of each replicate if they were
+        given.
+
+        """
+        if self.payments is None:
+            return self.world.policy_schedule.payments_in(year)
+        return self.payments[:, year - self.first_year, None]
+
+    def _feature_values(self, year):
+        """
+        Return the dynamic features of the year of all the replicates, in the
+        form taken by FeatureAssembler.write (the same values written by
+        SBPAdoption for each run).
+
+        """
+        world = self.world
+        adoption_pr_y = self._adoption_in(year - 1)
+        # (municipalities x replicates) products with the normalized
+        # adjacency, one column per replicate
+        neigh_adoption_pr_y = world.neighbors_weights @ (
+            adoption_pr_y * world.perm_pastures_ha
+            ).T
+        neigh_cumul_adoption = (world.neighbors_weights
+                                @ self.cumul_adoption_tot_ha.T)
+        values = {
+            'adoption_pr_y_munic': adoption_pr_y,
+            'adoption_pr_y_port': self.adoption_pr_y_port[:, None],
+            'adoption_pr_y_neighbours_adj': neigh_adoption_pr_y.T,
+            'tot_cumul_adoption_pr_y_munic': self.cumul_adoption_tot,
+            'tot_cumul_adoption_pr_y_neighbours_adj': neigh_cumul_adoption.T,
+            'tot_cumul_adoption_pr_y_port': (self.cumul_adoption_tot_ha_port
+                                             / self.perm_pastures_ha_port
+                                             )[:, None]
+            }
+        regr_assembler = self._feature_assemblers['regr']
+        if PAYMENT_FEATURE in regr_assembler.dynamic_features:
+            values[PAYMENT_FEATURE] = self._retrieve_payment(year)
+        return values
+
+    def step(self):
+        """
+        Simulate the next year for all the replicates:
+            - the classifier features of all the municipalities of all the
+              replicates that have not adopted SBP on all their permanent
+              pastures are passed once to predict_proba
+            - each probability is compared with the draw of the municipality
+              in the year of its replicate
+            - the regressor features of the adopting ones are passed once to
+              predict
+            - the adoptions are clamped (see adoption_state.clamp_adoptions)
+              and the adoption state of the municipalities and of Portugal is
+              advanced
+
+        """
+        if self.year > self.last_year:
+            raise ValueError('All the years until ' + str(self.last_year)
+                             + ' have already been simulated.')
+        year = self.year
+        cumul_adoption_tot = self.cumul_adoption_tot.ravel()
+        adoption_in_year = np.zeros(cumul_adoption_tot.shape)
+
+        eligible = np.flatnonzero(cumul_adoption_tot < 1)
+        if len(eligible):
+            values = self._feature_values(year)
+            clsf_assembler = self._feature_assemblers['clsf']
+            clsf_assembler.write(year, values)
+            prob_adopt = self._predict_adoption_probability(
+                clsf_assembler.rows(eligible)
+                )
+            draws = np.concatenate(
+                [streams.uniforms(year) for streams in self._random_streams]
+                )[eligible]
+            adopting = eligible[draws < prob_adopt]
+
+            if len(adopting):
+                regr_assembler = self._feature_assemblers['regr']
+                regr_assembler.write(year, values)
+                adoptions = self._ml_regr.predict(
+                    regr_assembler.rows(adopting)
+                    )
+                adoption_in_year[adopting] = clamp_adoptions(
+                    adoptions, cumul_adoption_tot[adopting]
+                    )
+
+        self._advance(year,
+                      adoption_in_year.reshape(self.cumul_adoption_tot.shape))
+        self.year += 1
+
+    def _predict_adoption_probability(self, rows):
+        if not self.deduplicate:
+            return self._ml_clsf.predict_proba(rows)[:, 1]
+        unique_rows, inverse = np.unique(rows, axis=0, return_inverse=True)
+        prob_adopt = self._ml_clsf.predict_proba(unique_rows)[:, 1]
+        return prob_adopt[inverse.ravel()]
+
+    def _advance(self, year, adoption_in_year):
+        """
+        Apply the (replicates x municipalities) adoption of the year and
+        update the adoption of Portugal (as AdoptionState.advance and
+        AdoptionState.update_port).
+
+        """
+        col = year - self.state_first_year
+        adoption_ha = adoption_in_year * self.world.perm_pastures_ha
+        self.adoption[col] = adoption_in_year
+        self.cumul_adoption_tot += adoption_in_year
+        self.cumul_adoption_tot_ha += adoption_ha
+
+        # Sequential sum in order of municipality, as in AdoptionState
+        adoption_port_ha = np.cumsum(
+            np.concatenate([np.zeros((len(adoption_ha), 1)), adoption_ha],
+                           axis=1),
+            axis=1
+            )[:, -1]
+        self.yearly_adoption_ha_port[:, col] = adoption_port_ha
+        self.adoption_pr_y_port = adoption_port_ha / self.perm_pastures_ha_port
+        self.cumul_adoption_tot_ha_port += adoption_port_ha
+
+    def run(self):
+        """
+        Simulate all the remaining years until the last one.
+
+        Returns
+        -------
+        munic_adoption : numpy array
+            (replicates x municipalities x years) yearly adoption of each
+            municipality from the first to the last year, divided by its
+            permanent pastures area
+        yearly_adoption_port : numpy array
+            (replicates x years) area adopted in Portugal in each year, in
+            hectares
+        cumul_adoption_port : numpy array
+            (replicates x years) total area adopted in Portugal until each
+            year, in hectares
+
+        """
+        while self.year <= self.last_year:
+            self.step()
+
+        first_col = self.first_year - self.state_first_year
+        n_years = self.last_year - self.first_year + 1
+        munic_adoption = np.ascontiguousarray(
+            self.adoption[first_col:].transpose(1, 2, 0)
+            )
+        yearly_adoption_port = self.yearly_adoption_ha_port[
+            :, PORT_FIRST_YEAR - self.state_first_year:
+            ]
+        cumul_adoption_port = np.cumsum(yearly_adoption_port, axis=1)
+        return (munic_adoption, yearly_adoption_port[:, -n_years:].copy(),
+                cumul_adoption_port[:, -n_years:].copy())
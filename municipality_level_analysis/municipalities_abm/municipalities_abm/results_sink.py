@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pathlib
+import queue
+import threading
+
+import numpy as np
+import scipy.sparse
+
+from .atomic_files import save_atomically
+
+"""
+Streaming storage of the outputs of large ensembles.
+
+The yearly adoption of the municipalities is zero for most of the
+municipality-years of a run, so the outputs of the runs are not kept in
+memory but passed, as soon as they are completed, to a SparseResultSink that
+writes them from a background thread in partitions of a fixed number of runs.
+Each partition is an npz file with a column for each of the coordinates (run,
+municipality, year) and the value of the non-zero adoptions only, plus the
+dense (runs x years) adoption of Portugal. A metadata.json file lists the
+municipalities, the years and the partitions written so far.
+
+A sink opened with resume=True on a folder already containing partitions
+keeps them, so that an interrupted ensemble can be resumed running only the
+seeds that are not in them (see EnsembleRunner.run): only the runs still
+waiting for their partition when the ensemble stopped are lost.
+
+SparseResults reads the folder back, rebuilding on demand a sparse matrix of
+all the runs, the dense array of some of them or their EnsembleResults, or
+iterating over the partitions one by one, so that the outputs never have to
+fit in memory all together.
+
+The partitions are written as npz files (numpy and scipy are already
+dependencies of the model) rather than in a columnar format such as parquet.
+
+"""
+
+METADATA_FILE = 'metadata.json'
+
+
+def _partition_file(n_partition):
+    return 'part-{:05d}.npz'.format(n_partition)
+
+
+class SparseResultSink:
+    """
+    Class writing the outputs of the runs of an ensemble in sparse
+    partitions, from a background thread.
+
+    Attributes
+    ----------
+    out_folder : pathlib Path
+        Folder of the partitions
+    runs_per_partition : int
+        Number of runs of each partition (except the last one)
+    municipalities : tuple
+        Names of the municipalities
+    years : numpy array
+        Simulated years
+    resume : bool
+        If True, the partitions already in the folder are kept
+
+    Methods
+    ----------
+    completed_seeds
+        Return the seeds of the runs already in the folder
+    open
+        Start the writer thread
+    write
+        Queue the outputs of some runs to be written
+    close
+        Write the last partition and wait for the writer thread to end
+
+    """
+
+    def __init__(self, out_folder, runs_per_partition=100, max_queued=8,
+                 resume=False):
+        """
+        Parameters
+        ----------
+        out_folder : path str
+            Folder where the partitions are written (created if missing)
+        runs_per_partition : int
+            Number of runs of each partition
+        max_queued : int
+            Maximum number of outputs waiting to be written: when it is
+            reached, write blocks until the writer thread catches up
+        resume : bool
+            If True, the partitions already written in the folder by an
+            interrupted ensemble are kept and the new ones are added. If
+            False, they are overwritten
+
+        """
+        if runs_per_partition < 1:
+            raise ValueError('The number of runs per partition has to be '
+                             'positive.')
+        self.out_folder = pathlib.Path(out_folder)
+        self.runs_per_partition = runs_per_partition
+        self.resume = resume
+        self.municipalities = None
+        self.years = None
+        self._queue = queue.Queue(max_queued)
+        self._thread = None
+        self._error = None
+        self._partitions = []
+        self._pending = []
+        self._n_pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self.close()
+
+    def _previous_results(self):
+        if (self.resume
+                and (self.out_folder / METADATA_FILE).exists()):
+            return SparseResults(self.out_folder)
+        return None
+
+    def completed_seeds(self):
+        """
+        Return the set of the seeds of the runs already written in the
+        folder, if the sink resumes an ensemble (empty otherwise).
+
+        """
+        previous = self._previous_results()
+        if previous is None:
+            return set()
+        return set(previous.seeds.tolist())
+
+    def open(self, municipalities, years):
+        """
+        Start the writer thread of the outputs of the municipalities and
+        years given (called by EnsembleRunner.run).
+
+        Raises
+        ------
+        ValueError
+            Raised if the sink resumes an ensemble of other municipalities or
+            years
+
+        """
+        if self._thread is not None:
+            raise ValueError('The sink is already open.')
+        self.municipalities = tuple(municipalities)
+        self.years = np.asarray(years)
+        previous = self._previous_results()
+        if previous is not None:
+            if (previous.municipalities != self.municipalities
+                    or not np.array_equal(previous.years, self.years)):
+                raise ValueError('The outputs in ' + str(self.out_folder)
+                                 + ' are of other municipalities or years.')
+            self._partitions = list(previous.partitions)
+        self.out_folder.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop,
+                                        name='SparseResultSink', daemon=True)
+        self._thread.start()
+
+    def write(self, seeds, munic_adoption, yearly_adoption_port,
+              cumul_adoption_port):
+        """
+        Queue the outputs of some runs (as returned by ensemble.run_batch).
+
+        Raises
+        ------
+        Exception
+            The error raised by the writer thread, if it failed
+
+        """
+        self._raise_error()
+        if self._thread is None:
+            raise ValueError('The sink has to be opened before writing.')
+        self._queue.put((list(seeds), munic_adoption, yearly_adoption_port,
+                         cumul_adoption_port))
+
+    def close(self):
+        """
+        Write the runs still pending and wait for the writer thread to end.
+
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write_loop(self):
+        # After a failure the queue is still drained, so that write never
+        # blocks, and the error is raised by the next write or by close
+        while True:
+            item = self._queue.get()
+            if self._error is not None:
+                if item is None:
+                    return
+                continue
+            try:
+                if item is None:
+                    self._flush()
+                    return
+                self._pending.append(item)
+                self._n_pending += len(item[0])
+                while self._n_pending >= self.runs_per_partition:
+                    self._flush(self.runs_per_partition)
+            except BaseException as error:
+                self._error = error
+                if item is None:
+                    return
+
+    def _flush(self, n_runs=None):
+        """
+        Write the first n_runs pending runs (all if None) as a partition.
+
+        """
+        if not self._n_pending:
+            return
+        seeds = np.concatenate([np.asarray(outputs[0])
+                                for outputs in self._pending])
+        munic_adoption, yearly_adoption_port, cumul_adoption_port = (
+            np.concatenate([outputs[n] for outputs in self._pending])
+            for n in range(1, 4)
+            )
+        if n_runs is None:
+            n_runs = len(seeds)
+        rest = (seeds[n_runs:], munic_adoption[n_runs:],
+                yearly_adoption_port[n_runs:], cumul_adoption_port[n_runs:])
+        self._pending = [rest] if len(rest[0]) else []
+        self._n_pending = len(rest[0])
+
+        run, municipality, year = np.nonzero(munic_adoption[:n_runs])
+        columns = {'seeds': seeds[:n_runs],
+                   'run': run.astype(np.int32),
+                   'municipality': municipality.astype(np.int32),
+                   'year': year.astype(np.int32),
+                   'adoption': munic_adoption[run, municipality, year],
+                   'yearly_adoption_port': yearly_adoption_port[:n_runs],
+                   'cumul_adoption_port': cumul_adoption_port[:n_runs]}
+        file_name = _partition_file(len(self._partitions))
+        save_atomically(self.out_folder / file_name,
+                        lambda file: np.savez(file, **columns))
+        self._partitions.append({'file': file_name, 'n_runs': int(n_runs)})
+        self._write_metadata()
+
+    def _write_metadata(self):
+        metadata = {'municipalities': list(self.municipalities),
+                    'years': self.years.tolist(),
+                    'n_runs': sum(part['n_runs'] for part in self._partitions),
+                    'partitions': self._partitions}
+        save_atomically(
+            self.out_folder / METADATA_FILE,
+            lambda file: file.write(json.dumps(metadata).encode('utf-8'))
+            )
+
+
+class SparseResults:
+    """
+    Class reading the outputs written by a SparseResultSink.
+
+    Attributes
+    ----------
+    folder : pathlib Path
+        Folder of the partitions
+    municipalities : tuple
+        Names of the municipalities
+    years : numpy array
+        Simulated years
+    n_runs : int
+        Number of runs written
+    seeds : numpy array
+        Seed of each run, in the order in which they were written
+
+    Methods
+    ----------
+    iter_partitions
+        Iterate over the contents of the partitions
+    sparse
+        Return the adoption of all the runs as a sparse matrix
+    dense
+        Return the adoption of some runs as a dense array
+    portugal
+        Return the yearly or cumulative adoption of Portugal of all the runs
+    to_ensemble_results
+        Return the EnsembleResults of some runs
+    statistics
+        Return the EnsembleStatistics of some runs
+
+    """
+
+    def __init__(self, folder):
+        """
+        Parameters
+        ----------
+        folder : path str
+            Folder where the partitions were written
+
+        """
+        self.folder = pathlib.Path(folder)
+        with open(self.folder / METADATA_FILE, encoding='utf-8') as file:
+            metadata = json.load(file)
+        self.municipalities = tuple(metadata['municipalities'])
+        self.years = np.array(metadata['years'])
+        self.n_runs = metadata['n_runs']
+        self._partitions = metadata['partitions']
+        seeds = [np.array([], dtype=int)]
+        for part in self._partitions:
+            with np.load(self.folder / part['file']) as columns:
+                seeds.append(columns['seeds'])
+        self.seeds = np.concatenate(seeds)
+
+    @property
+    def partitions(self):
+        return tuple(self._partitions)
+
+    def iter_partitions(self):
+        """
+        Iterate over the partitions, loading one at a time.
+
+        Yields
+        ------
+        dict
+            Columns of the partition: seeds, run (position of the run in the
+            partition), municipality, year (positions in municipalities and
+            years), adoption, yearly_adoption_port and cumul_adoption_port
+
+        """
+        for part in self._partitions:
+            with np.load(self.folder / part['file']) as columns:
+                yield {name: columns[name] for name in columns.files}
+
+    def sparse(self):
+        """
+        Return the yearly adoption of all the municipalities in all the runs
+        as a (runs x municipalities * years) CSR matrix, in which the column
+        of municipality m in year y is m * len(years) + y.
+
+        """
+        n_years = len(self.years)
+        rows, cols, values = [], [], []
+        first_run = 0
+        for columns in self.iter_partitions():
+            rows.append(columns['run'] + first_run)
+            cols.append(columns['municipality'] * n_years + columns['year'])
+            values.append(columns['adoption'])
+            first_run += len(columns['seeds'])
+        shape = (self.n_runs, len(self.municipalities) * n_years)
+        if not values:
+            return scipy.sparse.csr_matrix(shape)
+        return scipy.sparse.csr_matrix(
+            (np.concatenate(values),
+             (np.concatenate(rows), np.concatenate(cols))),
+            shape=shape
+            )
+
+    def dense(self, runs=None):
+        """
+        Return the (runs x municipalities x years) yearly adoption of some
+        runs (all if None), given by their position.
+
+        """
+        runs = (np.arange(self.n_runs) if runs is None
+                else np.asarray(runs, dtype=int))
+        dense = np.zeros((len(runs), len(self.municipalities),
+                          len(self.years)))
+        first_run = 0
+        for columns in self.iter_partitions():
+            n_runs = len(columns['seeds'])
+            in_part = (runs >= first_run) & (runs < first_run + n_runs)
+            if in_part.any():
+                # Position in the output of each run of the partition
+                out_pos = np.full(n_runs, -1)
+                out_pos[runs[in_part] - first_run] = np.flatnonzero(in_part)
+                selected = out_pos[columns['run']] >= 0
+                dense[out_pos[columns['run'][selected]],
+                      columns['municipality'][selected],
+                      columns['year'][selected]] = (
+                          columns['adoption'][selected]
+                          )
+            first_run += n_runs
+        return dense
+
+    def portugal(self, cumulative=False):
+        """
+        Return the (runs x years) yearly (or cumulative) adoption of Portugal
+        in hectares.
+
+        """
+        name = 'cumul_adoption_port' if cumulative else 'yearly_adoption_port'
+        arrays = [columns[name] for columns in self.iter_partitions()]
+        if not arrays:
+            return np.zeros((0, len(self.years)))
+        return np.concatenate(arrays)
+
+    def to_ensemble_results(self, runs=None):
+        """
+        Return the EnsembleResults of some runs (all if None), given by their
+        position, to get the same frames of a run kept in memory.
+
+        """
+        from .ensemble import EnsembleResults
+
+        runs = (np.arange(self.n_runs) if runs is None
+                else np.asarray(runs, dtype=int))
+        return EnsembleResults(self.seeds[runs].tolist(), self.years,
+                               self.municipalities, self.dense(runs),
+                               self.portugal()[runs],
+                               self.portugal(cumulative=True)[runs])
+
+    def statistics(self, seeds=None, runs_per_batch=100, **kwargs):
+        """
+        Return the EnsembleStatistics of the runs of some seeds (all if
+        None), added in the order of the seeds as EnsembleRunner.run does,
+        at most runs_per_batch runs at a time. The other keyword arguments
+        are passed to EnsembleStatistics.
+
+        The partitions are read only once: the runs of each partition are
+        kept in memory until the runs of all the previous seeds have been
+        added, so the memory used depends on how far from the order of the
+        seeds the runs were written (not much for an ensemble, whose runs
+        are written as they are completed).
+
+        Raises
+        ------
+        KeyError
+            Raised if a seed has no run in the folder
+
+        """
+        from .ensemble_statistics import EnsembleStatistics
+
+        seeds = (sorted(set(self.seeds.tolist())) if seeds is None
+                 else list(seeds))
+        # Positions of each seed in the order of the statistics
+        order = {}
+        for n_run, seed in enumerate(seeds):
+            order.setdefault(seed, []).append(n_run)
+        missing = sorted(set(order) - set(self.seeds.tolist()))
+        if missing:
+            raise KeyError('No run of the seeds ' + str(missing[:10])
+                           + ' in ' + str(self.folder) + '.')
+        statistics = EnsembleStatistics(self.municipalities, self.years,
+                                        **kwargs)
+        # Outputs of the runs read but not yet added, by position, and
+        # position of the next run to add
+        pending = {}
+        next_run = 0
+        for columns in self.iter_partitions():
+            dense = np.zeros((len(columns['seeds']), len(self.municipalities),
+                              len(self.years)))
+            dense[columns['run'], columns['municipality'],
+                  columns['year']] = columns['adoption']
+            for n_run, seed in enumerate(columns['seeds'].tolist()):
+                for position in order.pop(seed, ()):
+                    pending[position] = (
+                        dense[n_run], columns['yearly_adoption_port'][n_run],
+                        columns['cumul_adoption_port'][n_run]
+                        )
+            # Only complete batches are added (except the last one), so the
+            # batches don't depend on the partitions
+            while next_run < len(seeds):
+                batch = range(next_run,
+                              min(next_run + runs_per_batch, len(seeds)))
+                if not all(position in pending for position in batch):
+                    break
+                outputs = [pending.pop(position) for position in batch]
+                statistics.update(*(np.stack(arrays)
+                                    for arrays in zip(*outputs)))
+                next_run = batch.stop
+        return statistics
@@ -1,17 +1,18 @@
 # -*- coding: utf-8 -*-
 
+"""
+Visualization entry point of the model: the only module of the package
+importing mesa's visualization, mesa_geo's MapModule and plotly.
+Launch it with run.py or with "python -m municipalities_abm.server".
+
+"""
+
 from mesa.visualization.modules import TextElement, ChartModule
 from mesa_geo.visualization.MapModule import MapModule
 from mesa_geo.visualization.ModularVisualization import ModularServer
 import plotly.colors
 
 from .model import SBPAdoption
-from .custom_transformers import (
-    TransformCensusFeaturesClsf,
-    TransformCensusFeaturesRegr,
-    TransformClimateFeatures,
-    TransformSoilFeatures
-    )
 from .colors_interpolation import get_continuous_color
 
 start_year = 1996
@@ -98,3 +99,7 @@ modular_server = ModularServer(
     model_params
     )
 # server.port = 8521
+
+
+if __name__ == '__main__':
+    modular_server.launch()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import pathlib
+import subprocess
+import sys
+
+"""
+Import-time diagnostic of the package.
+
+Run as:
+    python -m municipalities_abm.startup [module ...] [--budget-ms MS]
+
+Each module is imported in a fresh interpreter with "python -X importtime",
+so the measure is the one paid by a newly spawned worker. The report shows
+the total import time, the slowest top-level imports and which of the heavy
+optional dependencies were loaded. If a budget is given, the exit status is 1
+when any module exceeds it, so the check can be used in scripts.
+
+"""
+
+# Modules that the headless core should not import
+HEAVY_MODULES = ('geopandas', 'shapely', 'fiona', 'pyproj', 'mesa_geo',
+                 'sklearn', 'joblib', 'scipy', 'plotly', 'matplotlib')
+
+DEFAULT_MODULES = ('municipalities_abm.model', )
+
+_PROJECT_FOLDER = pathlib.Path(__file__).parent.parent
+
+
+def measure_import(module, python=sys.executable):
+    """
+    Import a module in a new interpreter and return its import times.
+
+    Parameters
+    ----------
+    module : str
+        Name of the module to import
+    python : str
+        Path of the Python interpreter to use
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the import fails
+
+    Returns
+    -------
+    list of tuple
+        For each imported module, in import order: (name, depth in the import
+        tree, self time in µs, cumulative time in µs)
+
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(_PROJECT_FOLDER)] + ([env['PYTHONPATH']]
+                                  if env.get('PYTHONPATH') else [])
+        )
+    result = subprocess.run([python, '-X', 'importtime', '-c',
+                             'import ' + module],
+                            capture_output=True, text=True, env=env,
+                            cwd=_PROJECT_FOLDER)
+    if result.returncode != 0:
+        raise RuntimeError('Import of ' + module + ' failed:\n'
+                           + result.stderr[-2000:])
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def startup_report(module, n_slowest=10):
+    """
+    Return the import-time report of a module as a string, together with
+    its total import time in milliseconds.
+
+    """
+    imports = measure_import(module)
+    top_level = [imp for imp in imports if imp[1] == 0]
+    total_ms = sum(imp[3] for imp in top_level) / 1000
+    imported = {imp[0] for imp in imports}
+    heavy_loaded = [name for name in HEAVY_MODULES if name in imported]
+
+    lines = ['Import of ' + module + ' (with interpreter startup): '
+             '{:.1f} ms'.format(total_ms),
+             '  Slowest top-level imports:']
+    for name, _, _, cumulative_us in sorted(top_level, key=lambda imp: imp[3],
+                                            reverse=True)[:n_slowest]:
+        lines.append('    {:>9.1f} ms  {}'.format(cumulative_us / 1000, name))
+    lines.append('  Heavy dependencies loaded: '
+                 + (', '.join(heavy_loaded) if heavy_loaded else 'none'))
+    return '\n'.join(lines), total_ms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Report the import time of the modules of the package.'
+        )
+    parser.add_argument('modules', nargs='*', default=list(DEFAULT_MODULES),
+                        help='Modules to import (default: %(default)s)')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='Maximum import time allowed for each module')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of slowest imports to show')
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    for module in args.modules:
+        report, total_ms = startup_report(module, args.top)
+        print(report)
+        if args.budget_ms is not None and total_ms > args.budget_ms:
+            over_budget.append(module)
+
+    if over_budget:
+        print('Over the budget of {:.0f} ms: '.format(args.budget_ms)
+              + ', '.join(over_budget))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from .adoption_state import check_initial_year
+from .ensemble import EnsembleResults
+from .input_data import load_sbp_payments
+from .replicates import ReplicateEngine
+
+"""
+Sweeps of the model over many schedules of SBP payments.
+
+All the runs of all the payment scenarios (one per seed) are simulated
+together by ReplicateEngines (see the replicates module), with the replicates
+ordered by scenario and then by seed. The static features of the
+municipalities are assembled once, each year the ML estimators are called
+once for all the replicates, and the classifier, which doesn't depend on the
+payments, predicts only once the rows shared by several replicates: the runs
+of different scenarios with the same seed have the same adoption until the
+first year in which their payments are different, and many municipalities
+keep the same state in all of them also afterwards.
+
+The run of a scenario with a seed follows the same trajectory of an
+SBPAdoption run with that seed and those payments.
+
+Run as:
+    python -m municipalities_abm sweep payments_a.xlsx payments_b.xlsx
+        --runs N --years 1996-2021 --out DIR
+
+"""
+
+
+def load_payment_scenarios(paths):
+    """
+    Load the payment schedules of several scenarios from spreadsheets with
+    the format of the SBP payments of the model inputs (see
+    input_data.load_sbp_payments).
+
+    Parameters
+    ----------
+    paths : list of path str
+        Spreadsheets of the scenarios, each named as its file
+
+    Returns
+    -------
+    pandas DataFrame
+        Payments in €/hectare, with the scenarios as index and the years as
+        columns (NaN in the years missing in a spreadsheet)
+
+    """
+    paths = list(paths)
+    schedules = {pathlib.Path(path).stem: load_sbp_payments(path)
+                 ['sbp_payment'] for path in paths}
+    if len(schedules) < len(paths):
+        raise ValueError('The payment scenarios need different file names.')
+    payments = pd.DataFrame(schedules).T.sort_index(axis=1)
+    payments.index.name = 'Scenario'
+    payments.columns.name = 'Year'
+    return payments
+
+
+def _payments_matrix(payments, first_year, last_year, payment_years):
+    """
+    Return the names of the scenarios and their (scenarios x simulated
+    years) payments.
+
+    """
+    if isinstance(payments, pd.DataFrame):
+        names = [str(name) for name in payments.index]
+        payment_years = payments.columns
+        payments = payments.to_numpy(dtype=float)
+    else:
+        payments = np.atleast_2d(np.asarray(payments, dtype=float))
+        names = ['Scenario ' + str(n_scen + 1)
+                 for n_scen in range(len(payments))]
+        if payment_years is None:
+            payment_years = range(first_year, first_year + payments.shape[1])
+    payment_years = list(payment_years)
+    if len(payment_years) != payments.shape[1]:
+        raise ValueError('The payments have ' + str(payments.shape[1])
+                         + ' years instead of ' + str(len(payment_years))
+                         + '.')
+
+    columns = []
+    for year in range(first_year, last_year + 1):
+        try:
+            columns.append(payment_years.index(year))
+        except ValueError:
+            raise KeyError('Payment for ' + str(year) + ' not available. '
+                           'Year outside the time span of the scenarios.')
+    payments = payments[:, columns]
+    if np.isnan(payments).any():
+        missing = np.nonzero(np.isnan(payments))
+        raise KeyError('Payment for ' + str(first_year + missing[1][0])
+                       + ' not available in ' + names[missing[0][0]] + '.')
+    return names, payments
+
+
+def run_payment_sweep(world, payments, seeds=(0, ), first_year=1996,
+                      last_year=2021, payment_years=None,
+                      prediction_cache=None, batch_size=None,
+                      deduplicate=True):
+    """
+    Run the model once for each seed under each payment scenario.
+
+    Parameters
+    ----------
+    world : World
+        World of the runs (the headless one is enough)
+    payments : pandas DataFrame or array-like
+        Payment in €/hectare of each scenario in each year: a DataFrame with
+        the scenarios as index and the years as columns (as returned by
+        load_payment_scenarios), or a (scenarios x years) array
+    seeds : iterable of int or int
+        Seeds of the runs of each scenario. If an int n, the seeds are 0,
+        ..., n-1
+    first_year, last_year : int
+        First and last years to simulate
+    payment_years : list
+        Years of the columns of an array of payments. If None, they start
+        from first_year
+    prediction_cache : PredictionCache
+        Cache through which the ML estimators are called (see the
+        prediction_cache module)
+    batch_size : int
+        Maximum number of runs simulated together, to bound the memory used.
+        The runs of a scenario are never split. If None, all the runs are
+        simulated together
+    deduplicate : bool
+        If True, the classifier rows shared by several runs are predicted
+        only once per year
+
+    Returns
+    -------
+    SweepResults
+
+    """
+    check_initial_year(first_year)
+    if last_year < first_year:
+        raise ValueError('The last year of the sweep cannot be previous to '
+                         'the first one.')
+    if isinstance(seeds, (int, np.integer)):
+        seeds = range(seeds)
+    seeds = list(seeds)
+    if not seeds:
+        raise ValueError('A sweep needs at least one seed.')
+    names, payments = _payments_matrix(payments, first_year, last_year,
+                                       payment_years)
+    n_seeds = len(seeds)
+    scenarios_per_batch = (len(names) if batch_size is None
+                           else max(1, batch_size // n_seeds))
+
+    outputs = []
+    for start in range(0, len(names), scenarios_per_batch):
+        batch_payments = payments[start:start + scenarios_per_batch]
+        engine = ReplicateEngine(
+            world, seeds * len(batch_payments), first_year, last_year,
+            prediction_cache, np.repeat(batch_payments, n_seeds, axis=0),
+            deduplicate
+            )
+        outputs.append(engine.run())
+
+    # From (scenarios * seeds x ...) to (scenarios x seeds x ...)
+    munic_adoption, yearly_adoption_port, cumul_adoption_port = (
+        stacked.reshape((len(names), n_seeds) + stacked.shape[1:])
+        for stacked in map(np.concatenate, zip(*outputs))
+        )
+    return SweepResults(names, seeds, range(first_year, last_year + 1),
+                        world.names, payments, munic_adoption,
+                        yearly_adoption_port, cumul_adoption_port)
+
+
+class SweepResults:
+    """
+    Class for the outputs of all the runs of a payment sweep.
+
+    Attributes
+    ----------
+    scenarios : list
+        Names of the payment scenarios
+    seeds : list
+        Seeds of the runs of each scenario
+    years : numpy array
+        Simulated years
+    municipalities : tuple
+        Names of the municipalities
+    payments : numpy array
+        (scenarios x years) payment of each scenario, in €/hectare
+    munic_adoption : numpy array
+        (scenarios x runs x municipalities x years) yearly adoption of each
+        municipality, divided by its permanent pastures area
+    yearly_adoption_port : numpy array
+        (scenarios x runs x years) area adopted in Portugal in each year, in
+        hectares
+    cumul_adoption_port : numpy array
+        (scenarios x runs x years) total area adopted in Portugal until each
+        year, in hectares
+
+    Methods
+    ----------
+    scenario_results
+        Outputs of the runs of a scenario, as EnsembleResults
+    portugal_frame, municipalities_frame
+        Average adoption of each scenario over its runs
+    save
+        Write the outputs as csv files
+
+    """
+
+    def __init__(self, scenarios, seeds, years, municipalities, payments,
+                 munic_adoption, yearly_adoption_port, cumul_adoption_port):
+        self.scenarios = list(scenarios)
+        self.seeds = list(seeds)
+        self.years = np.asarray(years)
+        self.municipalities = tuple(municipalities)
+        self.payments = payments
+        self.munic_adoption = munic_adoption
+        self.yearly_adoption_port = yearly_adoption_port
+        self.cumul_adoption_port = cumul_adoption_port
+
+    def scenario_results(self, scenario):
+        """
+        Return the outputs of the runs of a scenario, given by name or by
+        position, as EnsembleResults (see the ensemble module).
+
+        """
+        if not isinstance(scenario, (int, np.integer)):
+            scenario = self.scenarios.index(scenario)
+        return EnsembleResults(self.seeds, self.years, self.municipalities,
+                               self.munic_adoption[scenario],
+                               self.yearly_adoption_port[scenario],
+                               self.cumul_adoption_port[scenario])
+
+    def payments_frame(self):
+        return pd.DataFrame(self.payments.T,
+                            index=pd.Index(self.years, name='Year'),
+                            columns=self.scenarios)
+
+    def portugal_frame(self, cumulative=False):
+        """
+        Return the yearly (or cumulative) adoption of Portugal in hectares,
+        averaged over the runs, with the years as index and a column per
+        scenario.
+
+        """
+        data = (self.cumul_adoption_port if cumulative
+                else self.yearly_adoption_port)
+        return pd.DataFrame(data.mean(axis=1).T,
+                            index=pd.Index(self.years, name='Year'),
+                            columns=self.scenarios)
+
+    def municipalities_frame(self):
+        """
+        Return the yearly adoption of the municipalities averaged over the
+        runs, with (Municipality, Year) as index and a column per scenario.
+
+        """
+        index = pd.MultiIndex.from_product([self.municipalities, self.years],
+                                           names=['Municipality', 'Year'])
+        data = self.munic_adoption.mean(axis=1).reshape(
+            len(self.scenarios), -1
+            ).T
+        return pd.DataFrame(data, index=index, columns=self.scenarios)
+
+    def save(self, out_folder, runs=False):
+        """
+        Write the outputs as csv files in out_folder (created if missing):
+            - payments.csv, with the payments of each scenario
+            - municipalities_yearly_adoption.csv
+            - portugal_yearly_adoption.csv
+            - portugal_cumulative_adoption.csv
+        with the average over the runs of each scenario. If runs is True, the
+        outputs of all the runs of each scenario are also written in a
+        subfolder named as the scenario (see EnsembleResults.save).
+
+        """
+        out_folder = pathlib.Path(out_folder)
+        out_folder.mkdir(parents=True, exist_ok=True)
+        self.payments_frame().to_csv(out_folder / 'payments.csv')
+        self.municipalities_frame().to_csv(
+            out_folder / 'municipalities_yearly_adoption.csv'
+            )
+        self.portugal_frame().to_csv(
+            out_folder / 'portugal_yearly_adoption.csv'
+            )
+        self.portugal_frame(cumulative=True).to_csv(
+            out_folder / 'portugal_cumulative_adoption.csv'
+            )
+        if runs:
+            for n_scen, scenario in enumerate(self.scenarios):
+                self.scenario_results(n_scen).save(out_folder / scenario)
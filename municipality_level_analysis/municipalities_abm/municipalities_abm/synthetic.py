@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from .bundle import ScenarioBundle, _write_bundle
+from .topology import GEO_CRS
+
+"""
+Synthetic input data with the same schema of the real ones.
+
+The data of the municipalities are not distributed with the repository, so
+write_synthetic_bundle generates, from a seed, a scenario bundle (see the
+bundle module) with the transformed census, climate and soil features
+expected by the ML models, a historical adoption, the payments and an
+adjacency of the municipalities, laid out on a grid. The bundle has no
+geometries, so it can only be used by headless Worlds, with the fitted ML
+models of the ml_model folder.
+The values are random but in the ranges of the real ones, so that the costs
+of building and running the model are representative of the real ones.
+
+"""
+
+CENSUS_FEATURES = ('pastures_area_munic', 'pastures_mean_size_munic',
+                   'individual_prod_num', 'individual_prod_in_business',
+                   'land_rented', 'educ_3rd_cycle_or_higher',
+                   'prof_above_some_long', 'ext_sit_not_employer',
+                   'econ_above_40', 'econ_0_2', 'econ_2_4')
+
+CLIMATE_FEATURES = ('av_d_mean_t_average_munic', 'av_d_max_t_average_munic',
+                    'cons_days_no_prec_average_munic')
+
+SOIL_FEATURES = ('CaCO3_mean_munic', 'CN_mean_munic', 'N_mean_munic',
+                 'P_mean_munic')
+
+ADOPTION_YEARS = range(1995, 2013)
+
+PAYMENT_YEARS = range(1995, 2031)
+
+# Number of municipalities and of districts of Portugal (mainland)
+N_MUNICIPALITIES = 278
+N_DISTRICTS = 18
+
+
+def _grid_adjacency(n_municipalities):
+    """
+    Return the CSR adjacency (indptr and indices) of municipalities placed
+    row by row on a square grid, each touching the ones above, below, on the
+    left and on the right.
+
+    """
+    n_cols = int(np.ceil(np.sqrt(n_municipalities)))
+    indptr = [0]
+    indices = []
+    for munic in range(n_municipalities):
+        row, col = divmod(munic, n_cols)
+        neighbors = [munic - n_cols if row > 0 else None,
+                     munic - 1 if col > 0 else None,
+                     munic + 1 if col < n_cols - 1 else None,
+                     munic + n_cols]
+        indices.extend(neighbor for neighbor in neighbors
+                       if neighbor is not None and neighbor < n_municipalities)
+        indptr.append(len(indices))
+    return (np.array(indptr, dtype=np.int64),
+            np.array(indices, dtype=np.int64))
+
+
+def synthetic_arrays(n_municipalities=N_MUNICIPALITIES, seed=0):
+    """
+    Generate the data of the municipalities.
+
+    Returns
+    -------
+    meta : dict
+        Metadata of the bundle
+    arrays : dict
+        Arrays of the bundle
+
+    """
+    rng = np.random.default_rng(seed)
+    n = n_municipalities
+
+    census = np.column_stack([
+        rng.lognormal(7., 1.2, n),          # pastures_area_munic [ha]
+        rng.lognormal(2.5, 0.8, n),         # pastures_mean_size_munic [ha]
+        rng.lognormal(6., 1., n).round(),   # individual_prod_num
+        rng.uniform(0., 0.1, n),            # individual_prod_in_business
+        rng.uniform(0., 0.6, n),            # land_rented
+        rng.uniform(0., 0.5, n),            # educ_3rd_cycle_or_higher
+        rng.uniform(0., 0.3, n),            # prof_above_some_long
+        rng.uniform(0.5, 1., n),            # ext_sit_not_employer
+        rng.uniform(0., 0.1, n),            # econ_above_40
+        rng.uniform(0., 0.6, n),            # econ_0_2
+        rng.uniform(0., 0.3, n)             # econ_2_4
+        ])
+    climate = np.column_stack([
+        rng.uniform(11., 18., n),
+        rng.uniform(17., 25., n),
+        rng.uniform(20., 70., n)
+        ])
+    soil = np.column_stack([
+        rng.uniform(0., 5., n),
+        rng.uniform(8., 15., n),
+        rng.uniform(0.5, 3., n),
+        rng.uniform(5., 50., n)
+        ])
+
+    # A few municipalities adopt a small fraction of their pastures in some
+    # years, never exceeding their area
+    adopting = rng.random((n, len(ADOPTION_YEARS))) < 0.1
+    adoption = np.where(adopting,
+                        rng.uniform(0., 1. / len(ADOPTION_YEARS),
+                                    adopting.shape),
+                        0.)
+    sbp_payments = np.round(rng.uniform(40., 60., len(PAYMENT_YEARS)), 2)
+    adjacency_indptr, adjacency_indices = _grid_adjacency(n)
+
+    names = ['Municipality ' + str(munic + 1) for munic in range(n)]
+    districts = ['District ' + str(munic * N_DISTRICTS // n + 1)
+                 for munic in range(n)]
+    meta = {
+        'source_hash': 'synthetic-' + str(n) + '-' + str(seed),
+        'crs': GEO_CRS,
+        'unique_ids': ['{:04d}'.format(munic + 1) for munic in range(n)],
+        'attributes': {'Municipality': names, 'District': districts},
+        'census_features': list(CENSUS_FEATURES),
+        'adoption_years': list(ADOPTION_YEARS),
+        'climate_features': list(CLIMATE_FEATURES),
+        'soil_features': list(SOIL_FEATURES),
+        'payment_years': list(PAYMENT_YEARS),
+        }
+    arrays = {
+        'census': census,
+        'adoption': adoption,
+        'climate': climate,
+        'soil': soil,
+        'sbp_payments': sbp_payments,
+        'geometry_wkb': np.zeros(0, dtype=np.uint8),
+        'geometry_offsets': np.zeros(n + 1, dtype=np.int64),
+        'adjacency_indptr': adjacency_indptr,
+        'adjacency_indices': adjacency_indices,
+        }
+    return meta, arrays
+
+
+def write_synthetic_bundle(path, n_municipalities=N_MUNICIPALITIES, seed=0):
+    """
+    Write a synthetic scenario bundle (see the module description).
+
+    Parameters
+    ----------
+    path : path str
+        Path of the bundle file
+    n_municipalities : int
+        Number of municipalities
+    seed : int
+        Seed of the random data: the same seed gives the same bundle
+
+    Returns
+    -------
+    ScenarioBundle
+        The synthetic bundle, opened
+
+    """
+    meta, arrays = synthetic_arrays(n_municipalities, seed)
+    _write_bundle(path, meta, arrays)
+    return ScenarioBundle(path)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import pathlib
+
+import numpy as np
+
+from . import input_data
+from .atomic_files import save_atomically
+from .model_inputs import municipalities_shp_path, topology_cache_folder_path
+
+"""
+Adjacency topology of the municipalities.
+
+Finding the touching neighbours of each municipality requires polygon
+intersection tests, so the result is stored as a CSR sparse matrix in the
+cache folder under a key calculated from the content of the shapefile and is
+reused by all the following loads of the same shapefile.
+
+"""
+
+# CRS of the geometries: the one in which mesa_geo's AgentCreator creates the
+# agents, and therefore the one in which GeoSpace.get_neighbors works
+GEO_CRS = 'epsg:3857'
+
+
+class Topology:
+    """
+    Class for the adjacency topology of the municipalities.
+
+    Attributes
+    ----------
+    adjacency : scipy sparse CSR matrix
+        (municipalities x municipalities) matrix with 1 where two
+        municipalities touch each other
+    indptr, indices : numpy array
+        CSR representation of the adjacency: the neighbours of the i-th
+        municipality are indices[indptr[i]:indptr[i+1]]
+
+    Methods
+    ----------
+    neighbors
+        Return the indexes of the neighbours of a municipality
+    neighbor_indices
+        Return the indexes of the neighbours of all the municipalities
+    weighted_adjacency
+        Return the adjacency with a weight for each row
+
+    """
+
+    def __init__(self, indptr, indices):
+        import scipy.sparse
+
+        self._indptr = np.asarray(indptr, dtype=np.int64)
+        self._indices = np.asarray(indices, dtype=np.int64)
+        n_munic = len(self._indptr) - 1
+        self._adjacency = scipy.sparse.csr_matrix(
+            (np.ones(len(self._indices)), self._indices, self._indptr),
+            shape=(n_munic, n_munic)
+            )
+        self._neighbor_indices = None
+
+    @property
+    def adjacency(self):
+        return self._adjacency
+
+    @property
+    def indptr(self):
+        return self._indptr
+
+    @property
+    def indices(self):
+        return self._indices
+
+    def __len__(self):
+        return len(self._indptr) - 1
+
+    def neighbors(self, munic_idx):
+        """
+        Return the array of the indexes of the municipalities touching the
+        one with index munic_idx.
+
+        """
+        return self._indices[self._indptr[munic_idx]:
+                             self._indptr[munic_idx + 1]]
+
+    def weighted_adjacency(self, row_weights):
+        """
+        Return the adjacency as a scipy CSR matrix in which the entries of the
+        i-th row are equal to row_weights[i] instead of 1 (i.e. the product
+        diag(row_weights) @ adjacency).
+
+        """
+        import scipy.sparse
+
+        data = np.repeat(np.asarray(row_weights, dtype=float),
+                         np.diff(self._indptr))
+        return scipy.sparse.csr_matrix((data, self._indices, self._indptr),
+                                       shape=self._adjacency.shape)
+
+    def neighbor_indices(self):
+        """
+        Return a tuple with, for each municipality, the read-only array of the
+        indexes of the touching ones.
+
+        """
+        if self._neighbor_indices is None:
+            neighbor_indices = []
+            for munic_idx in range(len(self)):
+                neighbors = self.neighbors(munic_idx).copy()
+                neighbors.setflags(write=False)
+                neighbor_indices.append(neighbors)
+            self._neighbor_indices = tuple(neighbor_indices)
+        return self._neighbor_indices
+
+
+def touching_neighbors(geometries):
+    """
+    Find for each geometry the ones touching it (the same relation used by
+    mesa_geo's GeoSpace.get_neighbors) and return them in CSR format.
+
+    Parameters
+    ----------
+    geometries : geopandas GeoSeries
+        Geometries of the municipalities
+
+    Returns
+    -------
+    indptr, indices : numpy array
+        CSR representation of the adjacency
+
+    """
+    sindex = geometries.sindex
+    geoms = geometries.values
+    indptr = np.zeros(len(geoms) + 1, dtype=np.int64)
+    all_indices = []
+    for i, geom in enumerate(geoms):
+        neighbors = np.sort(sindex.query(geom, predicate='touches'))
+        neighbors = neighbors[neighbors != i]
+        all_indices.append(neighbors)
+        indptr[i + 1] = indptr[i] + len(neighbors)
+    indices = (np.concatenate(all_indices).astype(np.int64) if all_indices
+               else np.zeros(0, dtype=np.int64))
+    return indptr, indices
+
+
+def get_topology_key(shapefile_path=municipalities_shp_path):
+    """
+    Return the key identifying the topology of a shapefile: the SHA-256 digest
+    of all its files and of the CRS in which the neighbours are searched.
+
+    """
+    shapefile_hash = input_data.hash_files(
+        input_data.shapefile_paths(shapefile_path)
+        )
+    return shapefile_hash + '_' + GEO_CRS.replace(':', '')
+
+
+def load_topology(shapefile_path=municipalities_shp_path,
+                  geometries=None,
+                  cache_folder=topology_cache_folder_path):
+    """
+    Return the topology of the municipalities of a shapefile, computing it
+    only if it is not already in the cache.
+
+    Parameters
+    ----------
+    shapefile_path : path str
+        Path to the shapefile of the municipalities
+    geometries : geopandas GeoSeries
+        Geometries of the shapefile in GEO_CRS, if already loaded. Used only
+        if the topology has to be computed
+    cache_folder : path str or None
+        Path to the folder where the topologies are stored. If None, the
+        topology is computed without using the cache.
+
+    Returns
+    -------
+    Topology
+
+    """
+    if cache_folder is not None:
+        cache_path = (pathlib.Path(cache_folder)
+                      / (get_topology_key(shapefile_path) + '.npz'))
+        try:
+            with np.load(cache_path) as cached:
+                return Topology(cached['indptr'], cached['indices'])
+        except Exception:
+            # Missing or damaged entry: the topology is computed again and
+            # the entry overwritten
+            pass
+
+    if geometries is None:
+        geometries = input_data.load_municipalities_shapefile(
+            shapefile_path
+            ).geometry.to_crs(GEO_CRS)
+    indptr, indices = touching_neighbors(geometries)
+
+    if cache_folder is not None:
+        _store_in_cache(cache_path, indptr, indices)
+    return Topology(indptr, indices)
+
+
+def _store_in_cache(cache_path, indptr, indices):
+    """
+    Called by load_topology.
+
+    Save the CSR arrays atomically in the cache (see the atomic_files
+    module).
+
+    """
+    save_atomically(cache_path, lambda tmp_file: np.savez(
+        tmp_file, indptr=indptr, indices=indices
+        ))
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+"""
+Validation metrics of the outputs of an ensemble against the observed
+adoption.
+
+All the metrics of the validation notebook (RMSE, relative RMSE, MAE and
+adjusted R2) are calculated for all the runs at once, broadcasting the
+(runs x municipalities x years) predictions against the (municipalities x
+years) observations:
+    - macro validation: yearly adoption of Portugal, one value per run and
+      for the average prediction
+    - micro validation: yearly adoption of the municipalities, one value per
+      run and for the average prediction
+    - yearly micro validation: RMSE and relative RMSE in each year and from
+      the first year until each year, for the average prediction or for
+      each run
+Only the municipality-years observed (not NaN) are compared, as with the
+inner join of the notebook. The relative RMSE is the RMSE divided by the
+standard deviation of the observations, and R2 is defined as in sklearn
+(r2_score). The adjusted R2 is not defined (NaN) when the observations are
+not more than the features plus one: since the national adoption has one
+observation per year, macro_validation can be given the number of
+observations of the notebook (the municipality-years observed) instead.
+
+"""
+
+# Number of features of the regressor with the SBP payments, used for the
+# adjusted R2
+N_FEATURES = 21
+
+# Last year of the observed adoption used for the validation
+LAST_VALIDATION_YEAR = 2012
+
+METRICS = ('rmse', 'relative_rmse', 'mae', 'r2', 'adjusted_r2')
+
+
+def adjusted_r2(r2, n, p=N_FEATURES):
+    """
+    Return the adjusted R2 of n observations predicted with p features, NaN
+    where n <= p + 1.
+
+    """
+    r2 = np.asarray(r2, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        adj_r2 = 1 - (1 - r2) * (n - 1) / (n - p - 1)
+    return np.where(n > p + 1, adj_r2, np.nan)
+
+
+def regression_metrics(observed, predicted, axis=-1, n_features=N_FEATURES,
+                       n_observations=None):
+    """
+    Calculate all the metrics of predictions against observations, reducing
+    the axes given and broadcasting over all the others (e.g. the runs).
+    The NaN observations are excluded.
+
+    Parameters
+    ----------
+    observed : numpy array
+        Observations, broadcastable to the predictions
+    predicted : numpy array
+        Predictions
+    axis : int or tuple
+        Axes over which the metrics are calculated
+    n_features : int
+        Number of features for the adjusted R2
+    n_observations : int
+        Number of observations for the adjusted R2. If None, the number of
+        observations compared
+
+    Returns
+    -------
+    dict
+        Maps each metric of METRICS to its values
+
+    """
+    observed = np.asarray(observed, dtype=float)
+    predicted = np.asarray(predicted, dtype=float)
+    observed, predicted = np.broadcast_arrays(observed, predicted)
+    weights = ~np.isnan(observed)
+    observed = np.where(weights, observed, 0)
+
+    n_obs = weights.sum(axis=axis)
+    errors = np.where(weights, predicted - observed, 0)
+    sse = (errors ** 2).sum(axis=axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        obs_mean = (observed.sum(axis=axis, keepdims=True)
+                    / weights.sum(axis=axis, keepdims=True))
+        ss_tot = (np.where(weights, observed - obs_mean, 0) ** 2).sum(
+            axis=axis
+            )
+        rmse = np.sqrt(sse / n_obs)
+        relative_rmse = rmse / np.sqrt(ss_tot / n_obs)
+        # As r2_score: 1 if the observations are constant and predicted
+        # exactly, 0 if they are constant and not predicted exactly
+        r2 = np.where(ss_tot > 0, 1 - sse / ss_tot,
+                      np.where(sse == 0, 1., 0.))
+        mae = np.abs(errors).sum(axis=axis) / n_obs
+        adj_r2 = adjusted_r2(r2, n_obs if n_observations is None
+                             else n_observations, n_features)
+    return {'rmse': rmse,
+            'relative_rmse': relative_rmse,
+            'mae': mae,
+            'r2': r2,
+            'adjusted_r2': adj_r2}
+
+
+def _years_positions(years, first_year, last_year):
+    years = np.asarray(years)
+    first_year = years[0] if first_year is None else first_year
+    selected = (years >= first_year) & (years <= last_year)
+    if not selected.any():
+        raise ValueError('No simulated year between ' + str(first_year)
+                         + ' and ' + str(last_year) + '.')
+    return np.flatnonzero(selected)
+
+
+def observed_matrix(observed, municipalities, years):
+    """
+    Return the observed adoption of the municipalities as a (municipalities
+    x years) matrix, with NaN where not observed.
+
+    Parameters
+    ----------
+    observed : pandas Series or DataFrame
+        Observed yearly adoption with (Municipality, Year) as index, as read
+        from "SBP yearly adoption - Municipalities.csv" in the validation
+        notebook. A DataFrame has to have an "adoption_in_year" column
+    municipalities, years : list
+        Order of the rows and of the columns of the matrix
+
+    """
+    if isinstance(observed, pd.DataFrame):
+        observed = observed['adoption_in_year']
+    return (observed.unstack(level=-1)
+            .reindex(index=list(municipalities), columns=list(years))
+            .to_numpy(dtype=float))
+
+
+def _observed_vector(observed, years):
+    if isinstance(observed, pd.DataFrame):
+        observed = observed.iloc[:, 0]
+    return observed.reindex(list(years)).to_numpy(dtype=float)
+
+
+def _metrics_frames(per_run, average, results):
+    per_run = pd.DataFrame(per_run, index=results.run_names)
+    per_run.index.name = 'Run'
+    average = pd.Series({name: float(value)
+                         for name, value in average.items()})
+    summary = pd.DataFrame({'average prediction': average,
+                            'mean over runs': per_run.mean(),
+                            'std over runs': per_run.std(ddof=0)})
+    return per_run, summary.T
+
+
+def macro_validation(results, observed_port, first_year=None,
+                     last_year=LAST_VALIDATION_YEAR, n_features=N_FEATURES,
+                     n_observations=None):
+    """
+    Compare the yearly adoption of Portugal of all the runs with the observed
+    one, from first_year (the first simulated by default) to last_year.
+
+    Parameters
+    ----------
+    results : EnsembleResults
+        Outputs of the ensemble (see the ensemble module)
+    observed_port : pandas Series or DataFrame
+        Observed yearly adoption of Portugal in hectares, indexed by year (a
+        DataFrame is taken from its first column)
+    first_year, last_year : int
+        Years compared
+    n_features : int
+        Number of features for the adjusted R2
+    n_observations : int
+        Number of observations for the adjusted R2. The validation notebook
+        uses the number of municipality-years observed
+        (len(munic_yearly_adoption_av)). If None, the number of years
+        compared, for which the adjusted R2 is NaN if they are not more than
+        n_features + 1
+
+    Returns
+    -------
+    per_run : pandas DataFrame
+        Metrics of each run
+    summary : pandas DataFrame
+        Metrics of the average prediction, and mean and standard deviation
+        of the metrics of the runs
+
+    """
+    positions = _years_positions(results.years, first_year, last_year)
+    observed = _observed_vector(observed_port, results.years[positions])
+    predicted = results.yearly_adoption_port[:, positions]
+    per_run = regression_metrics(observed, predicted, -1, n_features,
+                                 n_observations)
+    average = regression_metrics(observed, predicted.mean(axis=0), -1,
+                                 n_features, n_observations)
+    return _metrics_frames(per_run, average, results)
+
+
+def micro_validation(results, observed_munic, first_year=None,
+                     last_year=LAST_VALIDATION_YEAR, n_features=N_FEATURES):
+    """
+    Compare the yearly adoption of the municipalities of all the runs with
+    the observed one, from first_year (the first simulated by default) to
+    last_year.
+
+    Parameters
+    ----------
+    results : EnsembleResults
+        Outputs of the ensemble (see the ensemble module)
+    observed_munic : pandas Series or DataFrame
+        Observed yearly adoption (see observed_matrix)
+    first_year, last_year : int
+        Years compared
+
+    Returns
+    -------
+    per_run : pandas DataFrame
+        Metrics of each run
+    summary : pandas DataFrame
+        Metrics of the average prediction, and mean and standard deviation
+        of the metrics of the runs
+
+    """
+    positions = _years_positions(results.years, first_year, last_year)
+    observed = observed_matrix(observed_munic, results.municipalities,
+                               results.years[positions])
+    predicted = results.munic_adoption[:, :, positions]
+    per_run = regression_metrics(observed, predicted, (-2, -1), n_features)
+    average = regression_metrics(observed, predicted.mean(axis=0), (-2, -1),
+                                 n_features)
+    return _metrics_frames(per_run, average, results)
+
+
+def yearly_micro_validation(results, observed_munic, first_year=None,
+                            last_year=LAST_VALIDATION_YEAR, per_run=False):
+    """
+    Calculate the RMSE and the relative RMSE of the yearly adoption of the
+    municipalities in each year and from first_year until each year (as
+    get_yearly_and_cumul_rmse in the validation notebook).
+
+    Parameters
+    ----------
+    results : EnsembleResults
+        Outputs of the ensemble (see the ensemble module)
+    observed_munic : pandas Series or DataFrame
+        Observed yearly adoption (see observed_matrix)
+    first_year, last_year : int
+        Years compared
+    per_run : bool
+        If False, the metrics of the average prediction are returned, with
+        the years as index. If True, the ones of each run, with (Run, Year)
+        as index
+
+    Returns
+    -------
+    pandas DataFrame
+        Columns "RMSE on year", "Relative RMSE on year", "RMSE till year" and
+        "Relative RMSE till year"
+
+    """
+    positions = _years_positions(results.years, first_year, last_year)
+    years = results.years[positions]
+    observed = observed_matrix(observed_munic, results.municipalities, years)
+    predicted = results.munic_adoption[:, :, positions]
+    if not per_run:
+        predicted = predicted.mean(axis=0)[None]
+
+    weights = ~np.isnan(observed)
+    observed = np.where(weights, observed, 0)
+    # (runs x years) sums of the squared errors of each year
+    sse = (np.where(weights, predicted - observed, 0) ** 2).sum(axis=-2)
+    n_obs = weights.sum(axis=0)
+
+    # Standard deviation of the observations of each year and of the ones
+    # until each year: (years x years) masks of the years included, to
+    # subtract from each observation the mean of its own window
+    till = np.tri(len(years), dtype=bool)
+    n_obs_till = till @ n_obs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_year = observed.sum(axis=0) / n_obs
+        mean_till = till @ observed.sum(axis=0) / n_obs_till
+        std_year = np.sqrt(
+            (np.where(weights, observed - mean_year, 0) ** 2).sum(axis=0)
+            / n_obs
+            )
+        ss_till = (np.where(weights[None], observed[None]
+                            - mean_till[:, None, None], 0) ** 2).sum(axis=1)
+        std_till = np.sqrt((ss_till * till).sum(axis=1) / n_obs_till)
+
+        rmse_year = np.sqrt(sse / n_obs)
+        rmse_till = np.sqrt(np.cumsum(sse, axis=-1) / n_obs_till)
+        metrics = {'RMSE on year': rmse_year,
+                   'Relative RMSE on year': rmse_year / std_year,
+                   'RMSE till year': rmse_till,
+                   'Relative RMSE till year': rmse_till / std_till}
+
+    if not per_run:
+        return pd.DataFrame({name: values[0]
+                             for name, values in metrics.items()},
+                            index=pd.Index(years, name='Year'))
+    index = pd.MultiIndex.from_product([results.run_names, years],
+                                       names=['Run', 'Year'])
+    return pd.DataFrame({name: values.ravel()
+                         for name, values in metrics.items()}, index=index)
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+import numpy as np
+
+from . import agents
+from . import input_data
+from .bundle import ScenarioBundle, load_bundle
+from .topology import GEO_CRS, Topology, load_topology
+from .ml_cache import (get_ml_model_key, load_fitted_ml_model,
+                       read_ml_features)
+from .model_inputs import clsf_folder_path, regr_folder_path
+from .policy_schedule import PolicySchedule
+
+
+def _read_only(array):
+    array = np.array(array)
+    array.setflags(write=False)
+    return array
+
+
+class World:
+    """
+    Static state of the SBP adoption model.
+
+    Holds everything that does not change during a simulation and that is
+    the same for every run: geometries and neighbours of the municipalities,
+    transformed census, climate and soil data, MunicipalityEnvironment
+    objects, historical adoption, fitted ML models and payments.
+    A World is built once and can be shared by any number of SBPAdoption
+    instances (see SBPAdoption.from_world), which then only allocate their
+    own adoption state. None of its data is modified by the models.
+    A headless World does not load the geometries at all: it can only be used
+    by models in headless mode.
+
+    Attributes
+    ----------
+    bundle : ScenarioBundle or None
+        Scenario bundle the data were loaded from, if any
+    headless : bool
+        True if the geometries were not loaded
+    names : tuple
+        Names of the municipalities. All the per-municipality data are in this
+        order
+    unique_ids : tuple
+        Unique identifier (CCA_2 code) of each municipality
+    attributes : dict
+        Maps each column of the shapefile (except the geometry and the unique
+        identifier) to the tuple of its values
+    geometries : tuple or None
+        Shapely geometries of the municipalities, in the CRS used by mesa_geo.
+        None if the World is headless
+    topology : Topology
+        Adjacency of the municipalities
+    neighbors : tuple
+        For each municipality, the array of the indexes of the touching ones
+    perm_pastures_ha : numpy array
+        Area of permanent pastures in hectares of each municipality
+    neighbors_perm_pastures_ha : numpy array
+        Sum of the permanent pastures area of the neighbours of each
+        municipality
+    neighbors_weights : scipy sparse CSR matrix
+        Adjacency normalized on the permanent pastures area of the neighbours:
+        its product with a vector of areas in hectares gives, for each
+        municipality, the sum of the areas of its neighbours divided by their
+        permanent pastures area. Rows of municipalities without neighbours are
+        empty
+    census_data : tuple
+        For each municipality, the dict of its transformed census features
+        (except the pastures area)
+    static_features : dict
+        Maps each transformed census, climate and soil feature (including
+        the pastures area) to the array of its values
+
+    adoption_data : pandas DataFrame
+        Historical yearly adoption of each municipality, divided by its
+        permanent pastures area, with the years as columns
+    adoption_years : numpy array
+        Years of the historical adoption
+    adoption_matrix : numpy array
+        (municipalities x adoption_years) matrix of the historical adoption
+    environments : dict
+        Maps each municipality name to its MunicipalityEnvironment
+    ml_clsf, ml_regr : sklearn estimators
+        Fitted classifier and regressor
+    ml_clsf_feats, ml_regr_feats : list
+        Names of the features of the classifier and of the regressor
+    sbp_payments : pandas DataFrame
+        Payment offered to adopt SBP for each year, as loaded (see the
+        policy_schedule module for the columns)
+    policy_schedule : PolicySchedule
+        Payment offered to each municipality in each year, as an array
+    sources : dict
+        Parameters the World was built with (ML folders, payments path and
+        bundle path), to build it again
+    fingerprint : str
+        SHA-256 digest of all the static data used by the models
+
+    """
+
+    def __init__(self,
+                 ml_clsf_folder=clsf_folder_path,
+                 ml_regr_folder=regr_folder_path,
+                 sbp_payments_path=None,
+                 bundle=None,
+                 headless=False,
+                 policy_schedule=None):
+        """
+        Parameters
+        ----------
+        ml_clsf_folder : path str
+            Path to the folder where the ML classifier model and the name of
+            its features are located
+        ml_regr_folder : path str
+            Path to the folder where the ML regressor model and the name of
+            its features are located
+        sbp_payments_path : path str
+            Path to the spreadsheed with the total payment in €/hectare
+            provided by the Portuguese Carbon Fund for each year. If None,
+            the payments of the bundle or, without a bundle, the default
+            spreadsheet are used
+        bundle : ScenarioBundle or path str
+            Scenario bundle from which all the input data are loaded instead
+            of the original files
+        headless : bool
+            If True, only the attribute table of the municipalities and their
+            precomputed adjacency (from the bundle or from the topology
+            cache) are loaded, without the geometries
+        policy_schedule : PolicySchedule
+            Payments of the municipalities, built from Python, replacing the
+            ones of sbp_payments_path or of the bundle. It is not recorded in
+            the sources of the World
+
+        """
+        if bundle is not None and not isinstance(bundle, ScenarioBundle):
+            bundle = load_bundle(bundle)
+        self._bundle = bundle
+        self._headless = headless
+        self._sources = {
+            'ml_clsf_folder': str(ml_clsf_folder),
+            'ml_regr_folder': str(ml_regr_folder),
+            'sbp_payments_path': (None if sbp_payments_path is None
+                                  else str(sbp_payments_path)),
+            'bundle': None if bundle is None else str(bundle.path)
+            }
+        self._fingerprint = None
+
+        self._load_municipalities()
+        self._load_municipalities_data()
+
+        self._ml_clsf = load_fitted_ml_model(ml_clsf_folder)
+        self._ml_clsf_feats = read_ml_features(ml_clsf_folder)
+        self._ml_regr = load_fitted_ml_model(ml_regr_folder)
+        self._ml_regr_feats = read_ml_features(ml_regr_folder)
+
+        if sbp_payments_path is not None:
+            self._sbp_payments = input_data.load_sbp_payments(
+                sbp_payments_path
+                )
+        elif bundle is not None:
+            self._sbp_payments = bundle.sbp_payments()
+        else:
+            self._sbp_payments = input_data.load_sbp_payments()
+        self._load_policy_schedule(policy_schedule)
+
+    @property
+    def bundle(self):
+        return self._bundle
+
+    @property
+    def headless(self):
+        return self._headless
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def unique_ids(self):
+        return self._unique_ids
+
+    @property
+    def attributes(self):
+        return self._attributes
+
+    @property
+    def geometries(self):
+        return self._geometries
+
+    @property
+    def topology(self):
+        return self._topology
+
+    @property
+    def neighbors(self):
+        return self._topology.neighbor_indices()
+
+    @property
+    def perm_pastures_ha(self):
+        return self._perm_pastures_ha
+
+    @property
+    def neighbors_perm_pastures_ha(self):
+        return self._neighbors_perm_pastures_ha
+
+    @property
+    def neighbors_weights(self):
+        return self._neighbors_weights
+
+    @property
+    def census_data(self):
+        return self._census_data
+
+    @property
+    def static_features(self):
+        return self._static_features
+
+    @property
+    def adoption_data(self):
+        return self._adoption_data
+
+    @property
+    def adoption_years(self):
+        return self._adoption_years
+
+    @property
+    def adoption_matrix(self):
+        return self._adoption_matrix
+
+    @property
+    def environments(self):
+        return self._environments
+
+    @property
+    def ml_clsf(self):
+        return self._ml_clsf
+
+    @property
+    def ml_clsf_feats(self):
+        return self._ml_clsf_feats
+
+    @property
+    def ml_regr(self):
+        return self._ml_regr
+
+    @property
+    def ml_regr_feats(self):
+        return self._ml_regr_feats
+
+    @property
+    def sbp_payments(self):
+        return self._sbp_payments
+
+    @property
+    def policy_schedule(self):
+        return self._policy_schedule
+
+    @property
+    def sources(self):
+        return self._sources
+
+    @property
+    def fingerprint(self):
+        """
+        SHA-256 digest of the names, adjacency, permanent pastures area,
+        historical adoption, static features and payments of the
+        municipalities and of the keys of the fitted estimators (see
+        ml_cache.get_ml_model_key), calculated at the first access. Two
+        Worlds with the same fingerprint give the same runs.
+
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            digest.update('\n'.join(self._names).encode('utf-8'))
+            arrays = [self._topology.indptr, self._topology.indices,
+                      self._perm_pastures_ha, self._adoption_years,
+                      self._adoption_matrix]
+            for feat in sorted(self._static_features):
+                digest.update(feat.encode('utf-8'))
+                arrays.append(self._static_features[feat])
+            for array in arrays:
+                digest.update(np.ascontiguousarray(array).tobytes())
+            digest.update(self._sbp_payments.to_csv().encode('utf-8'))
+            for feats in (self._ml_clsf_feats, self._ml_regr_feats):
+                digest.update('\n'.join(feats).encode('utf-8'))
+            for folder in (self._sources['ml_clsf_folder'],
+                           self._sources['ml_regr_folder']):
+                digest.update(get_ml_model_key(folder).encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def __len__(self):
+        return len(self._names)
+
+    def _load_municipalities(self):
+        """
+        Called by the __init__ method.
+
+        Load geometries (unless headless) and attributes of the municipalities
+        and find the touching neighbours of each one (cached, see the topology
+        module).
+
+        """
+        if self._bundle is None:
+            municipalities_data = input_data.load_municipalities_shapefile(
+                geometry=not self._headless
+                )
+            if self._headless:
+                geometries = None
+                self._topology = load_topology()
+            else:
+                geometries = municipalities_data.geometry.to_crs(GEO_CRS)
+                self._topology = load_topology(geometries=geometries)
+                municipalities_data = municipalities_data.drop(
+                    columns=municipalities_data.geometry.name
+                    )
+            attributes = {col: municipalities_data[col].tolist()
+                          for col in municipalities_data.columns}
+            unique_ids = attributes.pop('CCA_2')
+        else:
+            geometries = (None if self._headless
+                          else self._bundle.geometries())
+            self._topology = Topology(
+                self._bundle.arrays['adjacency_indptr'],
+                self._bundle.arrays['adjacency_indices']
+                )
+            attributes = self._bundle.attributes
+            unique_ids = self._bundle.unique_ids
+
+        self._unique_ids = tuple(unique_ids)
+        self._attributes = {col: tuple(values)
+                            for col, values in attributes.items()}
+        self._names = self._attributes['Municipality']
+        self._geometries = (None if geometries is None
+                            else tuple(geometries))
+
+    def _load_policy_schedule(self, policy_schedule):
+        """
+        Called by the __init__ method.
+
+        Build the PolicySchedule of the payments loaded, with the districts
+        of the municipalities for the district columns, or check the one
+        given and use its payments as sbp_payments.
+
+        """
+        if policy_schedule is None:
+            self._policy_schedule = PolicySchedule.from_frame(
+                self._sbp_payments, self._names,
+                self._attributes.get('District')
+                )
+            return
+        if policy_schedule.municipalities != self._names:
+            raise ValueError('The policy schedule is not aligned on the '
+                             'municipalities of the World.')
+        self._policy_schedule = policy_schedule
+        self._sbp_payments = policy_schedule.to_frame()
+
+    def _load_municipalities_data(self):
+        """
+        Called by the __init__ method.
+
+        Join census, adoption, climate and soil data on the names of the
+        municipalities, checking in a single pass that none of them is
+        missing, and set:
+            - the permanent pastures area of each municipality and of its
+              neighbours, and the adjacency normalized on the latter
+            - the census features of each municipality
+            - the arrays of the static features of the ML estimators
+            - the historical adoption, as DataFrame and as matrix
+            - the MunicipalityEnvironment of each municipality
+
+        """
+        if self._bundle is None:
+            datasets = {
+                'Census': input_data.load_census_data(),
+                'Adoption': input_data.load_adoption_data(),
+                'Average climate': input_data.load_climate_data(),
+                'Soil': input_data.load_soil_data()
+                }
+        else:
+            datasets = {
+                'Census': self._bundle.census_data(),
+                'Adoption': self._bundle.adoption_data(),
+                'Average climate': self._bundle.climate_data(),
+                'Soil': self._bundle.soil_data()
+                }
+        data = input_data.join_on_municipalities(datasets, self._names)
+
+        census_data_tr = data['Census']
+        perm_pastures_ha = census_data_tr['pastures_area_munic'].to_numpy(
+            dtype=float
+            )
+        self._perm_pastures_ha = _read_only(perm_pastures_ha)
+        self._neighbors_perm_pastures_ha = _read_only(
+            self._topology.adjacency @ perm_pastures_ha
+            )
+        has_neighbors = self._neighbors_perm_pastures_ha > 0
+        inv_neighbors_perm_pastures_ha = np.zeros(len(perm_pastures_ha))
+        inv_neighbors_perm_pastures_ha[has_neighbors] = (
+            1 / self._neighbors_perm_pastures_ha[has_neighbors]
+            )
+        self._neighbors_weights = self._topology.weighted_adjacency(
+            inv_neighbors_perm_pastures_ha
+            )
+        self._census_data = tuple(
+            census_data_tr.drop('pastures_area_munic', axis=1).to_dict(
+                'records'
+                )
+            )
+
+        adoption_data = data['Adoption']
+        adoption_data.columns = adoption_data.columns.astype(int)
+        self._adoption_data = adoption_data
+        self._adoption_years = _read_only(adoption_data.columns.to_numpy())
+        self._adoption_matrix = _read_only(
+            adoption_data.to_numpy(dtype=float)
+            )
+
+        average_climate_data_tr = data['Average climate']
+        soil_data_tr = data['Soil']
+        self._static_features = {
+            feat: _read_only(dataset[feat].to_numpy(dtype=float))
+            for dataset in (census_data_tr, average_climate_data_tr,
+                            soil_data_tr)
+            for feat in dataset.columns
+            }
+        self._environments = {
+            munic_name: agents.MunicipalityEnvironment(
+                average_climate_data_tr.iloc[i], soil_data_tr.iloc[i]
+                )
+            for i, munic_name in enumerate(self._names)
+            }